@@ -0,0 +1,236 @@
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional, Tuple
+
+from loguru import logger
+
+from rule_parser import parse_with_rules
+
+# Canned Whisper results, picked by a hash of the uploaded bytes so the same audio always gets the same text
+TRANSCRIPTS = [
+    "I ran for 30 minutes and ate 2 bananas.",
+    "Had a bowl of oatmeal with 1 cup milk, then walked for 20 minutes.",
+    "Lunch was 1 serving rice and 150 g chicken breast.",
+    "Easy cycling for 45 minutes this morning.",
+    "Ate 2 slices pizza and a protein bar.",
+]
+
+
+def _parse_reply(transcript: str) -> Dict[str, Any]:
+    return parse_with_rules(transcript)[0]
+
+
+def chat_completion(body: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON-mode answer in the shape parse_with_llm / the batched parse expect."""
+    messages = body.get("messages") or []
+    user = next((m.get("content") or "" for m in messages if m.get("role") == "user"), "")
+    if user.startswith("Transcript: "):
+        content = _parse_reply(user[len("Transcript: "):])
+    else:
+        try:
+            batch = json.loads(user)
+        except ValueError:
+            batch = None
+        if isinstance(batch, dict):
+            content = {log_id: _parse_reply(str(text)) for log_id, text in batch.items()}
+        else:
+            content = _parse_reply(user)
+    text = json.dumps(content)
+    prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(text) // 4,
+                  "total_tokens": prompt_tokens + len(text) // 4},
+    }
+
+
+def transcription(upload: bytes) -> Dict[str, Any]:
+    digest = hashlib.sha256(upload).digest()
+    text = TRANSCRIPTS[digest[0] % len(TRANSCRIPTS)]
+    return {"text": text, "language": "english", "duration": 0.0, "segments": []}
+
+
+# Query parts naming this word are not recognised, like foods Nutritionix has never heard of
+NO_MATCH_WORD = "unmatchable"
+
+
+def nutrients(body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Nutritionix natural/nutrients answer: one food per " and "-separated
+    query part. None (the real API's 404) when no part could be matched.
+    """
+    foods = []
+    for part in (body.get("query") or "").split(" and "):
+        words = part.split()
+        if not words or NO_MATCH_WORD in words:
+            continue
+        try:
+            qty = float(words[0])
+        except ValueError:
+            qty = 1.0
+        seed = int(hashlib.md5(words[-1].encode("utf-8")).hexdigest()[:6], 16)
+        foods.append({
+            "food_name": words[-1],
+            "serving_qty": qty,
+            "nf_calories": round(qty * (50 + seed % 250), 1),
+            "nf_total_carbohydrate": round(qty * (seed % 40), 1),
+            "nf_protein": round(qty * (seed % 17), 1),
+            "nf_total_fat": round(qty * (seed % 13), 1),
+            "nf_dietary_fiber": round(qty * (seed % 5), 1),
+            "nf_sugars": round(qty * (seed % 11), 1),
+            "nf_sodium": round(qty * (seed % 300), 1),
+            "tag_id": str(seed),
+        })
+    return {"foods": foods} if foods else None
+
+
+class StubServer:
+    """
+    Local stand-in for the OpenAI chat/transcription and Nutritionix
+    endpoints, for offline benchmarks.
+
+    Every request sleeps `latency_ms` (+ up to `jitter_ms`) before answering,
+    and `error_rate` of them get a 503 so retry paths are exercised;
+    fail_next() scripts exact failures (429/5xx, optional Retry-After). Point
+    the pipeline at it with env(): OPENAI_BASE_URL and NUTRITIONIX_BASE_URL
+    (both read when the clients are created).
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0,
+                 jitter_ms: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.requests: Dict[str, int] = {}
+        self._scripted: List[Tuple[int, Optional[float]]] = []
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self) -> Dict[str, str]:
+        return {
+            "OPENAI_BASE_URL": f"{self.url}/v1",
+            "NUTRITIONIX_BASE_URL": f"{self.url}/v2/natural/nutrients",
+        }
+
+    def fail_next(self, *statuses: int, retry_after: Optional[float] = None):
+        """Answer the next requests with these statuses, in order, then serve normally."""
+        with self._lock:
+            self._scripted.extend((status, retry_after) for status in statuses)
+
+    def _delay_and_fail(self, route: str) -> Optional[Tuple[int, Optional[float]]]:
+        """(status, Retry-After) of an injected failure for this request, or None."""
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+            delay = self.latency_ms + self._rng.uniform(0, self.jitter_ms)
+            if self._scripted:
+                fail = self._scripted.pop(0)
+            else:
+                fail = (503, None) if self._rng.random() < self.error_rate else None
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        return fail
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, status: int, payload: Dict[str, Any], retry_after: Optional[float] = None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                if retry_after is not None:
+                    self.send_header("Retry-After", f"{retry_after:g}")
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                path = self.path.split("?")[0].rstrip("/")
+                if path.endswith("/chat/completions"):
+                    route = "chat"
+                elif path.endswith("/audio/transcriptions"):
+                    route = "transcriptions"
+                elif path.endswith("/natural/nutrients"):
+                    route = "nutrients"
+                else:
+                    self._send(404, {"error": f"no stub for {path}"})
+                    return
+                fail = stub._delay_and_fail(route)
+                if fail is not None:
+                    self._send(fail[0], {"error": "stub: injected failure"}, retry_after=fail[1])
+                    return
+                if route == "chat":
+                    self._send(200, chat_completion(json.loads(raw or b"{}")))
+                elif route == "transcriptions":
+                    self._send(200, transcription(raw))
+                else:
+                    answer = nutrients(json.loads(raw or b"{}"))
+                    if answer is None:
+                        self._send(404, {"message": "We couldn't match any of your foods"})
+                    else:
+                        self._send(200, answer)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Serve stand-ins for the OpenAI and Nutritionix APIs")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8799)
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="Added delay per request")
+    ap.add_argument("--jitter-ms", type=float, default=0.0, help="Random extra delay, up to this much")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    args = ap.parse_args()
+
+    stub = StubServer(args.host, args.port, args.latency_ms, args.jitter_ms, args.error_rate)
+    for key, value in stub.env().items():
+        logger.info(f"export {key}={value}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.server.server_close()
+        logger.info(f"Stub: served {stub.requests}")
+
+
+if __name__ == "__main__":
+    main()
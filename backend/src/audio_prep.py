@@ -0,0 +1,279 @@
+import io
+import os
+import shutil
+import wave
+import subprocess
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+TARGET_RATE = 16000
+# Long-audio chunking: target chunk length, how far to look for a quiet cut, overlap between chunks
+CHUNK_S = 30.0
+CUT_SEARCH_S = 5.0
+OVERLAP_S = 1.0
+# Frames quieter than this (dB below the loudest frame) count as silence
+SILENCE_DB = 40.0
+FRAME_MS = 20
+# Kept on each side of the detected speech so word onsets aren't clipped
+PAD_MS = 200
+# Optional compact encoding via ffmpeg ("flac", "ogg", "mp3"); empty keeps 16-bit WAV
+COMPACT_FORMAT = os.getenv("AUDIO_COMPACT_FORMAT", "")
+
+# Containers Whisper accepts as-is; anything else that isn't a RIFF/WAVE file or
+# a bare MPEG audio stream is rejected
+PASSTHROUGH_MAGIC = {
+    b"ID3": "mp3",
+    b"fLaC": "flac",
+    b"OggS": "ogg",
+    b"\x1a\x45\xdf\xa3": "webm",
+}
+_FFMPEG_ARGS = {
+    "flac": ["-c:a", "flac", "-f", "flac"],
+    "ogg": ["-c:a", "libopus", "-b:a", "24k", "-f", "ogg"],
+    "mp3": ["-c:a", "libmp3lame", "-b:a", "32k", "-f", "mp3"],
+}
+
+
+class AudioError(ValueError):
+    """Upload is empty, truncated or not a recognised audio container."""
+
+
+class UnsupportedWav(AudioError):
+    """Well-formed WAV in an encoding read_wav doesn't decode (IEEE float, WAVE_FORMAT_EXTENSIBLE)."""
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+    if head[4:8] == b"ftyp":
+        return "m4a"
+    for magic, fmt in PASSTHROUGH_MAGIC.items():
+        if head.startswith(magic):
+            return fmt
+    # MPEG audio frame sync (11 set bits) without an ID3 tag, any version/layer/CRC flag
+    if len(head) >= 2 and head[0] == 0xFF and (head[1] & 0xE0) == 0xE0:
+        return "mp3"
+    return None
+
+
+def _wav_has_audio(data: bytes) -> bool:
+    """True when the RIFF chunks hold a complete "fmt " chunk and a non-empty "data" chunk."""
+    pos, has_fmt = 12, False
+    while pos + 8 <= len(data):
+        chunk_id, size = data[pos:pos + 4], int.from_bytes(data[pos + 4:pos + 8], "little")
+        if chunk_id == b"fmt ":
+            has_fmt = size >= 16 and pos + 8 + size <= len(data)
+        elif chunk_id == b"data":
+            return has_fmt and size > 0 and pos + 8 < len(data)
+        pos += 8 + size + (size & 1)
+    return False
+
+
+def read_wav(data: bytes) -> Tuple[np.ndarray, int]:
+    """Decode PCM WAV bytes to a float32 (frames, channels) array in [-1, 1] and its sample rate."""
+    try:
+        with wave.open(io.BytesIO(data), "rb") as w:
+            channels, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+            raw = w.readframes(w.getnframes())
+    except (wave.Error, EOFError) as e:
+        if _wav_has_audio(data):
+            raise UnsupportedWav(f"WAV encoding not decoded here: {e}") from e
+        raise AudioError(f"corrupt WAV header: {e}") from e
+    if not raw:
+        raise AudioError("WAV contains no audio frames")
+    usable = len(raw) - len(raw) % (width * channels)
+    raw = raw[:usable]
+    if width == 1:
+        x = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        x = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    elif width == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        x = (np.where(ints >= 1 << 23, ints - (1 << 24), ints) / float(1 << 23)).astype(np.float32)
+    elif width == 4:
+        x = (np.frombuffer(raw, dtype="<i4") / float(1 << 31)).astype(np.float32)
+    else:
+        raise UnsupportedWav(f"unsupported sample width: {width} bytes")
+    return x.reshape(-1, channels), rate
+
+
+def to_mono(x: np.ndarray) -> np.ndarray:
+    return x.mean(axis=1) if x.ndim == 2 else x
+
+
+def resample(x: np.ndarray, src_rate: int, dst_rate: int = TARGET_RATE) -> np.ndarray:
+    """Linear-interpolation resample; a moving-average low-pass first when downsampling."""
+    if src_rate == dst_rate or len(x) == 0:
+        return x
+    if src_rate > dst_rate:
+        k = int(np.ceil(src_rate / dst_rate))
+        if k > 1:
+            x = np.convolve(x, np.full(k, 1.0 / k, dtype=np.float32), mode="same")
+    n_out = max(1, int(round(len(x) * dst_rate / src_rate)))
+    t_out = np.arange(n_out, dtype=np.float64) * (src_rate / dst_rate)
+    return np.interp(t_out, np.arange(len(x)), x).astype(np.float32)
+
+
+def frame_energy_db(x: np.ndarray, rate: int, frame_ms: int = FRAME_MS) -> np.ndarray:
+    """RMS level of consecutive frames in dB relative to full scale."""
+    hop = max(1, rate * frame_ms // 1000)
+    n = len(x) // hop
+    if n == 0:
+        return np.full(1, 20 * np.log10(np.sqrt(np.mean(x ** 2)) + 1e-10))
+    frames = x[:n * hop].reshape(n, hop)
+    return 20 * np.log10(np.sqrt(np.mean(frames ** 2, axis=1)) + 1e-10)
+
+
+def trim_silence(x: np.ndarray, rate: int, silence_db: float = SILENCE_DB,
+                 frame_ms: int = FRAME_MS, pad_ms: int = PAD_MS) -> np.ndarray:
+    """Drop leading/trailing frames more than `silence_db` below the loudest frame."""
+    db = frame_energy_db(x, rate, frame_ms)
+    loud = np.flatnonzero(db > max(db.max() - silence_db, -80.0))
+    if loud.size == 0:
+        return x[:0]
+    hop = max(1, rate * frame_ms // 1000)
+    pad = rate * pad_ms // 1000
+    start = max(0, loud[0] * hop - pad)
+    end = min(len(x), (loud[-1] + 1) * hop + pad)
+    return x[start:end]
+
+
+def encode_wav(x: np.ndarray, rate: int) -> bytes:
+    pcm = (np.clip(x, -1.0, 1.0) * 32767.0).astype("<i2")
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+
+def encode_compact(wav_bytes: bytes, fmt: str) -> Optional[bytes]:
+    """Re-encode WAV bytes with ffmpeg; None when ffmpeg is missing or fails."""
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg or fmt not in _FFMPEG_ARGS:
+        return None
+    cmd = [ffmpeg, "-hide_banner", "-loglevel", "error", "-i", "pipe:0", *_FFMPEG_ARGS[fmt], "pipe:1"]
+    try:
+        proc = subprocess.run(cmd, input=wav_bytes, capture_output=True, timeout=60, check=True)
+    except (subprocess.SubprocessError, OSError) as e:
+        logger.debug(f"ffmpeg {fmt} encode failed, sending WAV: {e}")
+        return None
+    return proc.stdout or None
+
+
+def split_at_silence(x: np.ndarray, rate: int, chunk_s: float = CHUNK_S, search_s: float = CUT_SEARCH_S,
+                     overlap_s: float = OVERLAP_S, frame_ms: int = FRAME_MS) -> List[Tuple[int, int]]:
+    """
+    Sample ranges of roughly `chunk_s` seconds covering `x`.
+
+    Each cut is placed at the quietest frame within `search_s` before the
+    nominal boundary, so words are rarely split; neighbouring ranges then
+    overlap by `overlap_s` on each side so a clipped word still appears whole
+    in one of them.
+    """
+    hop = max(1, rate * frame_ms // 1000)
+    db = frame_energy_db(x, rate, frame_ms)
+    chunk, search, overlap = int(chunk_s * rate), int(search_s * rate), int(overlap_s * rate)
+    cuts = [0]
+    while len(x) - cuts[-1] > chunk + search:
+        nominal = cuts[-1] + chunk
+        lo, hi = max(cuts[-1] + hop, nominal - search) // hop, nominal // hop
+        quiet = lo + int(np.argmin(db[lo:hi + 1])) if hi >= lo else hi
+        cuts.append(quiet * hop)
+    cuts.append(len(x))
+    return [(max(0, a - overlap), min(len(x), b + overlap)) for a, b in zip(cuts, cuts[1:])]
+
+
+def _read_upload(audio_path: str) -> Tuple[bytes, str]:
+    with open(audio_path, "rb") as f:
+        data = f.read()
+    fmt = sniff_format(data[:12])
+    if fmt is None:
+        raise AudioError(f"{audio_path}: unrecognised audio container ({len(data)} bytes)")
+    return data, fmt
+
+
+def _decode_mono(audio_path: str, data: bytes, target_rate: int) -> Optional[np.ndarray]:
+    """Mono samples at `target_rate`; None for a WAV Whisper can read but read_wav can't."""
+    try:
+        x, rate = read_wav(data)
+    except UnsupportedWav as e:
+        logger.debug(f"{audio_path}: {e}; uploading it unchanged")
+        return None
+    except AudioError as e:
+        raise AudioError(f"{audio_path}: {e}") from e
+    return resample(to_mono(x), rate, target_rate)
+
+
+def load_mono(audio_path: str, target_rate: int = TARGET_RATE, trim: bool = True) -> Optional[np.ndarray]:
+    """Mono float32 samples at `target_rate`, or None for uploads we pass through undecoded."""
+    data, fmt = _read_upload(audio_path)
+    if fmt != "wav":
+        return None
+    x = _decode_mono(audio_path, data, target_rate)
+    if x is None:
+        return None
+    return trim_silence(x, target_rate) if trim else x
+
+
+def decode_upload(audio_path: str, target_rate: int = TARGET_RATE,
+                  trim: bool = True) -> Tuple[bytes, Optional[np.ndarray], Dict[str, Any]]:
+    """
+    Read an upload once: (raw bytes, mono samples at `target_rate` or None
+    for uploads passed through undecoded, stats). Samples are trimmed of
+    leading/trailing silence when `trim` is set.
+    """
+    data, fmt = _read_upload(audio_path)
+    stats: Dict[str, Any] = {"format": fmt, "original_bytes": len(data), "bytes": len(data)}
+    if fmt != "wav":
+        return data, None, stats
+    x = _decode_mono(audio_path, data, target_rate)
+    if x is None:
+        return data, None, stats
+    stats["duration_s"] = round(len(x) / target_rate, 3)
+    if trim:
+        x = trim_silence(x, target_rate)
+    stats["trimmed_s"] = round(stats["duration_s"] - len(x) / target_rate, 3)
+    return data, x, stats
+
+
+def encode_upload(audio_path: str, x: np.ndarray, stats: Dict[str, Any], target_rate: int = TARGET_RATE,
+                  compact: Optional[str] = None) -> Tuple[bytes, str]:
+    """Decoded samples -> (upload bytes, file name); raises AudioError when they are silent."""
+    if len(x) == 0 or not np.any(np.abs(x) > 1e-4):
+        raise AudioError(f"{audio_path}: audio is silent")
+    base = os.path.splitext(os.path.basename(audio_path))[0]
+    out, name = encode_wav(x, target_rate), f"{base}.wav"
+    compact = COMPACT_FORMAT if compact is None else compact
+    if compact:
+        encoded = encode_compact(out, compact)
+        if encoded is not None and len(encoded) < len(out):
+            out, name = encoded, f"{base}.{compact}"
+    stats["bytes"] = len(out)
+    return out, name
+
+
+def preprocess_audio(audio_path: str, target_rate: int = TARGET_RATE, trim: bool = True,
+                     compact: Optional[str] = None) -> Tuple[bytes, str, Dict[str, Any]]:
+    """
+    Validate and shrink an upload before transcription.
+
+    WAV input is downmixed to mono, resampled to `target_rate`, trimmed of
+    leading/trailing silence and re-encoded as 16-bit PCM (or `compact`, e.g.
+    "flac", when ffmpeg is available). Other containers Whisper understands,
+    and WAV encodings read_wav doesn't decode (IEEE float, extensible), are
+    passed through untouched. Raises AudioError for empty, corrupt or
+    all-silent audio so no API call is spent on it.
+    Returns (bytes, upload file name, stats).
+    """
+    data, x, stats = decode_upload(audio_path, target_rate, trim)
+    if x is None:
+        base = os.path.splitext(os.path.basename(audio_path))[0]
+        return data, f"{base}.{stats['format']}", stats
+    out, name = encode_upload(audio_path, x, stats, target_rate, compact)
+    return out, name, stats
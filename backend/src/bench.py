@@ -0,0 +1,278 @@
+import os
+import sys
+import json
+import time
+import random
+import platform
+import atexit
+import shutil
+import argparse
+import tempfile
+import itertools
+import subprocess
+from datetime import datetime, timezone
+from typing import Callable, Dict, Any, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+# classifier builds its OpenAI client at import; nothing in-process here calls the API
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+
+import bench_data
+from api_stubs import StubServer
+from calculator import _best_food_match, calculate_exercise_calories, enrich_payload
+from logindex import LogIndex
+from nutrition_db import LocalNutritionDB
+from payload import pick_latest_log
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = (1000, 10000)
+
+# name -> setup(n, seed) returning (callable run once per repeat, ops per run)
+Setup = Callable[[int, int], Tuple[Callable[[], Any], int]]
+BENCHMARKS: Dict[str, Setup] = {}
+
+
+def benchmark(name: str):
+    def register(setup: Setup) -> Setup:
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def time_call(fn: Callable[[], Any], repeat: int) -> List[float]:
+    fn()  # warm-up: imports, lazy tables, caches
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+# --- Micro-benchmarks ----------------------------------------------------
+
+def _log_file(n: int, seed: int) -> Tuple[str, Iterator[Tuple[str, Dict[str, Any]]]]:
+    """log.json with n synthetic logs in a temp dir kept until exit, plus an iterator of later logs."""
+    tmp = tempfile.mkdtemp(prefix="bench-logs-")
+    atexit.register(shutil.rmtree, tmp, True)
+    path = os.path.join(tmp, "log.json")
+    logs = bench_data.iter_logs(n + 1_000_000, seed=seed)
+    bench_data.write_json_dict(path, itertools.islice(logs, n))
+    return path, logs
+
+
+def _append_log(path: str, log_id: str, record: Dict[str, Any]):
+    """Add one log at the end of log.json the way the API's rewrite leaves it (new key last)."""
+    with open(path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(("," + json.dumps(log_id) + ": " + json.dumps(record) + "}").encode("utf-8"))
+
+
+@benchmark("pick_latest_log")
+def _pick_latest(n: int, seed: int):
+    path, _ = _log_file(n, seed)
+
+    def run():
+        with open(path, "r", encoding="utf-8") as f:
+            return pick_latest_log(json.load(f))
+
+    # One op = one latest-log selection from log.json on disk, as in pick_latest_log[index]
+    return run, 1
+
+
+@benchmark("pick_latest_log[index]")
+def _pick_latest_index(n: int, seed: int):
+    path, later = _log_file(n, seed)
+    # Built once, as by an earlier run
+    build = LogIndex(path)
+    build.refresh()
+    build.save()
+
+    def run():
+        # What payload.py --log-index does after the API added one log: load, refresh, save, read the pick
+        _append_log(path, *next(later))
+        index = LogIndex(path)
+        index.refresh()
+        index.save()
+        latest = index.latest()
+        return pick_latest_log(index.load_records([latest]), index)
+
+    return run, 1
+
+
+@benchmark("enrich_payload")
+def _enrich(n: int, seed: int):
+    rng = random.Random(seed)
+    payloads = [bench_data.make_payload(rng, str(i), "u", "2025-01-01T00:00:00Z", enriched=False) for i in range(n)]
+    profile = {"weight": 72}
+    local_db = LocalNutritionDB.load()
+    return (lambda: [enrich_payload(p, profile, None, local_db) for p in payloads]), n
+
+
+@benchmark("calculate_exercise_calories")
+def _exercise(n: int, seed: int):
+    rng = random.Random(seed)
+    batches = [[bench_data.random_exercise(rng) for _ in range(rng.randint(1, 3))] for _ in range(n)]
+    profile = {"weight": 72}
+    return (lambda: [calculate_exercise_calories(items, profile) for items in batches]), n
+
+
+@benchmark("_best_food_match")
+def _food_match(n: int, seed: int):
+    rng = random.Random(seed)
+    cases = []
+    for _ in range(n):
+        item = bench_data.random_food(rng)
+        names = [bench_data.random_food(rng)["name"] for _ in range(rng.randint(2, 6))] + [item["name"]]
+        rng.shuffle(names)
+        cases.append((item, [{"food_name": name, "tag_id": str(i)} for i, name in enumerate(names)]))
+    return (lambda: [_best_food_match(item, foods) for item, foods in cases]), n
+
+
+# --- End to end ----------------------------------------------------------
+
+def run_batch_e2e(records: int, latency_ms: float, seed: int, workers: int = 8, voice_ratio: float = 0.1,
+                  extra_args: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    `payload.py --batch` over a fresh synthetic dataset against the local
+    stubs, in a subprocess with its own cache directory so nothing is warm.
+    Returns wall time plus the run's exported stage/API metrics.
+    """
+    with tempfile.TemporaryDirectory(prefix="bench-") as tmp, \
+            StubServer(latency_ms=latency_ms, jitter_ms=latency_ms / 4, seed=seed) as stub:
+        paths = bench_data.write_dataset(os.path.join(tmp, "data"), records, users=max(1, records // 20),
+                                         voice_ratio=voice_ratio, seed=seed)
+        metrics_path = os.path.join(tmp, "metrics.json")
+        env = {
+            **os.environ, **stub.env(),
+            "OPENAI_API_KEY": "stub", "NUTRITIONIX_APP_ID": "stub", "NUTRITIONIX_APP_KEY": "stub",
+            "PIPELINE_CACHE_DIR": os.path.join(tmp, "cache"),
+        }
+        for key in ("PARSE_CACHE_PATH", "TRANSCRIPT_CACHE_PATH"):
+            env.pop(key, None)
+        cmd = [
+            sys.executable, os.path.join(SRC_DIR, "payload.py"), "--batch",
+            "--logs", paths["logs"], "--profiles", paths["profiles"], "--uploads-dir", paths["uploads_dir"],
+            "--output_log", paths["output_log"], "--workers", str(workers), "--metrics-out", metrics_path,
+            *(extra_args or []),
+        ]
+        start = time.perf_counter()
+        proc = subprocess.run(cmd, env=env, cwd=SRC_DIR, capture_output=True, text=True)
+        elapsed = time.perf_counter() - start
+        if proc.returncode != 0:
+            raise RuntimeError(f"payload.py failed ({proc.returncode}):\n{proc.stderr[-2000:]}")
+        with open(paths["output_log"], "r", encoding="utf-8") as f:
+            done = len(json.load(f))
+        with open(metrics_path, "r", encoding="utf-8") as f:
+            metrics = json.load(f)
+    return {"seconds": elapsed, "done": done, "stub_requests": stub.requests, "metrics": metrics}
+
+
+# --- Reporting -----------------------------------------------------------
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SRC_DIR, capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def result_row(name: str, n: int, ops: int, times: List[float], **extra: Any) -> Dict[str, Any]:
+    best = min(times)
+    return {
+        "benchmark": name,
+        "n": n,
+        "repeat": len(times),
+        "best_s": round(best, 6),
+        "mean_s": round(sum(times) / len(times), 6),
+        "per_op_us": round(best * 1e6 / ops, 3) if ops else None,
+        "ops_per_s": round(ops / best, 1) if best > 0 else None,
+        **extra,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Lines describing each benchmark's change vs `baseline`; regressions beyond `threshold` are flagged."""
+    old = {(r["benchmark"], r["n"]): r for r in baseline.get("results", [])}
+    lines = []
+    for r in current["results"]:
+        base = old.get((r["benchmark"], r["n"]))
+        if base is None or not base.get("best_s"):
+            continue
+        ratio = r["best_s"] / base["best_s"]
+        flag = "  REGRESSION" if ratio > 1 + threshold else ""
+        lines.append(f"{r['benchmark']:<30} n={r['n']:<8} {base['best_s']:.4f}s -> {r['best_s']:.4f}s ({ratio:.2f}x){flag}")
+    return lines
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Offline pipeline benchmarks (synthetic data, local API stubs)")
+    ap.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                    help="Comma-separated record counts for the micro-benchmarks (e.g. 1000,100000,1000000)")
+    ap.add_argument("--only", action="append", default=[], help=f"Run only these benchmarks ({', '.join(BENCHMARKS)}, batch)")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--e2e-records", type=int, default=500, help="Logs in the end-to-end batch run (0 skips it)")
+    ap.add_argument("--latency-ms", type=float, default=20.0, help="Stub API latency for the batch run")
+    ap.add_argument("--workers", type=int, default=8, help="payload.py --workers for the batch run")
+    ap.add_argument("--out", help="Write results JSON here (default: stdout)")
+    ap.add_argument("--compare", help="Earlier results JSON to compare against")
+    ap.add_argument("--threshold", type=float, default=0.10, help="Slowdown counted as a regression with --compare")
+    args = ap.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    selected = set(args.only) or set(BENCHMARKS) | {"batch"}
+    unknown = selected - set(BENCHMARKS) - {"batch"}
+    if unknown:
+        ap.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results: List[Dict[str, Any]] = []
+    for name, setup in BENCHMARKS.items():
+        if name not in selected:
+            continue
+        for n in sizes:
+            fn, ops = setup(n, args.seed)
+            row = result_row(name, n, ops, time_call(fn, args.repeat))
+            logger.info(f"{name} n={n}: best {row['best_s']:.4f}s ({row['per_op_us']} us/op)")
+            results.append(row)
+
+    if "batch" in selected and args.e2e_records:
+        run = run_batch_e2e(args.e2e_records, args.latency_ms, args.seed, workers=args.workers)
+        stages = {k: v["total_s"] for k, v in run["metrics"]["stages"].items()}
+        row = result_row("batch", args.e2e_records, run["done"], [run["seconds"]],
+                         latency_ms=args.latency_ms, done=run["done"], stages=stages,
+                         stub_requests=run["stub_requests"], counters=run["metrics"]["counters"])
+        logger.info(f"batch n={args.e2e_records}: {run['seconds']:.2f}s, {run['done']} done, stages {stages}")
+        results.append(row)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            lines = compare(report, json.load(f), args.threshold)
+        for line in lines:
+            logger.info(line)
+        if any(line.endswith("REGRESSION") for line in lines):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+import os
+import json
+import uuid
+import random
+import argparse
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from audio_prep import TARGET_RATE, encode_wav
+from calculator import BASE_MET, EFFORT_MULT
+from nutrition_db import DEFAULT_TABLE
+
+# Foods the bundled table knows, plus a few it doesn't (Nutritionix / LLM paths)
+with open(DEFAULT_TABLE, "r", encoding="utf-8") as _f:
+    KNOWN_FOODS = [row["name"] for row in json.load(_f)]
+UNKNOWN_FOODS = ["dragonfruit smoothie", "pad see ew", "protein bar", "masala dosa", "poke bowl"]
+UNITS = ["count", "count", "cup", "g", "slice", "serving", "bowl"]
+ACTIVITIES = list(BASE_MET) + ["dancing", "climbing"]
+EFFORTS = list(EFFORT_MULT)
+# Free-form notes the rule parser can't handle, so they go to the LLM
+NOTES = [
+    "Started my new fitness routine today! Feeling motivated.",
+    "Skipped breakfast, grabbed something quick from the cafe near work",
+    "Long day, mostly snacks and a late takeaway dinner",
+    "Rest day, stretched a bit in the evening",
+]
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def _uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def _iso(dt: datetime, millis: bool = True) -> str:
+    if millis:
+        return dt.strftime("%Y-%m-%dT%H:%M:%S.") + f"{dt.microsecond // 1000:03d}Z"
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def user_ids(users: int) -> List[str]:
+    return [f"user_{i:05d}" for i in range(users)]
+
+
+def random_food(rng: random.Random, unknown_ratio: float = 0.1) -> Dict[str, Any]:
+    name = rng.choice(UNKNOWN_FOODS if rng.random() < unknown_ratio else KNOWN_FOODS)
+    unit = rng.choice(UNITS)
+    quantity = float(rng.randint(50, 300)) if unit == "g" else float(rng.choice([0.5, 1, 1, 2, 3]))
+    return {"name": name, "quantity": quantity, "unit": unit}
+
+
+def random_exercise(rng: random.Random) -> Dict[str, Any]:
+    return {"activity": rng.choice(ACTIVITIES), "duration_min": float(rng.choice([10, 20, 25, 30, 45, 60, 90])),
+            "effort_level": rng.choice(EFFORTS)}
+
+
+def _qty_text(item: Dict[str, Any]) -> str:
+    q = item["quantity"]
+    q = int(q) if float(q).is_integer() else q
+    return f"{q} {item['name']}" if item["unit"] == "count" else f"{q} {item['unit']} {item['name']}"
+
+
+def random_transcript(rng: random.Random, note_ratio: float = 0.15) -> str:
+    """A log in the style users type or say: foods and workouts, sometimes free text."""
+    if rng.random() < note_ratio:
+        return rng.choice(NOTES)
+    parts = []
+    for _ in range(rng.randint(0, 2)):
+        ex = random_exercise(rng)
+        parts.append(f"{ex['effort_level']} {ex['activity']} for {int(ex['duration_min'])} minutes")
+    foods = [random_food(rng) for _ in range(rng.randint(1, 4))]
+    parts.append("ate " + ", ".join(_qty_text(f) for f in foods))
+    return " and ".join(parts)
+
+
+# --- log.json / profile.json / output_log.json ---------------------------
+
+def iter_logs(n: int, users: int = 100, voice_ratio: float = 0.1, photo_ratio: float = 0.05,
+              duplicate_ratio: float = 0.05, audio_files: int = 20, seed: int = 0) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    (id, record) pairs shaped like log.json, oldest first. `duplicate_ratio`
+    of them repeat the previous record's content a few seconds later (the
+    double submits seen in production). Voice logs point at one of
+    `audio_files` WAVs named bench-<i>.wav (see write_audio()).
+    """
+    rng = random.Random(seed)
+    uids = user_ids(users)
+    ts = START
+    previous: Optional[Dict[str, Any]] = None
+    for _ in range(n):
+        duplicate = previous is not None and rng.random() < duplicate_ratio
+        ts += timedelta(seconds=rng.randint(1, 10) if duplicate else rng.randint(1, 900))
+        log_id = _uuid(rng)
+        if duplicate:
+            md = {**previous["metadata"], "id": log_id}
+        else:
+            roll = rng.random()
+            method = "voice" if roll < voice_ratio else "photo" if roll < voice_ratio + photo_ratio else "text"
+            md = {"type": "log", "user_id": rng.choice(uids), "input_method": method}
+            md["userId"] = md["user_id"]
+            if method == "voice":
+                md["file_name"] = f"bench-{rng.randrange(max(1, audio_files))}.wav"
+                md["content_preview"] = "Audio recording"
+            elif method == "photo":
+                md["file_name"] = f"{log_id}.png"
+                md["content_preview"] = "Image file (0.1 KB)"
+            else:
+                md["file_name"] = f"{log_id}.txt"
+                md["content_preview"] = random_transcript(rng)
+            md["id"] = log_id
+        md["timestamp"] = _iso(ts, millis=False)
+        md["created_at"] = _iso(ts)
+        record = {
+            "id": log_id,
+            "content": f"Log entry: {md['input_method']} - {md['content_preview']}",
+            "metadata": md,
+            "timestamp": _iso(ts),
+        }
+        previous = record
+        yield log_id, record
+
+
+def iter_profiles(users: int, seed: int = 0) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    rng = random.Random(seed + 1)
+    for uid in user_ids(users):
+        yield uid, {
+            "id": uid,
+            "content": f"User profile: {uid}",
+            "metadata": {
+                "type": "profile", "userId": uid, "id": uid, "name": uid.replace("_", " ").title(),
+                "age": rng.randint(18, 70), "gender": rng.choice(["male", "female"]),
+                "height": rng.randint(150, 200), "weight": rng.randint(45, 120),
+                "activity_level": rng.choice(["sedentary", "light", "moderate", "active"]),
+            },
+        }
+
+
+def make_payload(rng: random.Random, log_id: str, user_id: str, timestamp: str,
+                 enriched: bool = True) -> Dict[str, Any]:
+    """A build_payload()-shaped record; with enriched=True as enrich_payload() would leave it."""
+    exercise = [random_exercise(rng) for _ in range(rng.randint(0, 2))]
+    food = [random_food(rng) for _ in range(rng.randint(0, 4))]
+    if enriched:
+        for ex in exercise:
+            ex["met"] = round(BASE_MET.get(ex["activity"], 4.0) * EFFORT_MULT[ex["effort_level"]], 2)
+            ex["calories_burned"] = round(ex["met"] * 70 * ex["duration_min"] / 60, 1)
+        for it in food:
+            it["macros"] = {"calories": float(rng.randint(20, 700)), "carbs_g": round(rng.uniform(0, 80), 1),
+                            "protein_g": round(rng.uniform(0, 40), 1), "fat_g": round(rng.uniform(0, 30), 1),
+                            "fiber_g": 0.0, "sugar_g": 0.0, "sodium_mg": 0.0}
+            it["source_ref"] = {"provider": "local", "id": it["name"]}
+    return {
+        "user_id": user_id, "timestamp": timestamp, "input_method": "text", "id": log_id,
+        "file_name": f"{log_id}.txt", "transcript": random_transcript(rng),
+        "proposed_logs": [
+            {"type": "exercise", "items": exercise, "parser_confidence": 0.9},
+            {"type": "food", "items": food, "parser_confidence": 0.9},
+        ],
+    }
+
+
+def iter_output_log(n: int, users: int = 100, seed: int = 0) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    rng = random.Random(seed + 2)
+    uids = user_ids(users)
+    ts = START
+    for _ in range(n):
+        ts += timedelta(seconds=rng.randint(1, 900))
+        log_id = _uuid(rng)
+        yield log_id, make_payload(rng, log_id, rng.choice(uids), _iso(ts, millis=False))
+
+
+def write_json_dict(path: str, pairs: Iterable[Tuple[str, Any]], indent: Optional[int] = None) -> int:
+    """Stream id -> record pairs into a JSON object without holding them all (1M records fit)."""
+    n = 0
+    sep = "\n" if indent else ""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{" + sep)
+        for key, value in pairs:
+            f.write(("," + sep if n else "") + json.dumps(key) + ": " + json.dumps(value, indent=indent))
+            n += 1
+        f.write(sep + "}")
+    return n
+
+
+# --- Audio ---------------------------------------------------------------
+
+def synth_speech(seconds: float, seed: int, rate: int = TARGET_RATE) -> np.ndarray:
+    """Speech-like float audio: short tone bursts separated by pauses (so trimming/chunking has work)."""
+    rng = np.random.default_rng(seed)
+    out = np.zeros(int(seconds * rate), dtype=np.float32)
+    pos = int(0.3 * rate)
+    while pos < len(out) - rate // 10:
+        length = int(rng.uniform(0.15, 0.6) * rate)
+        t = np.arange(min(length, len(out) - pos)) / rate
+        out[pos:pos + len(t)] = 0.3 * np.sin(2 * np.pi * rng.uniform(120, 300) * t) * np.hanning(len(t))
+        pos += len(t) + int(rng.uniform(0.05, 0.5) * rate)
+    return out + rng.normal(0, 0.002, len(out)).astype(np.float32)
+
+
+def write_audio(uploads_dir: str, count: int, seconds: float = 4.0, seed: int = 0) -> List[str]:
+    audio_dir = os.path.join(uploads_dir, "audio")
+    os.makedirs(audio_dir, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(audio_dir, f"bench-{i}.wav")
+        with open(path, "wb") as f:
+            f.write(encode_wav(synth_speech(seconds, seed + i), TARGET_RATE))
+        paths.append(path)
+    return paths
+
+
+def write_dataset(out_dir: str, records: int, users: int = 100, outputs: int = 0, voice_ratio: float = 0.1,
+                  duplicate_ratio: float = 0.05, audio_files: int = 20, audio_seconds: float = 4.0,
+                  seed: int = 0) -> Dict[str, str]:
+    """log.json, profile.json, optional output_log.json and uploads/audio under `out_dir`."""
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {
+        "logs": os.path.join(out_dir, "log.json"),
+        "profiles": os.path.join(out_dir, "profile.json"),
+        "output_log": os.path.join(out_dir, "output_log.json"),
+        "uploads_dir": os.path.join(out_dir, "uploads"),
+    }
+    write_json_dict(paths["logs"], iter_logs(records, users, voice_ratio=voice_ratio, duplicate_ratio=duplicate_ratio,
+                                             audio_files=audio_files, seed=seed))
+    write_json_dict(paths["profiles"], iter_profiles(users, seed), indent=2)
+    write_json_dict(paths["output_log"], iter_output_log(outputs, users, seed))
+    if voice_ratio > 0 and audio_files:
+        write_audio(paths["uploads_dir"], audio_files, audio_seconds, seed)
+    else:
+        os.makedirs(paths["uploads_dir"], exist_ok=True)
+    return paths
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate synthetic log.json/profile.json/output_log.json for benchmarks")
+    ap.add_argument("--out", required=True, help="Directory to write the dataset to")
+    ap.add_argument("--records", type=int, default=1000, help="Entries in log.json")
+    ap.add_argument("--outputs", type=int, default=0, help="Already-enriched entries in output_log.json")
+    ap.add_argument("--users", type=int, default=100)
+    ap.add_argument("--voice-ratio", type=float, default=0.1, help="Share of voice logs")
+    ap.add_argument("--duplicate-ratio", type=float, default=0.05, help="Share of logs repeating the previous one")
+    ap.add_argument("--audio-files", type=int, default=20, help="Distinct WAVs the voice logs point at")
+    ap.add_argument("--audio-seconds", type=float, default=4.0)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    paths = write_dataset(args.out, args.records, args.users, args.outputs, args.voice_ratio,
+                          args.duplicate_ratio, args.audio_files, args.audio_seconds, args.seed)
+    logger.info(f"Dataset written: {paths}")
+
+
+if __name__ == "__main__":
+    main()
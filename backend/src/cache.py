@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from loguru import logger
+
+from store import atomic_write_json
+from metrics import incr
+
+DEFAULT_CACHE_DIR = os.getenv(
+    "PIPELINE_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "cache"),
+)
+
+
+class PersistentLRU:
+    """
+    Small on-disk key/value cache with LRU eviction and an optional TTL.
+
+    Entries live in an OrderedDict (least recently used first) and are written
+    to a single JSON file every `autosave_every` puts and on save(). Values
+    must be JSON-serialisable. A `name` also reports hits/misses to metrics.
+    """
+
+    def __init__(self, path: Optional[str], max_entries: int = 10000, ttl_s: Optional[float] = None,
+                 autosave_every: int = 50, name: Optional[str] = None):
+        self.path = path
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.autosave_every = autosave_every
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._data = OrderedDict(json.load(f))
+            except Exception as e:
+                logger.warning(f"Could not load cache {path}: {e}")
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl_s is not None and time.time() - stored_at > self.ttl_s
+
+    def get(self, key: str) -> Optional[Any]:
+        return self.get_first(key)
+
+    def get_first(self, *keys: str) -> Optional[Any]:
+        """Value of the first live key; counts as one lookup however many keys are tried."""
+        hit = None
+        with self._lock:
+            for key in keys:
+                entry = self._data.get(key)
+                if entry is not None and self._expired(entry[0]):
+                    del self._data[key]
+                elif entry is not None:
+                    self._data.move_to_end(key)
+                    hit = entry[1]
+                    break
+            if hit is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if self.name:
+            incr("cache_hits" if hit is not None else "cache_misses", cache=self.name)
+        return hit
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._data[key] = [time.time(), value]
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            self._unsaved += 1
+            autosave = self.autosave_every and self._unsaved >= self.autosave_every
+        if autosave:
+            self.save()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._unsaved:
+                return
+            snapshot = list(self._data.items())
+            self._unsaved = 0
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        atomic_write_json(self.path, dict(snapshot), indent=None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
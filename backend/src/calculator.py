@@ -1,28 +1,114 @@
 from __future__ import annotations
 import os
-import math
-import json
-from typing import Dict, List, Optional, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Any, Tuple
 
-import requests
+from loguru import logger
+
+from cache import PersistentLRU, DEFAULT_CACHE_DIR
+from foodmatch import canonical_name, match_items
+from transport import PooledJsonTransport
+from model import Payload
+
+# Unit spellings folded together for cache keys ("" / None mean "count")
+UNIT_ALIASES = {
+    "": "count", "each": "count", "piece": "count", "pieces": "count", "counts": "count",
+    "grams": "g", "gram": "g", "gr": "g", "kilogram": "kg", "kilograms": "kg", "kgs": "kg",
+    "milliliter": "ml", "milliliters": "ml", "mls": "ml", "liter": "l", "liters": "l", "litre": "l", "litres": "l",
+    "fluid ounce": "fl oz", "fluid ounces": "fl oz",
+    "cups": "cup", "tablespoon": "tbsp", "tablespoons": "tbsp", "teaspoon": "tsp", "teaspoons": "tsp",
+    "ounce": "oz", "ounces": "oz", "pound": "lb", "pounds": "lb", "lbs": "lb",
+    "slices": "slice", "servings": "serving", "bowls": "bowl", "plates": "plate",
+}
+
+
+def _normalize_unit(unit: Optional[str]) -> str:
+    u = (unit or "").strip().lower()
+    return UNIT_ALIASES.get(u, u)
+
+
+def _item_quantity(item: Dict[str, Any]) -> float:
+    """Item quantity; only a missing one means a single unit (an explicit 0 stays 0)."""
+    q = item.get("quantity")
+    return float(q) if q not in (None, "") else 1.0
+
+
+def _scale_macros(macros: Dict[str, float], factor: float, ndigits: int = 2) -> Dict[str, float]:
+    return {k: round(float(v) * factor, ndigits) for k, v in macros.items()}
+
+
+class NutritionCache:
+    """
+    Persistent per-unit macro cache in front of Nutritionix.
+
+    Keyed on the normalised _compose_query() text for one unit of the item
+    ("1 banana", "1 bowl oatmeal"); values are macros for that single unit,
+    so "2 bananas" is served by scaling the "1 banana" entry.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 5000, ttl_s: Optional[float] = 30 * 86400):
+        self.lru = PersistentLRU(path, max_entries=max_entries, ttl_s=ttl_s, name="nutritionix")
+
+    @classmethod
+    def default(cls) -> "NutritionCache":
+        return cls(os.path.join(DEFAULT_CACHE_DIR, "nutritionix.json"))
+
+    @staticmethod
+    def key(item: Dict[str, Any]) -> str:
+        return NutritionixClient._compose_query(canonical_name(item.get("name")), 1.0, _normalize_unit(item.get("unit")))
+
+    def lookup(self, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Enriched copy of `item` from cache, or None on a miss."""
+        entry = self.lru.get(self.key(item))
+        if entry is None:
+            return None
+        return {
+            **item,
+            "macros": _scale_macros(entry["macros"], _item_quantity(item)),
+            "source_ref": {"provider": "Nutritionix", "id": entry.get("id")},
+        }
+
+    def store(self, item: Dict[str, Any], macros: Dict[str, float], source_id: Optional[str]):
+        qty = _item_quantity(item)
+        if qty <= 0:
+            return
+        # keep per-unit values unrounded enough that per-gram entries scale back accurately
+        self.lru.put(self.key(item), {"macros": _scale_macros(macros, 1.0 / qty, 6), "id": source_id})
+
+    def save(self):
+        self.lru.save()
+
+    def stats(self) -> Dict[str, Any]:
+        return self.lru.stats()
 
 
 class NutritionixClient:
-    BASE_URL = "https://trackapi.nutritionix.com/v2/natural/nutrients"
+    BASE_URL = os.getenv("NUTRITIONIX_BASE_URL", "https://trackapi.nutritionix.com/v2/natural/nutrients")
 
-    def __init__(self, app_id: Optional[str] = None, app_key: Optional[str] = None, timeout: int = 20):
+    def __init__(self, app_id: Optional[str] = None, app_key: Optional[str] = None, timeout: int = 20,
+                 cache: Optional[NutritionCache] = None, transport: Optional[PooledJsonTransport] = None,
+                 max_concurrency: int = 4, max_retries: int = 4):
         self.app_id = app_id or os.getenv("NUTRITIONIX_APP_ID")
         self.app_key = app_key or os.getenv("NUTRITIONIX_APP_KEY")
         if not self.app_id or not self.app_key:
             raise RuntimeError("Nutritionix credentials missing. Set NUTRITIONIX_APP_ID and NUTRITIONIX_APP_KEY.")
         self.timeout = timeout
+        self.cache = cache
+        self.transport = transport or PooledJsonTransport(
+            self.BASE_URL,
+            headers={"x-app-id": self.app_id, "x-app-key": self.app_key, "Content-Type": "application/json"},
+            timeout=timeout,
+            max_concurrency=max_concurrency,
+            max_retries=max_retries,
+            name="nutritionix",
+        )
 
     @staticmethod
     def _compose_query(name: str, quantity: Optional[float], unit: Optional[str]) -> str:
         # Map "count" to empty unit; otherwise include provided unit
         if unit is None or unit == "" or unit == "count":
             if quantity is not None:
-                return f"{int(quantity) if quantity.is_integer() else quantity} {name}"
+                return f"{int(quantity) if float(quantity).is_integer() else quantity} {name}"
             return name
         # Some units Nutritionix expects in singular/plural; keep simple here
         qty_str = int(quantity) if (quantity is not None and float(quantity).is_integer()) else quantity
@@ -31,26 +117,36 @@ class NutritionixClient:
     def fetch_macros_for_items(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
         Calls Nutritionix natural language endpoint once with a combined query (batched).
-        Returns items with macros and source_ref.
+        Returns items with macros and source_ref. Items found in the cache are
+        answered locally and left out of the query.
         """
-        queries = [self._compose_query(it.get("name",""), it.get("quantity"), it.get("unit")) for it in items]
-        query = " and ".join(q for q in queries if q)
-        headers = {
-            "x-app-id": self.app_id,
-            "x-app-key": self.app_key,
-            "Content-Type": "application/json"
-        }
-        body = {"query": query}
+        results, misses = self._from_cache(items)
+        if misses:
+            self._merge(items, results, misses, self._fetch([items[i] for i in misses]))
+        return results
 
-        resp = requests.post(self.BASE_URL, headers=headers, json=body, timeout=self.timeout)
-        resp.raise_for_status()
-        data = resp.json()
+    def _from_cache(self, items: List[Dict[str, Any]]):
+        if self.cache is None:
+            return [None] * len(items), list(range(len(items)))
+        results: List[Optional[Dict[str, Any]]] = [self.cache.lookup(it) for it in items]
+        return results, [i for i, r in enumerate(results) if r is None]
+
+    def _merge(self, items, results, misses, fetched):
+        for i, enriched in zip(misses, fetched):
+            results[i] = enriched
+            if self.cache is not None and enriched.get("macros"):
+                self.cache.store(items[i], enriched["macros"], enriched["source_ref"]["id"])
+
+    def _build_query(self, items: List[Dict[str, Any]]) -> str:
+        queries = [self._compose_query(it.get("name",""), it.get("quantity"), it.get("unit")) for it in items]
+        return " and ".join(q for q in queries if q)
 
+    @staticmethod
+    def _enrich_from_response(items: List[Dict[str, Any]], data: Dict[str, Any]) -> List[Dict[str, Any]]:
         # Nutritionix returns "foods": list with name, serving_qty/serving_unit, nf_* fields
         enriched: List[Dict[str, Any]] = []
-        for it in items:
-            # Find best match in returned foods by simple name containment heuristic
-            match = _best_food_match(it, data.get("foods", []))
+        # One pass over the returned foods assigns each requested item its match
+        for it, match in zip(items, match_items(items, data.get("foods", []))):
             macros = _macros_from_nx(match) if match else None
             enriched.append({
                 **it,
@@ -59,18 +155,18 @@ class NutritionixClient:
             })
         return enriched
 
+    def _fetch(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        query = self._build_query(items)
+        data = self.transport.post_json({"query": query}) if query else {}
+        return self._enrich_from_response(items, data)
+
+    def close(self):
+        self.transport.close()
+
+
 def _best_food_match(item: Dict[str, Any], foods: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
-    target = (item.get("name") or "").lower()
-    if not foods:
-        return None
-    # Prefer exact or startswith name, else first
-    exact = [f for f in foods if f.get("food_name","").lower() == target]
-    if exact:
-        return exact[0]
-    starts = [f for f in foods if f.get("food_name","").lower().startswith(target.split()[0])]
-    if starts:
-        return starts[0]
-    return foods[0]
+    # Single-item form of foodmatch.match_items (fuzzy name match, else first food)
+    return match_items([item], foods)[0]
 
 def _macros_from_nx(f: Dict[str, Any]) -> Optional[Dict[str, float]]:
     if not f:
@@ -85,13 +181,23 @@ def _macros_from_nx(f: Dict[str, Any]) -> Optional[Dict[str, float]]:
         "sodium_mg": float(f.get("nf_sodium") or 0.0),
     }
 
-def enrich_food_items(items: List[Dict[str, Any]], nx: NutritionixClient) -> List[Dict[str, Any]]:
+def enrich_food_items(items: List[Dict[str, Any]], nx: Optional[NutritionixClient], local_db=None) -> List[Dict[str, Any]]:
     """
     Returns new list with macros + source_ref for each food item.
+    With a local_db (nutrition_db.LocalNutritionDB) items it knows are resolved
+    offline and only the misses go to Nutritionix; without nx, misses are
+    returned unchanged.
     """
     if not items:
         return []
-    return nx.fetch_macros_for_items(items)
+    if local_db is None:
+        return nx.fetch_macros_for_items(items)
+    results = local_db.resolve_many(items)
+    misses = [i for i, r in enumerate(results) if r is None]
+    if misses and nx is not None:
+        for i, enriched in zip(misses, nx.fetch_macros_for_items([items[i] for i in misses])):
+            results[i] = enriched
+    return [r if r is not None else it for r, it in zip(results, items)]
 
 
 
@@ -135,30 +241,175 @@ def calculate_exercise_calories(
     user_profile expects at least 'weight' in kg.
     """
     weight = float(user_profile.get("weight") or 70.0)  # default 70kg if missing
-    enriched: List[Dict[str, Any]] = []
-    for it in items or []:
-        activity = it.get("activity", "")
-        duration = float(it.get("duration_min") or 0.0)
-        effort = it.get("effort_level") or "moderate"
-        met = _effective_met(activity, effort)
-        cals = _calories_from_met(met, weight, duration)
-        enriched.append({**it, "met": round(met, 2), "calories_burned": round(cals, 1)})
-    return enriched
-
-
-def enrich_payload(payload: Dict[str, Any], user_profile: Dict[str, Any], nx: Optional[NutritionixClient] = None) -> Dict[str, Any]:
+    return [{**it, **_exercise_values(it, weight)} for it in items or []]
+
+def _exercise_values(it, weight: float) -> Dict[str, float]:
+    """met and calories_burned for one exercise item (dict or model.ExerciseItem)."""
+    activity = it.get("activity") or ""
+    duration = float(it.get("duration_min") or 0.0)
+    effort = it.get("effort_level") or "moderate"
+    met = _effective_met(activity, effort)
+    cals = _calories_from_met(met, weight, duration)
+    return {"met": round(met, 2), "calories_burned": round(cals, 1)}
+
+
+def enrich_payload(payload: Dict[str, Any], user_profile: Dict[str, Any], nx: Optional[NutritionixClient] = None,
+                   local_db=None) -> Dict[str, Any]:
     """
     Given a payload with:
       { "metadata": {...}, "proposed_logs": [ {type: "exercise"| "food", "items":[...] }, ... ] }
     return a new payload with macros (food) and calories_burned+met (exercise).
 
-    If nx is None, food items are returned unchanged (no macros). Useful for offline dev.
+    If nx and local_db are both None, food items are returned unchanged (no
+    macros). Useful for offline dev.
+
+    The payload is loaded into the model.Payload types (validated, no deep
+    copy) and only the logs/items that change are rebuilt; everything else in
+    the returned dict is shared with `payload`, so neither may be mutated in
+    place afterwards.
+    """
+    doc = Payload.from_dict(payload)
+    weight = float(user_profile.get("weight") or 70.0)  # default 70kg if missing
+    logs = []
+    for log in doc.logs:
+        if log.type == "exercise":
+            items = tuple({**it.to_dict(), **_exercise_values(it, weight)} for it in log.get("items", ()))
+            log = log.replace(items=items)
+        elif log.type == "food" and (nx is not None or local_db is not None) and log.get("items"):
+            log = log.replace(items=tuple(enrich_food_items([it.to_dict() for it in log.items], nx, local_db)))
+        logs.append(log)
+    if "proposed_logs" in doc:
+        doc = doc.replace(proposed_logs=tuple(logs))
+    return doc.to_dict()
+
+
+class EnrichmentScheduler:
     """
-    out = json.loads(json.dumps(payload))  # deep copy
-    for log in out.get("proposed_logs", []):
-        if log.get("type") == "exercise":
-            log["items"] = calculate_exercise_calories(log.get("items", []), user_profile)
-        elif log.get("type") == "food":
-            if nx is not None:
-                log["items"] = enrich_food_items(log.get("items", []), nx)
-    return out
+    Coalesces Nutritionix lookups across many payloads.
+
+    Food items from every payload are resolved from the local table and the
+    cache first. The remaining ones are deduplicated by NutritionCache.key()
+    (canonical name + unit) and packed into natural-language queries of at
+    most `max_items` foods / `max_chars` characters. Each distinct food is
+    asked for once at a reference quantity, and the per-unit result is scaled
+    back into every proposed_logs entry that mentioned it.
+    """
+
+    # Reference quantity queried per unit; weight/volume units use 100 for precision
+    REFERENCE_QTY = {"g": 100.0, "ml": 100.0, "mg": 1000.0}
+
+    def __init__(self, nx: Optional[NutritionixClient], local_db=None, max_items: int = 20, max_chars: int = 500,
+                 max_parallel: int = 4):
+        self.nx = nx
+        self.local_db = local_db
+        self.max_items = max_items
+        self.max_chars = max_chars
+        self.max_parallel = max_parallel
+        self.stats = {"items": 0, "local": 0, "cached": 0, "distinct_fetched": 0, "requests": 0, "failed_requests": 0}
+
+    def _pack(self, unit_items: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        chunks: List[List[Dict[str, Any]]] = []
+        current: List[Dict[str, Any]] = []
+        length = 0
+        for it in unit_items:
+            q = NutritionixClient._compose_query(it["name"], it["quantity"], it["unit"])
+            extra = len(q) + (5 if current else 0)  # " and "
+            if current and (len(current) >= self.max_items or length + extra > self.max_chars):
+                chunks.append(current)
+                current, length = [], 0
+                extra = len(q)
+            current.append(it)
+            length += extra
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def _fetch_chunk(self, chunk: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """One packed query; a failed request (e.g. a 404 "no match") leaves its foods without macros."""
+        try:
+            return self.nx._fetch(chunk)
+        except Exception as e:
+            logger.warning(f"Nutritionix: lookup of {len(chunk)} foods failed: {e}")
+            self.stats["failed_requests"] += 1
+            return [{} for _ in chunk]
+
+    def _fetch_distinct(self, items: List[Dict[str, Any]]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """One reference lookup per distinct cache key -> {"macros" (per unit), "id"} or None."""
+        unit_items: Dict[str, Dict[str, Any]] = {}
+        key_of: Dict[int, str] = {}
+        for it in items:
+            key = NutritionCache.key(it)
+            if key not in unit_items:
+                unit = _normalize_unit(it.get("unit"))
+                qty = self.REFERENCE_QTY.get(unit, 1.0)
+                unit_items[key] = {"name": canonical_name(it.get("name")), "quantity": qty, "unit": unit}
+                key_of[id(unit_items[key])] = key
+        chunks = self._pack(list(unit_items.values()))
+        self.stats["distinct_fetched"] += len(unit_items)
+        self.stats["requests"] += len(chunks)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_parallel, len(chunks)))) as pool:
+            fetched = list(pool.map(self._fetch_chunk, chunks))
+
+        per_unit: Dict[str, Optional[Dict[str, Any]]] = {}
+        for chunk, results in zip(chunks, fetched):
+            for ref, enriched in zip(chunk, results):
+                key = key_of[id(ref)]
+                if not enriched.get("macros"):
+                    per_unit[key] = None
+                    continue
+                per_unit[key] = {
+                    "macros": _scale_macros(enriched["macros"], 1.0 / ref["quantity"], 6),
+                    "id": enriched["source_ref"]["id"],
+                }
+                if self.nx.cache is not None:
+                    self.nx.cache.store(ref, enriched["macros"], enriched["source_ref"]["id"])
+        return per_unit
+
+    def enrich_payloads(self, jobs: List[Tuple[Dict[str, Any], Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        jobs: list of (payload, user_profile). Returns enriched payloads in the
+        same order, shaped exactly like enrich_payload() output.
+        """
+        outs = [enrich_payload(payload, profile) for payload, profile in jobs]
+        refs: List[Tuple[Dict[str, Any], int]] = []  # (food log, item index)
+        for n, out in enumerate(outs):
+            if not any(log.get("type") == "food" for log in out.get("proposed_logs", [])):
+                continue
+            # enrich_payload output may share dicts with its input: copy the food logs written below
+            logs = [{**log, "items": list(log.get("items", []))} if log.get("type") == "food" else log
+                    for log in out["proposed_logs"]]
+            outs[n] = {**out, "proposed_logs": logs}
+            for log in logs:
+                if log.get("type") == "food":
+                    refs.extend((log, i) for i in range(len(log["items"])))
+        if not refs or (self.nx is None and self.local_db is None):
+            return outs
+        items = [log["items"][i] for log, i in refs]
+        self.stats["items"] += len(items)
+
+        resolved: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        if self.local_db is not None:
+            resolved = self.local_db.resolve_many(items)
+            self.stats["local"] += sum(r is not None for r in resolved)
+        if self.nx is not None:
+            if self.nx.cache is not None:
+                for k, it in enumerate(items):
+                    if resolved[k] is None:
+                        resolved[k] = self.nx.cache.lookup(it)
+                        self.stats["cached"] += resolved[k] is not None
+            misses = [k for k, r in enumerate(resolved) if r is None]
+            if misses:
+                per_unit = self._fetch_distinct([items[k] for k in misses])
+                for k in misses:
+                    entry = per_unit.get(NutritionCache.key(items[k]))
+                    qty = _item_quantity(items[k])
+                    resolved[k] = {
+                        **items[k],
+                        "macros": _scale_macros(entry["macros"], qty) if entry else None,
+                        "source_ref": {"provider": "Nutritionix", "id": entry["id"] if entry else None},
+                    }
+        for (log, i), enriched in zip(refs, resolved):
+            if enriched is not None:
+                log["items"][i] = enriched
+        return outs
@@ -1,11 +1,27 @@
 # llm_parser.py
-import os, json
-from typing import Dict, Any
+import os, re, json, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Dict, Any, List, Optional, Tuple
 from openai import OpenAI
 
+from cache import PersistentLRU, DEFAULT_CACHE_DIR
+from metrics import incr
+from rule_parser import parse_with_rules
+
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+# Bump when the parse prompt or schema changes meaning; the memo key also
+# hashes the prompt text itself, so edits invalidate old entries either way.
+PROMPT_VERSION = "1"
+PARSE_CACHE_PATH = os.getenv("PARSE_CACHE_PATH", os.path.join(DEFAULT_CACHE_DIR, "parse_with_llm.json"))
+PARSE_CACHE_DISABLED = os.getenv("PARSE_CACHE_DISABLE", "").lower() in ("1", "true", "yes")
+# Rule-parser results at or above this confidence skip the LLM
+RULE_CONFIDENCE_THRESHOLD = float(os.getenv("RULE_CONFIDENCE_THRESHOLD", "0.85"))
+# Confidence reported for LLM parses (previously hard-coded in build_payload)
+LLM_CONFIDENCE = 0.9
+
 # --- Helpers --------------------------------------------------------------
 
 def _safe_json(text: str) -> Dict[str, Any]:
@@ -24,6 +40,7 @@ def _chat_json(messages, schema_hint: str) -> Dict[str, Any]:
     Ask the model for strict JSON. We repeat the schema in the user message to
     minimize drift; then parse/clean the response.
     """
+    incr("api_calls", api="openai_chat")
     completion = client.chat.completions.create(
         model=OPENAI_MODEL,
         temperature=0,
@@ -45,6 +62,10 @@ def _chat_json(messages, schema_hint: str) -> Dict[str, Any]:
             },
         ],
     )
+    usage = getattr(completion, "usage", None)
+    if usage is not None:
+        incr("tokens", usage.prompt_tokens or 0, api="openai_chat", kind="prompt")
+        incr("tokens", usage.completion_tokens or 0, api="openai_chat", kind="completion")
     content = completion.choices[0].message.content
     return _safe_json(content)
 
@@ -126,7 +147,57 @@ def extract_entities_llm(segment_text: str, intent: str) -> Dict[str, Any]:
 
 # --- 3) Single-pass parse (recommended) ----------------------------------
 
-def parse_with_llm(transcript: str) -> Dict[str, Any]:
+PARSE_SCHEMA = """
+    {
+      "food": { "items": [ { "name": "string", "quantity": "number", "unit": "string" } ] },
+      "exercise": { "items": [ { "activity": "string", "duration_min": "number", "effort_level": "easy|moderate|vigorous|max" } ] }
+    }
+    """
+PARSE_SYSTEM_PROMPT = (
+    "You are a precise parser for fitness logs. "
+    "From the transcript, identify FOOD items and EXERCISE activities and extract entities. "
+    "Quantities default to 1.0 and unit 'count' if unspecified. "
+    "Effort defaults to 'moderate' if unspecified. "
+    "Use numbers for quantity and duration; do not invent items."
+)
+
+_parse_memo: Optional[PersistentLRU] = None
+_parse_memo_lock = threading.Lock()
+
+
+def _memo() -> PersistentLRU:
+    global _parse_memo
+    with _parse_memo_lock:
+        if _parse_memo is None:
+            _parse_memo = PersistentLRU(PARSE_CACHE_PATH, max_entries=20000, name="parse")
+        return _parse_memo
+
+
+def normalize_transcript(transcript: str) -> str:
+    """Case, whitespace and edge punctuation folded so near-identical logs share a key."""
+    text = " ".join((transcript or "").lower().split())
+    return re.sub(r"^[\s.,!?;:]+|[\s.,!?;:]+$", "", text)
+
+
+def parse_cache_key(transcript: str, system_prompt: str = PARSE_SYSTEM_PROMPT) -> str:
+    """Memo key; batched parses pass BATCH_SYSTEM_PROMPT so editing it invalidates their entries."""
+    h = hashlib.sha256()
+    for part in (OPENAI_MODEL, PROMPT_VERSION, system_prompt, PARSE_SCHEMA, normalize_transcript(transcript)):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def parse_cache_stats() -> Dict[str, Any]:
+    return _memo().stats()
+
+
+def save_parse_cache():
+    if _parse_memo is not None:
+        _parse_memo.save()
+
+
+def parse_with_llm(transcript: str, use_cache: bool = True) -> Dict[str, Any]:
     """
     Single call that returns both categories and their entities in one shot.
     Output aligned to your earlier structure (no macros/calories yet):
@@ -134,27 +205,192 @@ def parse_with_llm(transcript: str) -> Dict[str, Any]:
       "food": { "items": [ { name, quantity, unit } ] },
       "exercise": { "items": [ { activity, duration_min, effort_level } ] }
     }
+    Results are memoised on disk by parse_cache_key(); pass use_cache=False
+    (or set PARSE_CACHE_DISABLE=1) to always call the model.
     """
-    schema = """
-    {
-      "food": { "items": [ { "name": "string", "quantity": "number", "unit": "string" } ] },
-      "exercise": { "items": [ { "activity": "string", "duration_min": "number", "effort_level": "easy|moderate|vigorous|max" } ] }
-    }
-    """
+    use_cache = use_cache and not PARSE_CACHE_DISABLED
+    if use_cache:
+        key = parse_cache_key(transcript)
+        hit = _memo().get(key)
+        if hit is not None:
+            return json.loads(json.dumps(hit))  # callers may mutate the result
+    parsed = _parse_one(transcript)
+    if use_cache:
+        _memo().put(key, json.loads(json.dumps(parsed)))
+    return parsed
+
+
+def _parse_one(transcript: str) -> Dict[str, Any]:
+    """One uncached single-transcript parse request."""
     messages = [
         {
             "role": "system",
-            "content": (
-                "You are a precise parser for fitness logs. "
-                "From the transcript, identify FOOD items and EXERCISE activities and extract entities. "
-                "Quantities default to 1.0 and unit 'count' if unspecified. "
-                "Effort defaults to 'moderate' if unspecified. "
-                "Use numbers for quantity and duration; do not invent items."
-            ),
+            "content": PARSE_SYSTEM_PROMPT,
         },
         {
             "role": "user",
             "content": f"Transcript: {transcript}",
         },
     ]
-    return _chat_json(messages, schema)
+    return _chat_json(messages, PARSE_SCHEMA)
+
+# --- 4) Rule-based fast path ---------------------------------------------
+
+def parse_transcript(transcript: str, threshold: Optional[float] = None, use_cache: bool = True,
+                     llm_gate=None) -> Tuple[Dict[str, Any], float]:
+    """
+    Parse with rule_parser first and only escalate to parse_with_llm() when
+    its confidence is below `threshold` (RULE_CONFIDENCE_THRESHOLD by default).
+    `llm_gate` is an optional context manager (e.g. a semaphore) held only
+    around the LLM call. Returns (parsed, parser_confidence).
+    """
+    threshold = RULE_CONFIDENCE_THRESHOLD if threshold is None else threshold
+    parsed, confidence = parse_with_rules(transcript)
+    if confidence >= threshold:
+        return parsed, confidence
+    with llm_gate or nullcontext():
+        return parse_with_llm(transcript, use_cache=use_cache), LLM_CONFIDENCE
+
+
+# --- 5) Batched parse for backfills --------------------------------------
+
+BATCH_SYSTEM_PROMPT = (
+    PARSE_SYSTEM_PROMPT + " "
+    "You will receive a JSON object mapping log ids to transcripts. "
+    "Parse each transcript independently and return a JSON object with exactly the same ids as keys."
+)
+# Rough token accounting: ~4 chars/token plus fixed per-item overhead and expected output
+_PROMPT_OVERHEAD_TOKENS = (len(BATCH_SYSTEM_PROMPT) + len(PARSE_SCHEMA)) // 4 + 150
+_ITEM_OVERHEAD_TOKENS = 20
+_OUTPUT_TOKENS_PER_ITEM = 120
+
+
+def _estimate_tokens(transcript: str) -> int:
+    return len(transcript) // 4 + _ITEM_OVERHEAD_TOKENS + _OUTPUT_TOKENS_PER_ITEM
+
+
+def _valid_parse(value: Any) -> bool:
+    if not isinstance(value, dict):
+        return False
+    for key in ("food", "exercise"):
+        section = value.get(key)
+        if not isinstance(section, dict) or not isinstance(section.get("items", []), list):
+            return False
+    return True
+
+
+def _pack_batches(transcripts: Dict[str, str], token_budget: int, max_batch: int) -> List[Dict[str, str]]:
+    batches: List[Dict[str, str]] = []
+    current: Dict[str, str] = {}
+    used = _PROMPT_OVERHEAD_TOKENS
+    for log_id, text in transcripts.items():
+        cost = _estimate_tokens(text)
+        if current and (len(current) >= max_batch or used + cost > token_budget):
+            batches.append(current)
+            current, used = {}, _PROMPT_OVERHEAD_TOKENS
+        current[log_id] = text
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _parse_batch_once(batch: Dict[str, str], use_cache: bool) -> Dict[str, Dict[str, Any]]:
+    """
+    One request for the whole batch; re-splits and retries only the ids that
+    came back missing or malformed. API errors (transport, auth, rate limit)
+    propagate: re-splitting would only repeat them ~2N times.
+    """
+    if len(batch) == 1:
+        # Already missed the memo in parse_batch_with_llm; checked like a batch reply
+        ((log_id, text),) = batch.items()
+        parsed = _parse_one(text)
+        if not _valid_parse(parsed):
+            return {}
+        if use_cache:
+            _memo().put(parse_cache_key(text), json.loads(json.dumps(parsed)))
+        return {log_id: parsed}
+    messages = [
+        {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+        {"role": "user", "content": json.dumps(batch, ensure_ascii=False)},
+    ]
+    try:
+        reply = _chat_json(messages, '{ "<log id>": ' + PARSE_SCHEMA.strip() + ", ... }")
+    except ValueError:  # reply was not JSON
+        reply = {}
+    if not isinstance(reply, dict):
+        reply = {}
+    results = {log_id: reply[log_id] for log_id in batch if _valid_parse(reply.get(log_id))}
+    if use_cache:
+        for log_id, parsed in results.items():
+            _memo().put(parse_cache_key(batch[log_id], BATCH_SYSTEM_PROMPT), json.loads(json.dumps(parsed)))
+    failed = [log_id for log_id in batch if log_id not in results]
+    if failed:
+        # Halve the failed remainder so one bad transcript can't sink a whole request
+        half = max(1, len(failed) // 2)
+        for part in (failed[:half], failed[half:]):
+            if part:
+                incr("api_retries", api="openai_chat")
+                results.update(_parse_batch_once({log_id: batch[log_id] for log_id in part}, use_cache))
+    return results
+
+
+def parse_batch_with_llm(transcripts: Dict[str, str], token_budget: int = 6000, max_batch: int = 25,
+                         max_parallel: int = 4, use_cache: bool = True, llm_gate=None) -> Dict[str, Dict[str, Any]]:
+    """
+    Parse many transcripts, keyed by log id, packing several into each JSON
+    mode request so the system prompt and schema are paid once per batch.
+
+    Batches are sized to stay under `token_budget` (estimated prompt plus
+    output tokens) and `max_batch` items. Memoised transcripts (batched or
+    single parses) are answered from the parse cache. Ids missing or
+    malformed in a reply are re-split and retried on their own; a single
+    leftover id gets a single-transcript request and is left out of the
+    result if that reply is malformed too. API errors are raised.
+    """
+    use_cache = use_cache and not PARSE_CACHE_DISABLED
+    results: Dict[str, Dict[str, Any]] = {}
+    todo: Dict[str, str] = {}
+    for log_id, text in transcripts.items():
+        hit = None
+        if use_cache:
+            hit = _memo().get_first(parse_cache_key(text, BATCH_SYSTEM_PROMPT), parse_cache_key(text))
+        if hit is not None:
+            results[log_id] = json.loads(json.dumps(hit))
+        else:
+            todo[log_id] = text
+    if not todo:
+        return results
+
+    def run(batch: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+        with llm_gate or nullcontext():
+            return _parse_batch_once(batch, use_cache)
+
+    batches = _pack_batches(todo, token_budget, max_batch)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_parallel, len(batches)))) as pool:
+        for part in pool.map(run, batches):
+            results.update(part)
+    return results
+
+
+def parse_transcripts(transcripts: Dict[str, str], threshold: Optional[float] = None, use_cache: bool = True,
+                      llm_gate=None, **batch_opts) -> Dict[str, Tuple[Dict[str, Any], float]]:
+    """
+    parse_transcript() for many logs at once: rule-based parse for every id,
+    then a single parse_batch_with_llm() pass over the low-confidence ones.
+    Returns {log_id: (parsed, parser_confidence)}.
+    """
+    threshold = RULE_CONFIDENCE_THRESHOLD if threshold is None else threshold
+    out: Dict[str, Tuple[Dict[str, Any], float]] = {}
+    escalate: Dict[str, str] = {}
+    for log_id, text in transcripts.items():
+        parsed, confidence = parse_with_rules(text)
+        if confidence >= threshold:
+            out[log_id] = (parsed, confidence)
+        else:
+            escalate[log_id] = text
+    if escalate:
+        parsed_many = parse_batch_with_llm(escalate, use_cache=use_cache, llm_gate=llm_gate, **batch_opts)
+        for log_id, parsed in parsed_many.items():
+            out[log_id] = (parsed, LLM_CONFIDENCE)
+    return out
@@ -0,0 +1,197 @@
+import os
+import json
+import argparse
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from calculator import BASE_MET, EFFORT_MULT
+from store import atomic_write_json, open_output_store
+
+DEFAULT_WEIGHT_KG = 70.0
+FALLBACK_MET = 4.0
+
+# Lookup arrays; the last slot of each is the fallback for unknown names
+ACTIVITIES = list(BASE_MET)
+EFFORTS = list(EFFORT_MULT)
+MET_TABLE = np.array([BASE_MET[a] for a in ACTIVITIES] + [FALLBACK_MET], dtype=np.float64)
+MULT_TABLE = np.array([EFFORT_MULT[e] for e in EFFORTS] + [1.0], dtype=np.float64)
+_ACTIVITY_CODE = {a: i for i, a in enumerate(ACTIVITIES)}
+_EFFORT_CODE = {e: i for i, e in enumerate(EFFORTS)}
+
+
+def profile_weight(profiles: Dict[str, Any], user_id: str) -> float:
+    """Weight in kg as calculate_exercise_calories() sees it (70 kg when missing)."""
+    md = (profiles.get(user_id) or {}).get("metadata", {})
+    return float(md.get("weight") or DEFAULT_WEIGHT_KG)
+
+
+def activity_code(activity: Optional[str]) -> int:
+    return _ACTIVITY_CODE.get((activity or "").lower(), len(ACTIVITIES))
+
+
+def effort_code(effort: Optional[str]) -> int:
+    return _EFFORT_CODE.get((effort or "moderate").lower(), len(EFFORTS))
+
+
+def compute(activity: np.ndarray, effort: np.ndarray, duration_min: np.ndarray,
+            weight_kg: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorised _effective_met/_calories_from_met: unrounded (met, calories)
+    for arrays of activity codes, effort codes, durations and per-item weights.
+    """
+    met = MET_TABLE[activity] * MULT_TABLE[effort]
+    hours = np.maximum(0.0, duration_min) / 60.0
+    return met, met * weight_kg * hours
+
+
+class ExerciseColumns:
+    """
+    Exercise items of many output records flattened into parallel arrays.
+
+    `refs` keeps (record_id, log index, item index) for every row so computed
+    values can be written back into the records they came from.
+    """
+
+    def __init__(self):
+        self.refs: List[Tuple[str, int, int]] = []
+        self._activity: List[int] = []
+        self._effort: List[int] = []
+        self._duration: List[float] = []
+        self._weight: List[float] = []
+
+    def __len__(self) -> int:
+        return len(self.refs)
+
+    def add_record(self, record_id: str, record: Dict[str, Any], weight_kg: float):
+        for li, log in enumerate(record.get("proposed_logs", [])):
+            if log.get("type") != "exercise":
+                continue
+            for ii, it in enumerate(log.get("items", [])):
+                self.refs.append((record_id, li, ii))
+                self._activity.append(activity_code(it.get("activity")))
+                self._effort.append(effort_code(it.get("effort_level")))
+                self._duration.append(float(it.get("duration_min") or 0.0))
+                self._weight.append(weight_kg)
+
+    def compute(self) -> Tuple[np.ndarray, np.ndarray]:
+        return compute(
+            np.array(self._activity, dtype=np.intp),
+            np.array(self._effort, dtype=np.intp),
+            np.array(self._duration, dtype=np.float64),
+            np.array(self._weight, dtype=np.float64),
+        )
+
+
+def load_weight_snapshot(path: str) -> Dict[str, float]:
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return {k: float(v) for k, v in json.load(f).items()}
+    except Exception as e:
+        logger.warning(f"Could not load weight snapshot {path}: {e}")
+        return {}
+
+
+def changed_users(profiles: Dict[str, Any], snapshot: Dict[str, float]) -> List[str]:
+    """Users whose current profile weight differs from (or is missing in) the snapshot."""
+    return [uid for uid in profiles if snapshot.get(uid) != profile_weight(profiles, uid)]
+
+
+def recompute_exercise(store, profiles: Dict[str, Any], users: Optional[List[str]] = None) -> Dict[str, int]:
+    """
+    Recompute met/calories_burned of every stored exercise item for `users`
+    (all users when None) in one vectorised pass; only records whose values
+    actually change are written back, as copies (stores hand out the records
+    they hold).
+    """
+    wanted = set(profiles if users is None else users)
+    if not wanted:
+        return {"records": 0, "items": 0, "updated": 0}
+    weights = {uid: profile_weight(profiles, uid) for uid in wanted}
+    records: Dict[str, Dict[str, Any]] = {}
+    cols = ExerciseColumns()
+    for record_id in store.ids_for_users(wanted):
+        record = store.get(record_id)
+        if record is None or record.get("user_id") not in wanted:
+            continue
+        records[record_id] = record
+        cols.add_record(record_id, record, weights[record["user_id"]])
+    if not len(cols):
+        return {"records": len(records), "items": 0, "updated": 0}
+
+    met, calories = cols.compute()
+    dirty: Dict[str, Dict[str, Any]] = {}
+    for (record_id, li, ii), m, c in zip(cols.refs, met.tolist(), calories.tolist()):
+        # Python round() so values match calculate_exercise_calories() exactly
+        m, c = round(m, 2), round(c, 1)
+        item = records[record_id]["proposed_logs"][li]["items"][ii]
+        if item.get("met") != m or item.get("calories_burned") != c:
+            if record_id not in dirty:
+                dirty[record_id] = json.loads(json.dumps(records[record_id]))
+            dirty[record_id]["proposed_logs"][li]["items"][ii].update(met=m, calories_burned=c)
+    for record_id, record in dirty.items():
+        store.put(record_id, record)
+    return {"records": len(records), "items": len(cols), "updated": len(dirty)}
+
+
+def recompute_changed(store, profiles: Dict[str, Any], snapshot_path: str) -> Dict[str, int]:
+    """
+    Incremental recompute: only users whose weight moved since the last run
+    (per the snapshot at `snapshot_path`) are touched. The snapshot is
+    rewritten after the store has been flushed.
+
+    Without a snapshot there is nothing to compare against, so the first run
+    only records the current weights; stored values are left as they were
+    computed (use `exercise_engine.py --all` to force a full recompute).
+    """
+    if not os.path.exists(snapshot_path):
+        atomic_write_json(snapshot_path, {uid: profile_weight(profiles, uid) for uid in profiles})
+        logger.info(f"Exercise: no weight snapshot yet, recorded {len(profiles)} users to {snapshot_path}")
+        return {"users": 0, "records": 0, "items": 0, "updated": 0}
+    snapshot = load_weight_snapshot(snapshot_path)
+    users = changed_users(profiles, snapshot)
+    if not users:
+        return {"users": 0, "records": 0, "items": 0, "updated": 0}
+    stats = recompute_exercise(store, profiles, users)
+    store.flush()
+    snapshot.update({uid: profile_weight(profiles, uid) for uid in users})
+    atomic_write_json(snapshot_path, snapshot)
+    logger.info(f"Exercise: recomputed {stats['items']} items for {len(users)} users ({stats['updated']} records changed)")
+    return {"users": len(users), **stats}
+
+
+def default_snapshot_path(output_file: str) -> str:
+    return f"{os.path.splitext(output_file)[0]}.weights.json"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Recompute exercise calories after profile weight changes")
+    ap.add_argument("--profiles", required=True, help="Path to profile.json (dict keyed by userId)")
+    ap.add_argument("--output_log", required=True, help="Path to output_log.json (dict keyed by log id)")
+    ap.add_argument("--journal", help="Append-only JSONL output store (see payload.py)")
+    ap.add_argument("--shards", help="Sharded output store directory (see payload.py)")
+    ap.add_argument("--snapshot", help="Weight snapshot file (default: <output_log>.weights.json)")
+    ap.add_argument("--all", action="store_true", help="Recompute every user, not only those whose weight changed")
+    args = ap.parse_args()
+
+    with open(args.profiles, "r", encoding="utf-8") as f:
+        profiles = json.load(f)
+    store = open_output_store(args.output_log, args.journal, shards=args.shards)
+    snapshot_path = args.snapshot or default_snapshot_path(args.output_log)
+    try:
+        if args.all:
+            stats = recompute_exercise(store, profiles)
+            store.flush()
+            atomic_write_json(snapshot_path, {uid: profile_weight(profiles, uid) for uid in profiles})
+        else:
+            stats = recompute_changed(store, profiles, snapshot_path)
+    finally:
+        store.close()
+    logger.info(f"Exercise: {stats}")
+
+
+if __name__ == "__main__":
+    main()
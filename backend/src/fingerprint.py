@@ -0,0 +1,144 @@
+import os
+import json
+import hashlib
+import threading
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+from loguru import logger
+
+from classifier import normalize_transcript
+from store import atomic_write_json, ts_epoch
+from transcription import audio_digest
+
+# Submissions of the same content by the same user this close together are one log
+BUCKET_S = float(os.getenv("FINGERPRINT_BUCKET_S", "120"))
+# Owners older than this (relative to the newest one seen) are dropped on save
+RETENTION_S = float(os.getenv("FINGERPRINT_RETENTION_S", str(7 * 86400)))
+# Where routes/logging.js stores each input method's upload, under the uploads dir
+UPLOAD_DIRS = {"voice": "audio", "photo": "images"}
+
+
+def content_digest(record: Dict[str, Any], uploads_dir: str) -> str:
+    """
+    What a log says: the normalised text for typed logs, the SHA-256 of the
+    file for voice/photo uploads (their previews are generic), or the file
+    name when the upload is missing.
+    """
+    md = record.get("metadata", {})
+    method = md.get("input_method")
+    file_name = md.get("file_name")
+    if method == "text" or not file_name:
+        text = normalize_transcript(md.get("content_preview") or "")
+        return "text:" + hashlib.sha256(text.encode("utf-8")).hexdigest()
+    path = os.path.join(uploads_dir, UPLOAD_DIRS.get(method, method or ""), file_name)
+    if os.path.exists(path):
+        return "file:" + audio_digest(path)
+    return "name:" + file_name
+
+
+def _key(user_id: Optional[str], digest: str, bucket: int) -> str:
+    return hashlib.sha256(f"{user_id}\0{digest}\0{bucket}".encode("utf-8")).hexdigest()[:32]
+
+
+def link_duplicate(original: Dict[str, Any], record: Dict[str, Any], original_id: str) -> Dict[str, Any]:
+    """Output entry for a duplicate log: the original's enrichment under the duplicate's own metadata."""
+    md = record.get("metadata", {})
+    linked = json.loads(json.dumps(original))  # stores may update records in place (exercise recompute)
+    linked.update({
+        "user_id": md.get("user_id"),
+        "timestamp": md.get("timestamp"),
+        "input_method": md.get("input_method"),
+        "id": record.get("id"),
+        "file_name": md.get("file_name"),
+        "duplicate_of": original_id,
+    })
+    return linked
+
+
+class FingerprintIndex:
+    """
+    Persisted fingerprint -> log id map for duplicate suppression.
+
+    A fingerprint is (user, content_digest(), time bucket of BUCKET_S). A log
+    is a duplicate when a fingerprint for the same user and content exists in
+    its own or an adjacent bucket, so double submits seconds apart match even
+    across a bucket edge. claim() either returns the id that owns the content
+    or registers the caller as owner; owners still being processed are held
+    in memory only until commit() (or release() on failure), so the file
+    never points at a log that has no output.
+    """
+
+    def __init__(self, path: Optional[str], uploads_dir: str = ".", bucket_s: float = BUCKET_S,
+                 retention_s: float = RETENTION_S):
+        self.path = path
+        self.uploads_dir = uploads_dir
+        self.bucket_s = bucket_s
+        self.retention_s = retention_s
+        self.owners: Dict[str, List[Any]] = {}  # key -> [log id, bucket]
+        self._inflight: Dict[str, List[str]] = {}  # log id -> keys it claimed
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.stats = {"checked": 0, "duplicates": 0}
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("bucket_s") == bucket_s:
+                    self.owners = data["owners"]
+            except Exception as e:
+                logger.warning(f"Could not load fingerprint index {path}: {e}")
+
+    def fingerprint(self, record: Dict[str, Any]) -> Tuple[Optional[str], str, int]:
+        md = record.get("metadata", {})
+        ts = md.get("timestamp") or record.get("timestamp")
+        return md.get("user_id"), content_digest(record, self.uploads_dir), int(ts_epoch(ts) // self.bucket_s)
+
+    def claim(self, record_id: str, record: Dict[str, Any], done: Callable[[str], bool]) -> Optional[str]:
+        """
+        Id of the log whose output `record` duplicates (done, or in flight in
+        this process), else None after registering `record_id` as the owner.
+        """
+        user_id, digest, bucket = self.fingerprint(record)
+        own = _key(user_id, digest, bucket)
+        with self._lock:
+            self.stats["checked"] += 1
+            for b in (bucket, bucket - 1, bucket + 1):
+                entry = self.owners.get(own if b == bucket else _key(user_id, digest, b))
+                if entry is None or entry[0] == record_id:
+                    continue
+                if entry[0] in self._inflight or done(entry[0]):
+                    self.stats["duplicates"] += 1
+                    return entry[0]
+            self.owners[own] = [record_id, bucket]
+            self._inflight[record_id] = [own]
+        return None
+
+    def commit(self, record_id: str):
+        """`record_id`'s output is stored: its fingerprints may be persisted."""
+        with self._lock:
+            if self._inflight.pop(record_id, None) is not None:
+                self._dirty = True
+
+    def release(self, record_id: str):
+        """Processing `record_id` failed: forget its claim so a later copy can own the content."""
+        with self._lock:
+            for key in self._inflight.pop(record_id, []):
+                if self.owners.get(key, [None])[0] == record_id:
+                    del self.owners[key]
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            newest = max((b for _, b in self.owners.values()), default=0)
+            oldest = newest - int(self.retention_s // self.bucket_s)
+            self.owners = {k: v for k, v in self.owners.items() if v[1] >= oldest or v[0] in self._inflight}
+            owners = {k: v for k, v in self.owners.items() if v[0] not in self._inflight}
+            atomic_write_json(self.path, {"bucket_s": self.bucket_s, "owners": owners}, indent=None)
+            self._dirty = False
+
+
+def default_fingerprint_path(output_file: str) -> str:
+    return f"{os.path.splitext(output_file)[0]}.fingerprints.json"
@@ -0,0 +1,168 @@
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Any, Tuple
+
+# Whole-phrase synonyms applied after singularisation
+SYNONYMS = {
+    "muskmelon": "cantaloupe",
+    "rockmelon": "cantaloupe",
+    "porridge": "oatmeal",
+    "yoghurt": "yogurt",
+    "curd": "yogurt",
+    "chapatti": "chapati",
+    "daal": "dal",
+    "garbanzo bean": "chickpea",
+    "aubergine": "eggplant",
+    "courgette": "zucchini",
+    "capsicum": "bell pepper",
+    "prawn": "shrimp",
+}
+
+# Plurals the suffix rules get wrong
+IRREGULAR = {
+    "cookies": "cookie", "pies": "pie", "brownies": "brownie", "smoothies": "smoothie",
+    "leaves": "leaf", "loaves": "loaf", "halves": "half", "knives": "knife",
+    "fries": "fries", "hummus": "hummus", "couscous": "couscous", "asparagus": "asparagus",
+    "oats": "oats", "grits": "grits", "chips": "chips", "greens": "greens", "molasses": "molasses",
+}
+
+# Filler words that never identify a food
+STOPWORDS = {"a", "an", "the", "of", "some", "fresh", "plain", "small", "medium", "large", "piece", "pieces"}
+
+_TOKEN = re.compile(r"[a-z0-9%]+")
+
+
+def singular(word: str) -> str:
+    if word in IRREGULAR:
+        return IRREGULAR[word]
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("oes", "ches", "shes", "xes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def canonical_tokens(name: Optional[str]) -> List[str]:
+    return [singular(t) for t in _TOKEN.findall((name or "").lower()) if t not in STOPWORDS]
+
+
+@lru_cache(maxsize=65536)
+def canonical_name(name: Optional[str]) -> str:
+    """Lower-cased, singular, filler-free form used for cache and table keys."""
+    phrase = " ".join(canonical_tokens(name))
+    return SYNONYMS.get(phrase, phrase)
+
+
+@lru_cache(maxsize=65536)
+def _trigrams(text: str) -> frozenset:
+    padded = f"  {text} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class FoodNameIndex:
+    """
+    Token + trigram inverted index over a list of food names.
+
+    best() scores only names that share at least one token or trigram with
+    the query: token Jaccard catches word-order and extra-word differences,
+    trigram Jaccard catches spelling variants ("oatmeal" / "oat meal").
+    The inverted lists are built on the first query that is not an exact
+    name match, so tables only ever hit exactly never pay for them.
+    """
+
+    def __init__(self, names: List[str]):
+        self.names = [canonical_name(n) for n in names]
+        self._exact: Dict[str, int] = {}
+        for i, name in enumerate(self.names):
+            self._exact.setdefault(name, i)
+        self._tokens: List[set] = []
+        self._grams: List[frozenset] = []
+        self._by_token: Dict[str, List[int]] = {}
+        self._by_gram: Dict[str, List[int]] = {}
+        self._built = False
+        self._lock = threading.Lock()
+
+    def _build(self):
+        with self._lock:
+            if self._built:
+                return
+            for i, name in enumerate(self.names):
+                toks, grams = set(name.split()), _trigrams(name)
+                self._tokens.append(toks)
+                self._grams.append(grams)
+                for t in toks:
+                    self._by_token.setdefault(t, []).append(i)
+                for g in grams:
+                    self._by_gram.setdefault(g, []).append(i)
+            self._built = True
+
+    def scores(self, query: str) -> Dict[int, float]:
+        q = canonical_name(query)
+        if q in self._exact:
+            return {self._exact[q]: 1.0}
+        if not self._built:
+            self._build()
+        q_toks, q_grams = set(q.split()), _trigrams(q)
+        candidates = set()
+        for t in q_toks:
+            candidates.update(self._by_token.get(t, ()))
+        for g in q_grams:
+            candidates.update(self._by_gram.get(g, ()))
+        out = {}
+        for i in candidates:
+            toks, grams = self._tokens[i], self._grams[i]
+            tok_j = len(q_toks & toks) / len(q_toks | toks) if q_toks or toks else 0.0
+            gram_j = len(q_grams & grams) / len(q_grams | grams)
+            out[i] = 0.6 * tok_j + 0.4 * gram_j
+        return out
+
+    def best(self, query: str, min_score: float = 0.3) -> Tuple[Optional[int], float]:
+        scored = self.scores(query)
+        if not scored:
+            return None, 0.0
+        i = max(scored, key=scored.get)
+        return (i, scored[i]) if scored[i] >= min_score else (None, scored[i])
+
+
+@lru_cache(maxsize=1024)
+def index_for(names: Tuple[str, ...]) -> FoodNameIndex:
+    """Shared FoodNameIndex per food-name table (indexes are read-only once built)."""
+    return FoodNameIndex(list(names))
+
+
+def match_items(items: List[Dict[str, Any]], foods: List[Dict[str, Any]],
+                min_score: float = 0.3) -> List[Optional[Dict[str, Any]]]:
+    """
+    Assign each requested item to one returned Nutritionix food.
+
+    Pairs are taken greedily by score so each food is used at most once.
+    Items left without a confident match take the unused food at the same
+    position (else the next unused one), since Nutritionix answers a
+    multi-item query in query order.
+    """
+    if not foods:
+        return [None] * len(items)
+    index = index_for(tuple(f.get("food_name") or "" for f in foods))
+    pairs = []
+    for i, it in enumerate(items):
+        for j, score in index.scores(it.get("name") or "").items():
+            if score >= min_score:
+                pairs.append((score, -abs(i - j), i, j))
+    pairs.sort(reverse=True)
+
+    assigned: List[Optional[int]] = [None] * len(items)
+    used = set()
+    for _, _, i, j in pairs:
+        if assigned[i] is None and j not in used:
+            assigned[i] = j
+            used.add(j)
+    leftover = [j for j in range(len(foods)) if j not in used]
+    for i in range(len(items)):
+        if assigned[i] is None and leftover:
+            j = i if i in leftover else leftover[0]
+            assigned[i] = j
+            leftover.remove(j)
+    return [foods[j] if j is not None else None for j in assigned]
@@ -0,0 +1,484 @@
+import os
+import json
+import bisect
+import codecs
+import hashlib
+from typing import BinaryIO, Dict, Any, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+from store import file_lock, ts_epoch
+
+_decoder = json.JSONDecoder()
+_WS = " \t\n\r"
+
+# Bytes before the end of the last indexed record that must be unchanged to resume from there
+TAIL_BYTES = 256
+# Read from the end of the sidecar to find its last state line
+STATE_READ_BYTES = 4096
+
+
+def _scan_object(f: BinaryIO, start: int = 0, chunk_size: int = 1 << 16) -> Iterator[Tuple[str, Any, int, int]]:
+    """
+    Stream (key, value, value_start, value_end) out of a top-level JSON
+    object, with byte offsets into `f`. With `start` > 0, `f` is read from
+    that offset, which must be the end of a member value (as returned for an
+    earlier member); only the members after it are yielded.
+    """
+    f.seek(start)
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    pos = 0
+    eof = False
+    # Byte offset of buf[mark]; advanced lazily so offsets cost O(bytes read) overall
+    mark = 0
+    mark_bytes = start
+
+    def tell() -> int:
+        nonlocal mark, mark_bytes
+        mark_bytes += len(buf[mark:pos].encode("utf-8"))
+        mark = pos
+        return mark_bytes
+
+    def fill() -> bool:
+        nonlocal buf, pos, eof, mark
+        if eof:
+            return False
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+            return False
+        tell()
+        buf = buf[pos:] + utf8.decode(chunk)
+        pos = mark = 0
+        return True
+
+    def peek() -> str:
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in _WS:
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if not fill():
+                return ""
+
+    def decode():
+        nonlocal pos
+        while True:
+            try:
+                value, end = _decoder.raw_decode(buf, pos)
+                # A number at the buffer edge may be cut short; make sure it is complete
+                if end == len(buf) and not eof and fill():
+                    continue
+                pos = end
+                return value
+            except json.JSONDecodeError:
+                if not fill():
+                    raise
+
+    first = start == 0
+    if first:
+        if peek() != "{":
+            raise ValueError("expected a JSON object at top level")
+        pos += 1
+    while True:
+        c = peek()
+        if c == "}":
+            return
+        if not first:
+            if c != ",":
+                raise ValueError(f"expected ',' or '}}' at byte {tell()}")
+            pos += 1
+            peek()
+        first = False
+        key = decode()
+        if peek() != ":":
+            raise ValueError(f"expected ':' after key {key!r}")
+        pos += 1
+        peek()
+        value_start = tell()
+        value = decode()
+        yield key, value, value_start, tell()
+
+
+def iter_log_records(path: str, chunk_size: int = 1 << 16) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Stream (id, record) pairs out of a top-level JSON object without building
+    the whole dict. Only one record (plus a read-ahead chunk) is held at a time.
+    """
+    with open(path, "rb") as f:
+        try:
+            for key, value, _, _ in _scan_object(f, chunk_size=chunk_size):
+                yield key, value
+        except ValueError as e:
+            raise ValueError(f"{path}: {e}") from e
+
+
+Entry = Tuple[float, str]
+# Sidecar line per log: [epoch, id, user_id, start, length]; start/length are None when unknown
+Row = List[Any]
+
+
+class LogIndex:
+    """
+    Persisted timestamp index over log.json.
+
+    Keeps (epoch, id) pairs sorted globally and per user, the byte span of
+    each record in log.json, and a cursor marking how far processing has got.
+
+    log.json only grows at the end when the API adds a log, so refresh()
+    resumes parsing at the end of the last indexed record (after checking the
+    bytes just before it are unchanged) and reads only the new records. Any
+    other change (deletes, edits) falls back to one streamed rescan.
+
+    The sidecar is JSON lines: one Row per log plus a state line (source
+    stamp, resume offset, cursor, newest log) per save. Saves append;
+    removals and accumulated state lines rewrite it. Opening reads only the
+    last state line, so picking the newest log after an append never loads
+    the per-log lines; anything else loads them on first use.
+    """
+
+    def __init__(self, logs_path: str, index_path: Optional[str] = None, persist: bool = True):
+        self.logs_path = logs_path
+        self.index_path = (index_path or logs_path + ".idx.json") if persist else None
+        self.entries: List[Entry] = []
+        self.by_user: Dict[str, List[Entry]] = {}
+        self.user_of: Dict[str, Optional[str]] = {}
+        self.epoch_of: Dict[str, float] = {}
+        self.span_of: Dict[str, Tuple[int, int]] = {}
+        self.cursor: Optional[Entry] = None
+        self._source: Optional[List[float]] = None
+        self._end: Optional[int] = None  # byte offset just past the last indexed record
+        self._tail: Optional[str] = None  # digest of the TAIL_BYTES before _end
+        self._newest: Optional[Row] = None  # newest log while the rows are not loaded
+        self._count = 0  # logs indexed while the rows are not loaded
+        self._saves = 0  # state lines since the sidecar was last rewritten
+        self._unsaved: List[Row] = []
+        self._loaded = True
+        self._dirty = False
+        self._rewrite = False
+        if self.index_path and os.path.exists(self.index_path):
+            self._open()
+
+    # --- Persistence -----------------------------------------------------
+
+    def _open(self):
+        try:
+            with open(self.index_path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                start = max(0, f.tell() - STATE_READ_BYTES)
+                f.seek(start)
+                lines = f.read().split(b"\n")
+            # Complete last line: the file ends with a newline and the line did not start before `start`
+            state = json.loads(lines[-2]) if lines[-1] == b"" and (len(lines) > 2 or start == 0) else None
+        except (OSError, ValueError, IndexError):
+            state = None
+        if isinstance(state, dict) and "count" in state:
+            self._set_state(state)
+            self._count = state["count"]
+            self._newest = state.get("newest")
+            self._saves = state.get("saves", 1)
+            self._loaded = False
+        else:
+            self._load(read_state=True)
+
+    def _set_state(self, state: Dict[str, Any]):
+        cursor = state.get("cursor")
+        self.cursor = tuple(cursor) if cursor else None
+        self._source = state.get("source")
+        self._end = state.get("end")
+        self._tail = state.get("tail")
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self._load(read_state=False)
+
+    def _load(self, read_state: bool):
+        """Build the entries from the sidecar's rows (plus unsaved ones); `read_state` also takes its last state."""
+        self._loaded = True
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                text = f.read()
+        except OSError as e:
+            logger.warning(f"Could not load log index {self.index_path}: {e}")
+            text = ""
+        if text and not text.endswith("\n"):
+            self._rewrite = True  # torn last line; appending after it would corrupt the next one
+        try:
+            items = json.loads("[" + text.rstrip("\n").replace("\n", ",") + "]")
+        except ValueError:
+            items = []
+            for line in text.splitlines():
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    self._rewrite = True
+        state: Dict[str, Any] = {}
+        for item in items:
+            if isinstance(item, dict):
+                state = item
+                self._saves += read_state
+                if "entries" in item:
+                    # Single-document sidecar of earlier versions: no spans, rescan once
+                    items.extend([epoch, log_id, user_id, None, None] for epoch, log_id, user_id in item["entries"])
+                    state = {**item, "source": None}
+                    self._rewrite = True
+        if read_state:
+            self._set_state(state)
+        rows = [item for item in items if isinstance(item, list) and len(item) == 5] + self._unsaved
+        if len(rows) != len({row[1] for row in rows}):
+            # Two runs appended the same new ids: keep the first line of each
+            rows = list({row[1]: row for row in reversed(rows)}.values())[::-1]
+        self.entries = sorted((epoch, log_id) for epoch, log_id, _, _, _ in rows)
+        self.epoch_of = {log_id: epoch for epoch, log_id, _, _, _ in rows}
+        self.user_of = {log_id: user_id for _, log_id, user_id, _, _ in rows}
+        self.span_of = {log_id: (start, length) for _, log_id, _, start, length in rows if start is not None}
+        self.by_user = {}
+        for entry in self.entries:
+            self.by_user.setdefault(self.user_of[entry[1]], []).append(entry)
+
+    def _row(self, log_id: str) -> Row:
+        start, length = self.span_of.get(log_id, (None, None))
+        return [self.epoch_of[log_id], log_id, self.user_of[log_id], start, length]
+
+    def _state(self) -> Dict[str, Any]:
+        if self._loaded:
+            count = len(self.entries)
+            newest = self._row(self.entries[-1][1]) if self.entries else None
+        else:
+            count, newest = self._count, self._newest
+        return {"source": self._source, "end": self._end, "tail": self._tail,
+                "cursor": list(self.cursor) if self.cursor else None,
+                "newest": newest, "count": count, "saves": self._saves}
+
+    def save(self):
+        if not self.index_path or not (self._dirty or self._rewrite):
+            return
+        with file_lock(self.index_path):
+            if self._rewrite or self._saves >= max(1024, len(self.entries) if self._loaded else self._count):
+                self._ensure_loaded()
+                self._saves = 1
+                lines = [json.dumps(self._row(log_id)) for _, log_id in self.entries]
+                lines.append(json.dumps(self._state()))
+                tmp = f"{self.index_path}.{os.getpid()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.index_path)
+            else:
+                self._saves += 1
+                lines = [json.dumps(row) for row in self._unsaved]
+                lines.append(json.dumps(self._state()))
+                with open(self.index_path, "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+        self._unsaved = []
+        self._dirty = False
+        self._rewrite = False
+
+    # --- Maintenance -----------------------------------------------------
+
+    def _source_stamp(self) -> List[float]:
+        st = os.stat(self.logs_path)
+        return [st.st_size, st.st_mtime]
+
+    def _tail_digest(self, f: BinaryIO, end: int) -> str:
+        start = max(0, end - TAIL_BYTES)
+        f.seek(start)
+        return hashlib.blake2b(f.read(end - start), digest_size=16).hexdigest()
+
+    def _add_many(self, added: List[Row]):
+        """Merge new rows: insort for a handful, one sort for a fresh build."""
+        bulk = len(added) > 8
+        for row in added:
+            epoch, log_id, user_id, start, length = row
+            entry = (epoch, log_id)
+            self.user_of[log_id] = user_id
+            self.epoch_of[log_id] = epoch
+            if start is not None:
+                self.span_of[log_id] = (start, length)
+            entries = self.by_user.setdefault(user_id, [])
+            if bulk:
+                self.entries.append(entry)
+                entries.append(entry)
+            else:
+                bisect.insort(self.entries, entry)
+                bisect.insort(entries, entry)
+        if bulk:
+            self.entries.sort()
+            for entries in self.by_user.values():
+                entries.sort()
+        self._unsaved.extend(added)
+        first = min((row[0], row[1]) for row in added)
+        if self.cursor is not None and first <= self.cursor:
+            # Late arrival behind the cursor: rewind so pending() still sees it
+            i = bisect.bisect_left(self.entries, first)
+            self.cursor = self.entries[i - 1] if i else None
+
+    def _add_appended(self, added: List[Row]):
+        """Rows parsed after _end: kept aside (no load) unless they land behind the cursor."""
+        first = min((row[0], row[1]) for row in added)
+        if self._loaded or (self.cursor is not None and first <= self.cursor):
+            self._ensure_loaded()
+            added = [row for row in added if row[1] not in self.user_of]
+            if added:
+                self._add_many(added)
+            return
+        self._unsaved.extend(added)
+        self._count += len(added)
+        candidates = added + [self._newest] if self._newest else added
+        self._newest = max(candidates, key=lambda row: (row[0], row[1]))
+
+    def _remove(self, removed: set):
+        self.entries = [e for e in self.entries if e[1] not in removed]
+        for log_id in removed:
+            self.epoch_of.pop(log_id, None)
+            self.span_of.pop(log_id, None)
+        for user_id in {self.user_of.pop(log_id) for log_id in removed}:
+            entries = [e for e in self.by_user[user_id] if e[1] not in removed]
+            if entries:
+                self.by_user[user_id] = entries
+            else:
+                del self.by_user[user_id]
+        self._rewrite = True
+
+    @staticmethod
+    def _new_row(log_id: str, record: Dict[str, Any], span: Optional[Tuple[int, int]]) -> Row:
+        start, length = span or (None, None)
+        return [ts_epoch(record.get("timestamp")), log_id, (record.get("metadata") or {}).get("user_id"), start, length]
+
+    def _append_scan(self, f: BinaryIO) -> Optional[List[Tuple[str, Dict[str, Any], int, int]]]:
+        """Records after _end if everything up to it is unchanged, else None."""
+        if self._end is None or self._tail is None or self._tail_digest(f, self._end) != self._tail:
+            return None
+        try:
+            return list(_scan_object(f, self._end))
+        except ValueError as e:
+            logger.info(f"Log index: cannot resume {self.logs_path} at byte {self._end} ({e}); rescanning")
+            return None
+
+    def refresh(self, logs: Optional[Dict[str, Any]] = None) -> int:
+        """
+        Sync with log.json: index records added since the last refresh and
+        drop ids that are gone (deleted through the API). Pass an
+        already-loaded dict to sync from it instead of the file (no record
+        spans are kept then). Returns the number of new records indexed.
+        """
+        stamp = self._source_stamp()
+        if logs is not None:
+            self._end = self._tail = None
+            return self._sync(((log_id, record, None) for log_id, record in logs.items()), stamp)
+        if stamp == self._source:
+            return 0
+        with open(self.logs_path, "rb") as f:
+            appended = self._append_scan(f) if self._source and stamp[0] > self._source[0] else None
+            if appended is not None:
+                if appended:
+                    self._add_appended([self._new_row(log_id, record, (start, end - start))
+                                        for log_id, record, start, end in appended])
+                    self._end = appended[-1][3]
+                    self._tail = self._tail_digest(f, self._end)
+                self._source = stamp
+                self._dirty = True
+                return len(appended)
+
+            def scanned():
+                for log_id, record, start, end in _scan_object(f):
+                    self._end = end
+                    yield log_id, record, (start, end - start)
+
+            self._end = None
+            added = self._sync(scanned(), stamp)
+            self._tail = self._tail_digest(f, self._end) if self._end is not None else None
+        return added
+
+    def _sync(self, records, stamp: List[float]) -> int:
+        """Full sync from (id, record, span) triples: add new ids, drop missing ones, update moved spans."""
+        self._ensure_loaded()
+        seen = set()
+        added = []
+        for log_id, record, span in records:
+            seen.add(log_id)
+            if log_id not in self.user_of:
+                added.append(self._new_row(log_id, record, span))
+            elif span is not None and self.span_of.get(log_id) != span:
+                self.span_of[log_id] = span
+                self._rewrite = True
+        removed = self.user_of.keys() - seen
+        if removed:
+            self._remove(removed)
+        if added:
+            self._add_many(added)
+        if added or removed or stamp != self._source:
+            self._source = stamp
+            self._dirty = True
+        return len(added)
+
+    # --- Queries ---------------------------------------------------------
+
+    def latest(self, user_id: Optional[str] = None) -> Optional[str]:
+        if user_id is None and not self._loaded:
+            return self._newest[1] if self._newest else None
+        self._ensure_loaded()
+        entries = self.entries if user_id is None else self.by_user.get(user_id, [])
+        return entries[-1][1] if entries else None
+
+    def window(self, start: Optional[str] = None, end: Optional[str] = None,
+               user_id: Optional[str] = None) -> List[str]:
+        """Ids with start <= timestamp < end, oldest first."""
+        self._ensure_loaded()
+        entries = self.entries if user_id is None else self.by_user.get(user_id, [])
+        lo = bisect.bisect_left(entries, (ts_epoch(start), "")) if start else 0
+        hi = bisect.bisect_left(entries, (ts_epoch(end), "")) if end else len(entries)
+        return [log_id for _, log_id in entries[lo:hi]]
+
+    def _span(self, log_id: str) -> Optional[Tuple[int, int]]:
+        if not self._loaded:
+            rows = self._unsaved + [self._newest] if self._newest else self._unsaved
+            for row in rows:
+                if row[1] == log_id and row[3] is not None:
+                    return row[3], row[4]
+            self._ensure_loaded()
+        return self.span_of.get(log_id)
+
+    def load_records(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Read just these records from log.json by their byte spans. Ids without
+        a usable span (unknown, or moved since the last refresh) are found by
+        one streamed scan.
+        """
+        found: Dict[str, Dict[str, Any]] = {}
+        with open(self.logs_path, "rb") as f:
+            for log_id in ids:
+                span = self._span(log_id)
+                if span is None:
+                    continue
+                f.seek(span[0])
+                try:
+                    record = json.loads(f.read(span[1]))
+                except ValueError:
+                    continue
+                if isinstance(record, dict) and record.get("id", log_id) == log_id:
+                    found[log_id] = record
+        missing = set(ids) - found.keys()
+        if missing:
+            for log_id, record in iter_log_records(self.logs_path):
+                if log_id in missing:
+                    found[log_id] = record
+        return {log_id: found[log_id] for log_id in ids if log_id in found}
+
+    def pending(self, processed) -> List[str]:
+        """Ids after the cursor that are not in `processed`, oldest first."""
+        self._ensure_loaded()
+        start = bisect.bisect_right(self.entries, self.cursor) if self.cursor else 0
+        return [log_id for _, log_id in self.entries[start:] if log_id not in processed]
+
+    def advance(self, processed):
+        """Move the cursor over the leading run of processed ids."""
+        self._ensure_loaded()
+        i = bisect.bisect_right(self.entries, self.cursor) if self.cursor else 0
+        while i < len(self.entries) and self.entries[i][1] in processed:
+            self.cursor = self.entries[i]
+            self._dirty = True
+            i += 1
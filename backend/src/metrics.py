@@ -0,0 +1,190 @@
+import os
+import io
+import time
+import json
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, Optional, Tuple
+
+from loguru import logger
+
+from store import atomic_write_json
+
+# Pipeline stages timed by span(); other names are accepted but these are always exported
+STAGES = ("load", "pick", "transcribe", "parse", "enrich", "save")
+PREFIX = "pipeline"
+
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, Any]) -> _Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _prom_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        f'{k}="' + v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for k, v in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class Metrics:
+    """
+    In-process stage timings and counters for one pipeline run or worker.
+
+    span(stage) records wall time per stage (count, sum, max); incr() bumps a
+    labelled counter such as api_calls{api="whisper"} or tokens{kind="prompt"}.
+    Both are a dict update under a lock, cheap enough to leave on. Results
+    export as Prometheus text format or JSON.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.spans: Dict[str, list] = {}  # stage -> [count, total_s, max_s]
+        self.counters: Dict[_Key, float] = {}
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            entry = self.spans.get(stage)
+            if entry is None:
+                self.spans[stage] = [1, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = max(entry[2], seconds)
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def incr(self, name: str, value: float = 1, **labels: Any):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self.spans, self.counters = {}, {}
+            self.started_at = time.time()
+
+    # --- Export ----------------------------------------------------------
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = {stage: list(v) for stage, v in self.spans.items()}
+            counters = dict(self.counters)
+        for stage in STAGES:
+            spans.setdefault(stage, [0, 0.0, 0.0])
+        return {
+            "uptime_s": round(time.time() - self.started_at, 3),
+            "stages": {
+                stage: {"count": n, "total_s": round(total, 6), "max_s": round(peak, 6),
+                        "mean_s": round(total / n, 6) if n else 0.0}
+                for stage, (n, total, peak) in spans.items()
+            },
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(counters.items())
+            ],
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self) -> str:
+        snap = self.snapshot()
+        lines = [
+            f"# HELP {PREFIX}_stage_seconds Wall time spent per pipeline stage.",
+            f"# TYPE {PREFIX}_stage_seconds summary",
+        ]
+        for stage, s in snap["stages"].items():
+            label = _prom_labels((("stage", stage),))
+            lines.append(f"{PREFIX}_stage_seconds_count{label} {s['count']}")
+            lines.append(f"{PREFIX}_stage_seconds_sum{label} {s['total_s']}")
+        lines.append(f"# TYPE {PREFIX}_stage_seconds_max gauge")
+        for stage, s in snap["stages"].items():
+            lines.append(f"{PREFIX}_stage_seconds_max{_prom_labels((('stage', stage),))} {s['max_s']}")
+        seen = set()
+        for c in snap["counters"]:
+            metric = f"{PREFIX}_{c['name']}_total"
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_prom_labels(tuple(sorted(c['labels'].items())))} {c['value']}")
+        lines.append(f"# TYPE {PREFIX}_uptime_seconds gauge")
+        lines.append(f"{PREFIX}_uptime_seconds {snap['uptime_s']}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: str):
+        """Write `path` as Prometheus text when it ends in .prom, else as JSON (atomically)."""
+        if path.endswith(".prom"):
+            directory = os.path.dirname(os.path.abspath(path))
+            tmp = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus())
+            os.replace(tmp, path)
+        else:
+            atomic_write_json(path, self.snapshot())
+
+    def summary(self) -> str:
+        """One-line stage breakdown for the run log."""
+        stages = self.snapshot()["stages"]
+        return ", ".join(f"{stage} {s['total_s']:.2f}s/{s['count']}" for stage, s in stages.items() if s["count"])
+
+
+# Process-wide registry used by the pipeline modules
+METRICS = Metrics()
+span = METRICS.span
+incr = METRICS.incr
+
+
+@contextmanager
+def profiling(mode: Optional[str], out: Optional[str] = None, top: int = 25) -> Iterator[None]:
+    """
+    Optional per-run profiler: mode "cpu" runs cProfile (stats dumped to
+    `out` for pstats/snakeviz), "memory" runs tracemalloc (top allocation
+    sites written to `out`). Either way the top entries are logged.
+    Does nothing when mode is None.
+    """
+    if not mode:
+        yield
+        return
+    if mode == "cpu":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            if out:
+                profiler.dump_stats(out)
+            buf = io.StringIO()
+            pstats.Stats(profiler, stream=buf).sort_stats("cumulative").print_stats(top)
+            logger.info(f"Profile (cpu, top {top} by cumulative time):\n{buf.getvalue()}")
+    elif mode == "memory":
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            stats = snapshot.statistics("lineno")[:top]
+            report = "\n".join(str(s) for s in stats)
+            if out:
+                with open(out, "w", encoding="utf-8") as f:
+                    f.write(f"current {current} bytes, peak {peak} bytes\n{report}\n")
+            logger.info(f"Profile (memory): current {current / 1e6:.1f} MB, peak {peak / 1e6:.1f} MB\n{report}")
+    else:
+        raise ValueError(f"Unknown profiling mode: {mode!r} (expected 'cpu' or 'memory')")
@@ -0,0 +1,270 @@
+from typing import Any, Callable, Dict, FrozenSet, Tuple
+
+# Per-item nutrient fields, in output order
+MACRO_KEYS = ("calories", "carbs_g", "protein_g", "fat_g", "fiber_g", "sugar_g", "sodium_mg")
+
+
+class _Unset:
+    __slots__ = ()
+
+    def __repr__(self):
+        return "UNSET"
+
+
+UNSET = _Unset()
+# Key-order tuples are interned so records with the same shape share one tuple
+_ORDERS: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+
+
+def _order(keys) -> Tuple[str, ...]:
+    keys = tuple(keys)
+    return _ORDERS.setdefault(keys, keys)
+
+
+# --- Field coercion ------------------------------------------------------
+# Each returns the value itself when it already has an accepted shape, so the
+# common case costs one type() check and shares the source dict unchanged.
+
+def _number(value: Any) -> Any:
+    """int/float/None as is; bools as 0/1; numeric strings kept (consumers float() them), others None."""
+    kind = type(value)
+    if kind is int or kind is float or value is None:
+        return value
+    if kind is bool:
+        return int(value)
+    if kind is str:
+        try:
+            float(value)
+            return value
+        except ValueError:
+            return None
+    return None
+
+
+def _text(value: Any) -> Any:
+    if value is None or type(value) is str:
+        return value
+    if type(value) in (int, float):
+        return str(value)
+    return None
+
+
+def _object(value: Any) -> Any:
+    return value if value is None or type(value) is dict else None
+
+
+def _list(value: Any) -> Any:
+    """Lists as is; null means empty and a lone object is a one-item list."""
+    if type(value) is list or type(value) is tuple:
+        return value
+    if type(value) is dict:
+        return [value]
+    return []
+
+
+class ModelError(ValueError):
+    """A payload does not have the shape the pipeline expects."""
+
+
+class _Model:
+    """
+    Immutable-by-convention record with one slot per known field.
+
+    Unknown keys are kept in `extra` and the original key order in `_order`,
+    so to_dict() reproduces the input JSON exactly. Fields with a coercer in
+    TYPES are normalised on load instead of rejected (LLM replies are not
+    always well-formed: null item lists, bools for numbers); only values that
+    needed it change, in a copy of the source dict. NESTED fields (logs,
+    items, macros) are loaded into their models on first access, so parts a
+    stage never looks at cost nothing.
+
+    replace() returns a new object sharing every unchanged value with the
+    original (copy-on-write instead of deep copies), and to_dict() of an
+    unchanged object returns the dict it was loaded from. Neither the models
+    nor the dicts they were loaded from or serialised to may be mutated.
+    """
+
+    __slots__ = ("extra", "_order", "_src", "_changed")
+    FIELDS: Tuple[str, ...] = ()
+    # field -> coercer returning the value unchanged or normalised (see _number/_text/...)
+    TYPES: Dict[str, Callable[[Any], Any]] = {}
+    # fields loaded lazily into nested models by _load()
+    NESTED: Tuple[str, ...] = ()
+    _FIELDSET: FrozenSet[str] = frozenset()
+    _SCALARS: Tuple[str, ...] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._FIELDSET = frozenset(cls.FIELDS)
+        cls._SCALARS = tuple(f for f in cls.FIELDS if f not in cls.NESTED)
+
+    def _load(self, key: str, value: Any) -> Any:
+        return value
+
+    @classmethod
+    def from_dict(cls, data: Any, path: str = "") -> "_Model":
+        if isinstance(data, cls):
+            return data
+        if not isinstance(data, dict):
+            raise ModelError(f"{path or cls.__name__}: expected an object, got {type(data).__name__}")
+        src = data
+        for key, coerce in cls.TYPES.items():
+            value = data.get(key, UNSET)
+            if value is UNSET:
+                continue
+            fixed = coerce(value)
+            if fixed is not value:
+                if src is data:
+                    src = dict(data)
+                src[key] = fixed
+        obj = cls.__new__(cls)
+        for key in cls._SCALARS:
+            setattr(obj, key, src.get(key, UNSET))
+        unknown = data.keys() - cls._FIELDSET
+        obj.extra = {k: v for k, v in data.items() if k in unknown} if unknown else None
+        obj._order = _order(data)
+        obj._src = src
+        obj._changed = False
+        return obj
+
+    def __getattr__(self, name: str) -> Any:
+        # Only reached for NESTED slots that haven't been loaded yet
+        if name not in type(self).NESTED:
+            raise AttributeError(name)
+        value = self._src.get(name, UNSET)
+        if value is not UNSET and value is not None:
+            try:
+                value = self._load(name, value)
+            except ModelError as e:
+                raise ModelError(f"{type(self).__name__}.{name}: {e}") from None
+        setattr(self, name, value)
+        return value
+
+    def _peek(self, name: str) -> Any:
+        """Slot value, or the raw source value for a NESTED field not loaded yet."""
+        try:
+            return object.__getattribute__(self, name)
+        except AttributeError:
+            return self._src.get(name, UNSET)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in self._FIELDSET:
+            value = getattr(self, key)
+            return default if value is UNSET else value
+        return (self.extra or {}).get(key, default)
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key, UNSET)
+        if value is UNSET:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: str) -> bool:
+        if key in self._FIELDSET:
+            return self._peek(key) is not UNSET
+        return key in (self.extra or {})
+
+    def replace(self, **changes: Any) -> "_Model":
+        obj = self.__class__.__new__(self.__class__)
+        for key in self._SCALARS:
+            setattr(obj, key, getattr(self, key))
+        for name in self.NESTED:
+            try:
+                setattr(obj, name, object.__getattribute__(self, name))
+            except AttributeError:
+                pass  # still lazy; obj loads it from the shared _src
+        extra = self.extra
+        added = [k for k in changes if k not in self._order]
+        for key, value in changes.items():
+            if key in self._FIELDSET:
+                setattr(obj, key, value)
+            else:
+                extra = {**(extra or {}), key: value}
+        obj.extra = extra
+        obj._order = _order(self._order + tuple(added)) if added else self._order
+        obj._src = self._src
+        obj._changed = True
+        return obj
+
+    def to_dict(self) -> Dict[str, Any]:
+        if not self._changed:
+            return self._src
+        out: Dict[str, Any] = {}
+        extra = self.extra
+        fields, nested = self._FIELDSET, self.NESTED
+        for key in self._order:
+            if key in fields:
+                value = self._peek(key) if key in nested else getattr(self, key)
+                if value is UNSET:
+                    continue
+                if isinstance(value, _Model):
+                    value = value.to_dict()
+                elif type(value) is tuple:
+                    value = [v.to_dict() if isinstance(v, _Model) else v for v in value]
+            elif extra and key in extra:
+                value = extra[key]
+            else:
+                continue
+            out[key] = value
+        return out
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, _Model) and self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.to_dict()!r})"
+
+
+class Macros(_Model):
+    __slots__ = MACRO_KEYS
+    FIELDS = MACRO_KEYS
+    TYPES = {k: _number for k in MACRO_KEYS}
+
+
+class FoodItem(_Model):
+    __slots__ = ("name", "quantity", "unit", "macros", "source_ref")
+    FIELDS = ("name", "quantity", "unit", "macros", "source_ref")
+    TYPES = {"name": _text, "quantity": _number, "unit": _text, "macros": _object}
+    NESTED = ("macros",)
+
+    def _load(self, key: str, value: Any) -> Any:
+        return Macros.from_dict(value, "")
+
+
+class ExerciseItem(_Model):
+    __slots__ = ("activity", "duration_min", "effort_level", "met", "calories_burned")
+    FIELDS = ("activity", "duration_min", "effort_level", "met", "calories_burned")
+    TYPES = {"activity": _text, "duration_min": _number, "effort_level": _text,
+             "met": _number, "calories_burned": _number}
+
+
+ITEM_TYPES = {"food": FoodItem, "exercise": ExerciseItem}
+
+
+class ProposedLog(_Model):
+    __slots__ = ("type", "items", "parser_confidence")
+    FIELDS = ("type", "items", "parser_confidence")
+    TYPES = {"type": _text, "items": _list, "parser_confidence": _number}
+    NESTED = ("items",)
+
+    def _load(self, key: str, value: Any) -> Any:
+        item_cls = ITEM_TYPES.get(self.type)
+        if item_cls is None:
+            return tuple(value)
+        return tuple(item_cls.from_dict(it, f"[{i}]") for i, it in enumerate(value))
+
+
+class Payload(_Model):
+    """One enriched (or to-be-enriched) log entry as written to output_log.json."""
+
+    __slots__ = ("user_id", "timestamp", "input_method", "id", "file_name", "transcript", "proposed_logs")
+    FIELDS = ("user_id", "timestamp", "input_method", "id", "file_name", "transcript", "proposed_logs")
+    TYPES = {"proposed_logs": _list}
+    NESTED = ("proposed_logs",)
+
+    def _load(self, key: str, value: Any) -> Any:
+        return tuple(ProposedLog.from_dict(log, f"[{i}]") for i, log in enumerate(value))
+
+    @property
+    def logs(self) -> Tuple[ProposedLog, ...]:
+        return self.get("proposed_logs") or ()
@@ -0,0 +1,95 @@
+import os
+import json
+from typing import Dict, List, Optional, Any
+
+import numpy as np
+
+from calculator import _item_quantity, _normalize_unit
+from model import MACRO_KEYS
+from foodmatch import canonical_name
+
+DEFAULT_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "nutrition_table.json")
+
+# Fixed conversions to grams (mass) or millilitres (volume)
+MASS_G = {"g": 1.0, "kg": 1000.0, "mg": 0.001, "oz": 28.3495, "lb": 453.592}
+VOLUME_ML = {"ml": 1.0, "l": 1000.0, "cup": 240.0, "tbsp": 14.787, "tsp": 4.929, "fl oz": 29.574}
+# Food-specific portions; each maps to a column of the table, in fallback order
+PORTION_COLUMNS = {
+    "count": ("unit_g", "serving_g"),
+    "serving": ("serving_g", "unit_g"),
+    "bowl": ("serving_g", "unit_g"),
+    "plate": ("serving_g", "unit_g"),
+    "slice": ("slice_g", "unit_g"),
+}
+
+
+class LocalNutritionDB:
+    """
+    Bundled food table for offline macro lookup.
+
+    Macros per 100 g are held in one (n_foods, len(MACRO_KEYS)) array and the
+    per-food portion weights (unit, serving, slice) and density in parallel
+    1-D arrays, so a whole list of items resolves with a few vectorised ops.
+    Names are matched after foodmatch.canonical_name(); anything unknown (or
+    in a unit the food has no weight for) is reported as a miss.
+    """
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.names = [r["name"] for r in rows]
+        self.per_100g = np.array([[float(r["per_100g"].get(k) or 0.0) for k in MACRO_KEYS] for r in rows], dtype=np.float64)
+        self.columns = {
+            col: np.array([np.nan if r.get(col) is None else float(r[col]) for r in rows], dtype=np.float64)
+            for col in ("unit_g", "serving_g", "slice_g", "density_g_per_ml")
+        }
+        self._row: Dict[str, int] = {}
+        for i, r in enumerate(rows):
+            for alias in [r["name"], *r.get("aliases", [])]:
+                self._row.setdefault(canonical_name(alias), i)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_TABLE) -> "LocalNutritionDB":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def row_for(self, name: Optional[str]) -> Optional[int]:
+        return self._row.get(canonical_name(name))
+
+    def _grams(self, rows: np.ndarray, units: List[str], qty: np.ndarray) -> np.ndarray:
+        """Grams for each (row, unit, quantity); NaN where the unit can't be converted."""
+        per_unit = np.full(len(rows), np.nan)
+        for unit in set(units):
+            mask = np.array([u == unit for u in units])
+            r = rows[mask]
+            if unit in MASS_G:
+                per_unit[mask] = MASS_G[unit]
+            elif unit in VOLUME_ML:
+                per_unit[mask] = VOLUME_ML[unit] * self.columns["density_g_per_ml"][r]
+            elif unit in PORTION_COLUMNS:
+                primary, fallback = PORTION_COLUMNS[unit]
+                grams = self.columns[primary][r]
+                per_unit[mask] = np.where(np.isnan(grams), self.columns[fallback][r], grams)
+        return per_unit * qty
+
+    def resolve_many(self, items: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+        """Enriched copy of each item, or None where the table can't answer it."""
+        results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        idx = [i for i, it in enumerate(items) if self.row_for(it.get("name")) is not None]
+        if not idx:
+            return results
+        rows = np.array([self.row_for(items[i].get("name")) for i in idx], dtype=np.intp)
+        units = [_normalize_unit(items[i].get("unit")) for i in idx]
+        qty = np.array([_item_quantity(items[i]) for i in idx], dtype=np.float64)
+        grams = self._grams(rows, units, qty)
+        macros = np.round(self.per_100g[rows] * (grams / 100.0)[:, None], 2)
+        for j, i in enumerate(idx):
+            if np.isnan(grams[j]):
+                continue
+            results[i] = {
+                **items[i],
+                "macros": dict(zip(MACRO_KEYS, macros[j].tolist())),
+                "source_ref": {"provider": "local", "id": self.names[rows[j]]},
+            }
+        return results
@@ -1,13 +1,24 @@
 import os
 import json
+import math
 from loguru import logger
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 
-from transcription import transcribe_audio
-from classifier import parse_with_llm
-from calculator import NutritionixClient, enrich_payload
+from transcription import transcribe_audio, transcript_cache_stats, save_transcript_cache
+import classifier
+from classifier import parse_transcript, parse_transcripts, parse_cache_stats, save_parse_cache, LLM_CONFIDENCE
+from calculator import NutritionixClient, NutritionCache, EnrichmentScheduler, enrich_payload
+from nutrition_db import LocalNutritionDB
+from store import atomic_write_json, open_output_store
+from logindex import LogIndex
+from exercise_engine import default_snapshot_path, recompute_changed
+from rollups import Rollups, default_rollup_path
+from metrics import METRICS, span, profiling
+from fingerprint import FingerprintIndex, default_fingerprint_path, link_duplicate
 
 ISO_FORMATS = [
     "%Y-%m-%dT%H:%M:%S.%fZ",
@@ -15,20 +26,26 @@ ISO_FORMATS = [
 ]
 
 def _parse_ts(ts: str) -> datetime:
+    # Fast path: fromisoformat handles both ISO_FORMATS on Python 3.11+
+    try:
+        dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+        return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+    except ValueError:
+        pass
     for fmt in ISO_FORMATS:
         try:
             return datetime.strptime(ts, fmt).replace(tzinfo=timezone.utc)
         except Exception:
             continue
-    # Last resort: let fromisoformat handle if possible
-    try:
-        return datetime.fromisoformat(ts.replace("Z","+00:00"))
-    except Exception as e:
-        raise ValueError(f"Unrecognized timestamp format: {ts}") from e
+    raise ValueError(f"Unrecognized timestamp format: {ts}")
 
-def pick_latest_log(logs: Dict[str, Any]) -> Dict[str, Any]:
+def pick_latest_log(logs: Dict[str, Any], index: Optional[LogIndex] = None, user_id: Optional[str] = None) -> Dict[str, Any]:
     # logs is a dict of id -> record
-    records = list(logs.values())
+    if index is not None:
+        log_id = index.latest(user_id)
+        if log_id is None:
+            raise KeyError(f"No logs found for user_id {user_id}")
+        return logs[log_id]
 
     def get_timestamp(record):
         # Use the top-level timestamp field
@@ -37,9 +54,12 @@ def pick_latest_log(logs: Dict[str, Any]) -> Dict[str, Any]:
             return _parse_ts(ts)
         # If no timestamp found, return epoch
         return datetime.fromtimestamp(0, tz=timezone.utc)
-    
-    records.sort(key=get_timestamp, reverse=True)
-    return records[0]
+
+    records = logs.values()
+    if user_id is not None:
+        records = [r for r in records if r.get("metadata", {}).get("user_id") == user_id]
+    # Only the newest record is needed, so a single max() pass instead of a sort
+    return max(records, key=get_timestamp)
 
 def load_profile(profiles: Dict[str, Any], user_id: str) -> Dict[str, Any]:
     rec = profiles.get(user_id)
@@ -56,12 +76,12 @@ def load_profile(profiles: Dict[str, Any], user_id: str) -> Dict[str, Any]:
         "name": md.get("name"),
     }
 
-def build_payload(metadata: dict, parsed: dict) -> dict:
+def build_payload(metadata: dict, parsed: dict, confidence: float = LLM_CONFIDENCE) -> dict:
     return {
         **metadata,
         "proposed_logs": [
-            {"type": "exercise", "items": parsed.get("exercise", {}).get("items", []), "parser_confidence": 0.9},
-            {"type": "food", "items": parsed.get("food", {}).get("items", []), "parser_confidence": 0.9},
+            {"type": "exercise", "items": parsed.get("exercise", {}).get("items", []), "parser_confidence": confidence},
+            {"type": "food", "items": parsed.get("food", {}).get("items", []), "parser_confidence": confidence},
         ]
     }
 
@@ -78,25 +98,17 @@ def load_output_log(output_file: str) -> Dict[str, Any]:
 
 
 def save_output_log(output_file: str, output_data: Dict[str, Any]):
-    """Save output_log.json with the new data"""
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(output_data, f, indent=2)
-
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--logs", required=True, help="Path to log.json (dict keyed by log id)")
-    ap.add_argument("--profiles", required=True, help="Path to profile.json (dict keyed by userId)")
-    ap.add_argument("--uploads-dir", default=".", help="Base directory where audio/photo files are stored")
-    ap.add_argument("--output_log", required=True, help="Path to output_log.json (dict keyed by log id)")
-    args = ap.parse_args()
+    """Save output_log.json with the new data (temp file + rename, never half-written)"""
+    atomic_write_json(output_file, output_data)
 
-    with open(args.logs, "r", encoding="utf-8") as f:
-        logs = json.load(f)
-    with open(args.profiles, "r", encoding="utf-8") as f:
-        profiles = json.load(f)
-
-    last_record = pick_latest_log(logs)
-    md = last_record.get("metadata", {})
+def load_transcript(
+    record: Dict[str, Any],
+    uploads_dir: str,
+    limits: Optional[Dict[str, threading.BoundedSemaphore]] = None,
+) -> Dict[str, Any]:
+    """Transcribe (voice) or copy (text) one log record; returns the payload metadata incl. transcript."""
+    limits = limits or {}
+    md = record.get("metadata", {})
 
     user_id =  md.get("user_id")
     input_method = md.get("input_method")
@@ -104,57 +116,394 @@ def main():
     file_name = md.get("file_name")
     content_preview = md.get("content_preview")
 
-    profile = load_profile(profiles, user_id)
-
-    output_data = load_output_log(args.output_log)
-
     # Get transcript
     transcript = None
     if input_method == "voice":
-        audio_path = os.path.join(args.uploads_dir, "audio", file_name) if file_name else None
+        audio_path = os.path.join(uploads_dir, "audio", file_name) if file_name else None
         if not audio_path or not os.path.exists(audio_path):
             raise FileNotFoundError(f"Audio file not found at {audio_path}.")
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise RuntimeError("OPENAI_API_KEY not set for transcription")
-        transcript = transcribe_audio(audio_path, api_key)
+        # The OpenAI limit is taken per Whisper request (long audio sends several)
+        with span("transcribe"):
+            transcript = transcribe_audio(audio_path, api_key, gate=limits.get("openai"))
     else: 
         transcript = content_preview or ""
 
-    metadata = {
+    return {
         "user_id": user_id,
         "timestamp": timestamp,
         "input_method": input_method,
-        "id": last_record.get("id"),
+        "id": record.get("id"),
         "file_name": file_name,
         "transcript": transcript,
     }
 
-    # Parse with LLM
-    parsed = parse_with_llm(transcript)
-    if isinstance(parsed, str):
-        parsed = json.loads(parsed)
 
-    payload = build_payload(metadata, parsed)
+def prepare_record(
+    record: Dict[str, Any],
+    profiles: Dict[str, Any],
+    uploads_dir: str,
+    limits: Optional[Dict[str, threading.BoundedSemaphore]] = None,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Transcribe and parse one log record; returns (payload, profile) ready for enrichment."""
+    limits = limits or {}
+    profile = load_profile(profiles, record.get("metadata", {}).get("user_id"))
+    metadata = load_transcript(record, uploads_dir, limits)
+
+    # Parse: rule-based fast path, LLM below the confidence threshold
+    with span("parse"):
+        parsed, confidence = parse_transcript(metadata["transcript"], llm_gate=limits.get("openai"))
+        if isinstance(parsed, str):
+            parsed = json.loads(parsed)
+
+    return build_payload(metadata, parsed, confidence), profile
+
 
-    # Enrichment
-    nx = None
+def process_record(
+    record: Dict[str, Any],
+    profiles: Dict[str, Any],
+    uploads_dir: str,
+    nx: Optional[NutritionixClient] = None,
+    limits: Optional[Dict[str, threading.BoundedSemaphore]] = None,
+    local_db: Optional[LocalNutritionDB] = None,
+) -> Dict[str, Any]:
+    """Run one log record through transcribe -> parse_transcript -> enrich_payload."""
+    payload, profile = prepare_record(record, profiles, uploads_dir, limits)
+    # Enrichment (the Nutritionix transport bounds its own concurrency)
+    with span("enrich"):
+        return enrich_payload(payload, profile, nx, local_db)
+
+
+def make_nutritionix_client(cache_path: Optional[str] = "", max_concurrency: int = 2) -> Optional[NutritionixClient]:
+    """Client from env credentials; cache_path "" uses the default cache file, None disables caching."""
     app_id = os.getenv("NUTRITIONIX_APP_ID")
     app_key = os.getenv("NUTRITIONIX_APP_KEY")
     if app_id and app_key:
         try:
-            nx = NutritionixClient(app_id=app_id, app_key=app_key)
+            cache = None
+            if cache_path is not None:
+                cache = NutritionCache(cache_path) if cache_path else NutritionCache.default()
+            return NutritionixClient(app_id=app_id, app_key=app_key, cache=cache, max_concurrency=max_concurrency)
         except Exception as e:
             logger.warning(f"Warning: Nutritionix not initialized: {e}")
+    return None
+
+
+def pending_log_ids(logs: Dict[str, Any], output_data, index: Optional[LogIndex] = None) -> List[str]:
+    """Ids present in log.json but missing from the output store, oldest first."""
+    if index is not None:
+        return index.pending(output_data)
+    pending = [log_id for log_id in logs if log_id not in output_data]
+
+    def get_timestamp(log_id):
+        ts = logs[log_id].get("timestamp")
+        return _parse_ts(ts) if ts else datetime.fromtimestamp(0, tz=timezone.utc)
+
+    pending.sort(key=get_timestamp)
+    return pending
+
+
+def run_batch(
+    logs: Dict[str, Any],
+    profiles: Dict[str, Any],
+    uploads_dir: str,
+    store,
+    workers: int = 8,
+    max_openai: int = 4,
+    checkpoint_every: int = 100,
+    index: Optional[LogIndex] = None,
+    nx: Optional[NutritionixClient] = None,
+    local_db: Optional[LocalNutritionDB] = None,
+    max_query_items: int = 20,
+    max_query_chars: int = 500,
+    llm_batch_tokens: int = 6000,
+    llm_batch_size: int = 25,
+    fingerprints: Optional[FingerprintIndex] = None,
+) -> Dict[str, int]:
+    """
+    Backfill every log that has no entry in the output store yet.
+
+    Pending logs are handled in windows of `checkpoint_every` records.
+    Transcription runs on a thread pool with OpenAI calls behind a shared
+    semaphore. Transcripts the rule parser can't handle confidently are sent
+    to the LLM packed several per request (`llm_batch_tokens` estimated
+    tokens, at most `llm_batch_size` logs). The window's food items then go through one
+    EnrichmentScheduler pass, so repeated foods cost one Nutritionix lookup
+    and queries are packed up to `max_query_items`/`max_query_chars`. The
+    store is flushed after each window, never per record.
+
+    With `fingerprints`, logs repeating an earlier log's content (same user,
+    seconds apart) are not run again: once the original is stored they get a
+    copy of its output marked "duplicate_of". If the original fails, its
+    duplicates are processed in a later pass instead.
+    """
+    with span("pick"):
+        pending = pending_log_ids(logs, store, index)
+    logger.info(f"Batch: {len(pending)} unprocessed logs ({len(store)} already done)")
+    if not pending:
+        return {"pending": 0, "done": 0, "failed": 0, "linked": 0}
+
+    limits = {"openai": threading.BoundedSemaphore(max(1, max_openai))}
+    scheduler = EnrichmentScheduler(nx, local_db, max_items=max_query_items, max_chars=max_query_chars)
+    window = checkpoint_every or len(pending)
+    links: Dict[str, str] = {}  # duplicate log id -> id of the log that owns its content
+
+    def claim(log_ids: List[str]) -> List[str]:
+        """Ids that need a full run; the rest are recorded in `links`."""
+        if fingerprints is None:
+            return log_ids
+        with span("pick"):
+            queue = []
+            for log_id in log_ids:
+                original = fingerprints.claim(log_id, logs[log_id], store.__contains__)
+                if original is None:
+                    queue.append(log_id)
+                else:
+                    links[log_id] = original
+        return queue
+
+    def link_ready() -> int:
+        linked = 0
+        for log_id, original in list(links.items()):
+            if original in store:
+                store.put(log_id, link_duplicate(store.get(original), logs[log_id], original))
+                del links[log_id]
+                linked += 1
+        return linked
+
+    def process_window(pool: ThreadPoolExecutor, chunk: List[str]) -> List[str]:
+        """Transcribe, parse and enrich one window; returns the ids stored."""
+        futures = {pool.submit(load_transcript, logs[log_id], uploads_dir, limits): log_id for log_id in chunk}
+        loaded: Dict[str, Tuple[Dict[str, Any], Dict[str, Any]]] = {}
+        for fut in as_completed(futures):
+            log_id = futures[fut]
+            try:
+                metadata = fut.result()
+                loaded[log_id] = (metadata, load_profile(profiles, metadata["user_id"]))
+            except Exception as e:
+                logger.warning(f"Batch: log {log_id} failed: {e}")
+        # Low-confidence transcripts of the window share packed LLM requests
+        try:
+            with span("parse"):
+                parses = parse_transcripts(
+                    {log_id: md["transcript"] for log_id, (md, _) in loaded.items()},
+                    llm_gate=limits["openai"], token_budget=llm_batch_tokens, max_batch=llm_batch_size,
+                    max_parallel=max_openai,
+                )
+        except Exception as e:
+            logger.warning(f"Batch: parsing failed for {len(loaded)} logs: {e}")
+            return []
+        prepared: List[Tuple[str, Tuple[Dict[str, Any], Dict[str, Any]]]] = []
+        for log_id in chunk:
+            if log_id not in loaded:
+                continue
+            metadata, profile = loaded[log_id]
+            if log_id not in parses:
+                logger.warning(f"Batch: log {log_id} failed: no parse returned")
+                continue
+            parsed, confidence = parses[log_id]
+            prepared.append((log_id, (build_payload(metadata, parsed, confidence), profile)))
+        # Nutritionix lookups for the whole window are deduplicated and packed together
+        try:
+            with span("enrich"):
+                enriched = scheduler.enrich_payloads([job for _, job in prepared])
+        except Exception as e:
+            # Keep the window's transcripts and parses: retry record by record so only the bad one fails
+            logger.warning(f"Batch: window enrichment failed ({e}), enriching {len(prepared)} logs one by one")
+            kept, enriched = [], []
+            with span("enrich"):
+                for log_id, job in prepared:
+                    try:
+                        enriched.extend(scheduler.enrich_payloads([job]))
+                        kept.append((log_id, job))
+                    except Exception as e:
+                        logger.warning(f"Batch: log {log_id} failed: {e}")
+            prepared = kept
+        with span("save"):
+            for (log_id, _), out in zip(prepared, enriched):
+                store.put(log_id, out)
+        return [log_id for log_id, _ in prepared]
+
+    done = failed = linked = 0
+    queue = claim(pending)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        while queue:
+            for start in range(0, len(queue), window):
+                chunk = queue[start:start + window]
+                stored = set(process_window(pool, chunk))
+                done += len(stored)
+                failed += len(chunk) - len(stored)
+                if fingerprints is not None:
+                    for log_id in chunk:
+                        (fingerprints.commit if log_id in stored else fingerprints.release)(log_id)
+                with span("save"):
+                    linked += link_ready()
+                    store.flush()
+                logger.info(f"Batch: checkpoint after {done} records, {linked} linked ({scheduler.stats})")
+            # Duplicates of logs that failed: the first of each group now runs in its place
+            orphans = list(links)
+            links.clear()
+            queue = claim(orphans)
+
+    with span("save"):
+        store.flush()
+        save_parse_cache()
+        save_transcript_cache()
+        if nx is not None and nx.cache is not None:
+            nx.cache.save()
+        if fingerprints is not None:
+            fingerprints.save()
+        if index is not None:
+            index.advance(store)
+            index.save()
+    logger.info(f"Batch: parse cache {parse_cache_stats()}, transcript cache {transcript_cache_stats()}")
+    if nx is not None and nx.cache is not None:
+        logger.info(f"Batch: Nutritionix cache {nx.cache.stats()}")
+    logger.info(f"Batch: completed {done} records, {linked} duplicates linked, {failed} failed ({METRICS.summary()})")
+    return {"pending": len(pending), "done": done, "failed": failed, "linked": linked}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--logs", required=True, help="Path to log.json (dict keyed by log id)")
+    ap.add_argument("--profiles", required=True, help="Path to profile.json (dict keyed by userId)")
+    ap.add_argument("--uploads-dir", default=".", help="Base directory where audio/photo files are stored")
+    ap.add_argument("--output_log", required=True, help="Path to output_log.json (dict keyed by log id)")
+    ap.add_argument("--journal", help="Append-only JSONL output store; a new journal imports output_log.json")
+    ap.add_argument("--shards", help="Directory of per-user/day output shards, safe for several concurrent processes; "
+                                     "a new shard directory imports output_log.json")
+    ap.add_argument("--legacy-export", action="store_true",
+                    help="With --journal/--shards, rewrite output_log.json for routes/insights.js at the end of the run "
+                         "(a full rewrite of every record)")
+    ap.add_argument("--log-index", nargs="?", const="", default=None,
+                    help="Use a persisted timestamp index over log.json (optional path; default <logs>.idx.json)")
+    ap.add_argument("--user", help="Only consider logs for this user_id")
+    ap.add_argument("--since", help="Only consider logs with timestamp >= this ISO time")
+    ap.add_argument("--until", help="Only consider logs with timestamp < this ISO time")
+    ap.add_argument("--nutrition-cache", default="", help="Path of the Nutritionix response cache (default: data/cache/nutritionix.json)")
+    ap.add_argument("--no-nutrition-cache", action="store_true", help="Always query Nutritionix live")
+    ap.add_argument("--no-parse-cache", action="store_true", help="Always call the LLM instead of reusing memoised parses")
+    ap.add_argument("--no-local-nutrition", action="store_true", help="Skip the bundled food table and send every item to Nutritionix")
+    ap.add_argument("--batch", action="store_true", help="Process every log missing from output_log.json instead of only the latest")
+    ap.add_argument("--workers", type=int, default=8, help="Batch mode: size of the worker pool")
+    ap.add_argument("--max-openai", type=int, default=4, help="Batch mode: concurrent OpenAI requests")
+    ap.add_argument("--max-nutritionix", type=int, default=2, help="Concurrent Nutritionix requests")
+    ap.add_argument("--max-query-items", type=int, default=20, help="Batch mode: foods packed into one Nutritionix query")
+    ap.add_argument("--max-query-chars", type=int, default=500, help="Batch mode: character limit of one Nutritionix query")
+    ap.add_argument("--llm-batch-tokens", type=int, default=6000, help="Batch mode: estimated token budget of one batched LLM parse request")
+    ap.add_argument("--llm-batch-size", type=int, default=25, help="Batch mode: max transcripts packed into one LLM parse request")
+    ap.add_argument("--checkpoint-every", type=int, default=100, help="Batch mode: save output_log.json every N records (0 = only at the end)")
+    ap.add_argument("--force", action="store_true",
+                    help="No duplicate suppression: rerun the picked log even if it already has an output, "
+                         "and process logs repeating an earlier log's content in full")
+    ap.add_argument("--metrics-out", action="append", default=[],
+                    help="Write stage timings and API/cache counters here (.prom = Prometheus text, else JSON); repeatable")
+    ap.add_argument("--profile", choices=["cpu", "memory"], help="Profile this run with cProfile (cpu) or tracemalloc (memory)")
+    ap.add_argument("--profile-out", help="cProfile stats / tracemalloc report file for --profile")
+    args = ap.parse_args()
+
+    try:
+        with profiling(args.profile, args.profile_out):
+            run(args)
+    finally:
+        for path in args.metrics_out:
+            METRICS.export(path)
+
+
+def run(args: argparse.Namespace):
+    with span("load"):
+        with open(args.profiles, "r", encoding="utf-8") as f:
+            profiles = json.load(f)
+
+        index = None
+        filtered = bool(args.user or args.since or args.until)
+        if args.log_index is not None or filtered:
+            # Parses only logs appended since the last run (a streamed rescan after other edits)
+            index = LogIndex(args.logs, args.log_index or None, persist=args.log_index is not None)
+            index.refresh()
+            index.save()
+        if filtered:
+            # Narrow log.json to the requested user/window; the cursor only tracks unfiltered runs
+            logs = index.load_records(index.window(args.since, args.until, args.user))
+            index = None
+        elif index is not None and not args.batch:
+            # Only the picked log is read from log.json
+            latest = index.latest()
+            logs = index.load_records([latest] if latest else [])
+        else:
+            with open(args.logs, "r", encoding="utf-8") as f:
+                logs = json.load(f)
+
+        if args.no_parse_cache:
+            classifier.PARSE_CACHE_DISABLED = True
+        nx = make_nutritionix_client(None if args.no_nutrition_cache else args.nutrition_cache, args.max_nutritionix)
+        local_db = None if args.no_local_nutrition else LocalNutritionDB.load()
+        # One export on close; checkpoints stay O(records written)
+        store = open_output_store(args.output_log, args.journal, export_legacy=args.legacy_export,
+                                  shards=args.shards, legacy_interval=math.inf)
+        # Per-user day/week totals follow every store write
+        Rollups.attach(store, default_rollup_path(args.output_log))
+        fingerprints = None if args.force else FingerprintIndex(default_fingerprint_path(args.output_log), args.uploads_dir)
+
+    if args.batch:
+        try:
+            # Stored exercise calories follow profile weight changes before new logs are added
+            try:
+                recompute_changed(store, profiles, default_snapshot_path(args.output_log))
+            except Exception as e:
+                logger.warning(f"Exercise recompute failed: {e}")
+            run_batch(
+                logs, profiles, args.uploads_dir, store,
+                workers=args.workers,
+                max_openai=args.max_openai,
+                checkpoint_every=args.checkpoint_every,
+                index=index,
+                nx=nx,
+                local_db=local_db,
+                max_query_items=args.max_query_items,
+                max_query_chars=args.max_query_chars,
+                llm_batch_tokens=args.llm_batch_tokens,
+                llm_batch_size=args.llm_batch_size,
+                fingerprints=fingerprints,
+            )
+        finally:
+            store.close()
+        return
 
-    enriched = enrich_payload(payload, profile, nx)
+    if not logs:
+        raise KeyError("No logs match the given --user/--since/--until filters")
+    with span("pick"):
+        last_record = pick_latest_log(logs, index)
+        record_id = last_record.get("id")
+        # Replays of a processed log and repeats of its content are answered from the store
+        original = None
+        if fingerprints is not None:
+            if record_id in store:
+                logger.info(f"Log {record_id} already processed; nothing to do (use --force to rerun)")
+                store.close()
+                return
+            original = fingerprints.claim(record_id, last_record, store.__contains__)
 
-    record_id = last_record.get("id")
-    output_data[record_id] = enriched
+    if original is not None:
+        logger.info(f"Log {record_id} duplicates {original}; linking its output")
+        enriched = link_duplicate(store.get(original), last_record, original)
+    else:
+        enriched = process_record(last_record, profiles, args.uploads_dir, nx, local_db=local_db)
+    with span("save"):
+        save_parse_cache()
+        save_transcript_cache()
+        if nx is not None and nx.cache is not None:
+            nx.cache.save()
 
-    save_output_log(args.output_log, output_data)
+        store.put(record_id, enriched)
+        store.close()
+        if fingerprints is not None:
+            fingerprints.commit(record_id)
+            fingerprints.save()
 
-    logger.info("Completed extraction ")
+    logger.info(f"Completed extraction ({METRICS.summary()})")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,265 @@
+import os
+import json
+import argparse
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple
+
+from loguru import logger
+
+from model import MACRO_KEYS
+from store import atomic_write_json, file_lock, open_output_store, ts_epoch
+
+# Totals kept per user per bucket; food macros other than calories keep their calculator names
+TOTAL_KEYS = ("calories_in", "calories_out", "exercise_min", "records") + tuple(k for k in MACRO_KEYS if k != "calories")
+
+
+def buckets(timestamp: Optional[str]) -> Tuple[str, str]:
+    """(day, ISO week) keys for a record timestamp, e.g. ("2025-09-06", "2025-W36"), in UTC."""
+    dt = datetime.fromtimestamp(ts_epoch(timestamp), tz=timezone.utc)
+    year, week, _ = dt.isocalendar()
+    return dt.strftime("%Y-%m-%d"), f"{year}-W{week:02d}"
+
+
+def contribution(record: Dict[str, Any]) -> Dict[str, float]:
+    """What one enriched payload adds to its user's day/week totals (nothing for a linked duplicate)."""
+    out = dict.fromkeys(TOTAL_KEYS, 0.0)
+    if record.get("duplicate_of"):
+        return out
+    out["records"] = 1.0
+    for log in record.get("proposed_logs", []):
+        for it in log.get("items", []):
+            if log.get("type") == "food":
+                macros = it.get("macros") or {}
+                out["calories_in"] += float(macros.get("calories") or 0.0)
+                for k in MACRO_KEYS[1:]:
+                    out[k] += float(macros.get(k) or 0.0)
+            elif log.get("type") == "exercise":
+                out["calories_out"] += float(it.get("calories_burned") or 0.0)
+                out["exercise_min"] += float(it.get("duration_min") or 0.0)
+    return out
+
+
+def _add(totals: Dict[str, float], delta: Dict[str, float], sign: float):
+    for k, v in delta.items():
+        totals[k] = round(totals.get(k, 0.0) + sign * v, 6)
+
+
+class Rollups:
+    """
+    Materialised per-user daily and ISO-weekly totals of enriched payloads.
+
+    Each record's contribution is remembered by id, so apply() is O(1): a
+    reprocessed record first retracts what it added before, and retract()
+    removes a deleted one. Records without a user_id are remembered with an
+    empty contribution, so every store id is accounted for. Totals are kept
+    in step with a store through store.subscribe() (see attach()); range
+    queries never read the raw logs.
+
+    On disk a JSON snapshot next to the output log is followed by an
+    append-only `<path>.deltas` file of [id, entry] lines (entry null for a
+    delete). save() appends only what changed since the last save, so a
+    flush costs O(changes); the snapshot is rewritten (folding the deltas in)
+    once the delta file outgrows it. Replaying a delta is idempotent, so a
+    crash between the two steps loses nothing.
+    """
+
+    def __init__(self, path: Optional[str] = None, compact_min_bytes: int = 1 << 20):
+        self.path = path
+        self.delta_path = f"{path}.deltas" if path else None
+        self.compact_min_bytes = compact_min_bytes
+        self.records: Dict[str, List[Any]] = {}  # id -> [user_id, day, week, contribution]
+        self.days: Dict[str, Dict[str, Dict[str, float]]] = {}
+        self.weeks: Dict[str, Dict[str, Dict[str, float]]] = {}
+        self._lock = threading.Lock()
+        self._unsaved: Dict[str, Optional[List[Any]]] = {}  # id -> entry (None: deleted) since last save
+        self._rewrite = False
+        if path:
+            self._load()
+
+    def _load(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.records, self.days, self.weeks = data["records"], data["days"], data["weeks"]
+            except Exception as e:
+                logger.warning(f"Could not load rollups {self.path}: {e}")
+        if os.path.exists(self.delta_path):
+            with open(self.delta_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record_id, entry = json.loads(line)
+                    except (ValueError, TypeError):
+                        continue  # torn last line of an interrupted save
+                    self._set(record_id, entry)
+
+    # --- Updates ---------------------------------------------------------
+
+    def _bump(self, user_id: Optional[str], day: str, week: str, delta: Dict[str, float], sign: float):
+        if user_id is None:
+            return
+        for table, key in ((self.days, day), (self.weeks, week)):
+            per_user = table.setdefault(user_id, {})
+            totals = per_user.setdefault(key, dict.fromkeys(TOTAL_KEYS, 0.0))
+            _add(totals, delta, sign)
+            if totals["records"] <= 0:
+                del per_user[key]
+
+    def _set(self, record_id: str, entry: Optional[List[Any]]):
+        """Swap a record's remembered contribution for `entry` (None forgets it)."""
+        old = self.records.pop(record_id, None)
+        if old is not None:
+            self._bump(*old, sign=-1.0)
+        if entry is not None:
+            self._bump(*entry, sign=1.0)
+            self.records[record_id] = entry
+
+    def retract(self, record_id: str):
+        with self._lock:
+            if record_id in self.records:
+                self._set(record_id, None)
+                self._unsaved[record_id] = None
+
+    def apply(self, record_id: str, record: Dict[str, Any]):
+        user_id = record.get("user_id")
+        if user_id:
+            day, week = buckets(record.get("timestamp"))
+            entry = [user_id, day, week, contribution(record)]
+        else:
+            entry = [None, None, None, {}]  # seen, but adds to nobody's totals
+        with self._lock:
+            self._set(record_id, entry)
+            self._unsaved[record_id] = entry
+
+    def rebuild(self, store) -> int:
+        with self._lock:
+            self.records, self.days, self.weeks = {}, {}, {}
+        for record_id in store.ids():
+            record = store.get(record_id)
+            if record is not None:
+                self.apply(record_id, record)
+        with self._lock:
+            self._unsaved, self._rewrite = {}, True  # the next save() writes a fresh snapshot
+        logger.info(f"Rollups: rebuilt from {len(self.records)} records")
+        return len(self.records)
+
+    def on_store_event(self, event: str, record_id: Optional[str], record: Optional[Dict[str, Any]]):
+        if event == "put":
+            self.apply(record_id, record)
+        elif event == "delete":
+            self.retract(record_id)
+        elif event == "flush":
+            self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if self._rewrite:
+                snapshot = {"records": dict(self.records), "days": self.days, "weeks": self.weeks}
+                with file_lock(self.path):
+                    atomic_write_json(self.path, snapshot, indent=None)
+                    open(self.delta_path, "w").close()
+                self._unsaved, self._rewrite = {}, False
+                return
+            if not self._unsaved:
+                return
+            changes, self._unsaved = self._unsaved, {}
+        lines = "".join(json.dumps([record_id, entry], separators=(",", ":")) + "\n"
+                        for record_id, entry in changes.items())
+        with file_lock(self.path):
+            with open(self.delta_path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.getsize(self.delta_path) > max(self.compact_min_bytes, self._snapshot_bytes()):
+                self._compact()
+
+    def _snapshot_bytes(self) -> int:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def _compact(self):
+        """Fold the delta file into the snapshot (caller holds file_lock). Reads the files, not
+        this process's view, so deltas other processes appended are kept."""
+        folded = Rollups(self.path)
+        atomic_write_json(self.path, {"records": folded.records, "days": folded.days, "weeks": folded.weeks},
+                          indent=None)
+        open(self.delta_path, "w").close()
+        logger.info(f"Rollups: compacted {self.path} ({len(folded.records)} records)")
+
+    @classmethod
+    def attach(cls, store, path: Optional[str]) -> "Rollups":
+        """
+        Load (or rebuild when the record count differs from `store`) and keep
+        updated from store writes. Only the count is compared at start; run
+        rollups.py --rebuild after editing the output store by other means.
+        """
+        rollups = cls(path)
+        if len(rollups.records) != len(store):
+            rollups.rebuild(store)
+            rollups.save()
+        store.subscribe(rollups.on_store_event)
+        return rollups
+
+    # --- Queries ---------------------------------------------------------
+
+    def series(self, user_id: str, start: Optional[str] = None, end: Optional[str] = None,
+               by: str = "day") -> List[Dict[str, Any]]:
+        """Per-bucket totals for `user_id` with start <= timestamp < end, oldest first."""
+        table = self.days if by == "day" else self.weeks
+        idx = 0 if by == "day" else 1
+        lo = buckets(start)[idx] if start else None
+        hi = buckets(end)[idx] if end else None
+        with self._lock:
+            rows = [
+                {"period": key, **totals}
+                for key, totals in table.get(user_id, {}).items()
+                if (lo is None or key >= lo) and (hi is None or key < hi)
+            ]
+        return sorted(rows, key=lambda r: r["period"])
+
+    def summary(self, user_id: str, start: Optional[str] = None, end: Optional[str] = None) -> Dict[str, float]:
+        """Totals over a day-aligned range."""
+        out = dict.fromkeys(TOTAL_KEYS, 0.0)
+        for row in self.series(user_id, start, end, by="day"):
+            _add(out, {k: row[k] for k in TOTAL_KEYS}, 1.0)
+        return out
+
+
+def default_rollup_path(output_file: str) -> str:
+    return f"{os.path.splitext(output_file)[0]}.rollups.json"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Per-user daily/weekly nutrition and activity totals")
+    ap.add_argument("--output_log", required=True, help="Path to output_log.json (dict keyed by log id)")
+    ap.add_argument("--journal", help="Append-only JSONL output store (see payload.py)")
+    ap.add_argument("--shards", help="Sharded output store directory (see payload.py)")
+    ap.add_argument("--rollups", help="Rollup file (default: <output_log>.rollups.json)")
+    ap.add_argument("--rebuild", action="store_true", help="Recompute every total from the output store")
+    ap.add_argument("--user", required=True, help="user_id to report")
+    ap.add_argument("--since", help="Start date/time (inclusive)")
+    ap.add_argument("--until", help="End date/time (exclusive)")
+    ap.add_argument("--by", choices=["day", "week"], default="day")
+    args = ap.parse_args()
+
+    path = args.rollups or default_rollup_path(args.output_log)
+    if args.rebuild or not (os.path.exists(path) or os.path.exists(f"{path}.deltas")):
+        store = open_output_store(args.output_log, args.journal, shards=args.shards)
+        try:
+            rollups = Rollups(path)
+            rollups.rebuild(store)
+            rollups.save()
+        finally:
+            store.close()
+    else:
+        rollups = Rollups(path)
+    print(json.dumps({
+        "series": rollups.series(args.user, args.since, args.until, args.by),
+        "summary": rollups.summary(args.user, args.since, args.until),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
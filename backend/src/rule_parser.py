@@ -0,0 +1,191 @@
+import os
+import re
+import json
+from typing import Dict, List, Optional, Any, Tuple
+
+from calculator import UNIT_ALIASES
+from foodmatch import canonical_name, singular
+
+FOOD_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "nutrition_table.json")
+
+# Surface forms -> calculator.BASE_MET activity names
+ACTIVITY_WORDS = {
+    "ran": "running", "run": "running", "runs": "running", "running": "running", "jog": "running",
+    "jogged": "running", "jogging": "running",
+    "walk": "walking", "walked": "walking", "walking": "walking",
+    "cycle": "cycling", "cycled": "cycling", "cycling": "cycling", "bike": "cycling", "biked": "cycling", "biking": "cycling",
+    "swim": "swimming", "swam": "swimming", "swimming": "swimming",
+    "row": "rowing", "rowed": "rowing", "rowing": "rowing",
+    "yoga": "yoga", "hiit": "hiit",
+    "hike": "hiking", "hiked": "hiking", "hiking": "hiking",
+    "elliptical": "elliptical",
+    "lifted": "weight training", "lifting": "weight training", "weights": "weight training",
+}
+
+# Surface forms -> calculator.EFFORT_MULT levels
+EFFORT_WORDS = {
+    "easy": "easy", "light": "easy", "gentle": "easy", "slow": "easy",
+    "moderate": "moderate", "steady": "moderate",
+    "hard": "vigorous", "vigorous": "vigorous", "intense": "vigorous", "fast": "vigorous", "brisk": "vigorous",
+    "max": "max", "all-out": "max", "sprint": "max",
+}
+
+NUMBER_WORDS = {
+    "a": 1.0, "an": 1.0, "one": 1.0, "two": 2.0, "three": 3.0, "four": 4.0, "five": 5.0, "six": 6.0,
+    "seven": 7.0, "eight": 8.0, "nine": 9.0, "ten": 10.0, "half": 0.5, "couple": 2.0, "few": 3.0,
+}
+
+# Words that carry no content of their own for the coverage score
+FILLER = {
+    "i", "i'm", "im", "my", "me", "we", "today", "tonight", "this", "morning", "afternoon", "evening",
+    "for", "at", "in", "of", "the", "a", "an", "some", "and", "with", "along", "then", "also", "plus",
+    "had", "have", "ate", "eat", "eaten", "drank", "drink", "did", "do", "went", "go", "about",
+    "around", "just", "log", "entry", "is", "was", "food", "exercise", "breakfast", "lunch", "dinner",
+    "snack", "text", "hi", "hello", "so", "it", "to", "on", "minute", "minutes", "min", "mins",
+    "hour", "hours", "hr", "hrs",
+}
+
+_SEGMENT = re.compile(r"[;!?\n]+|\.(?!\d)")
+_CLAUSE = re.compile(r",|\band then\b|\balong with\b|\band\b|\bwith\b|\bplus\b|\bthen\b")
+_LABEL = re.compile(r"^\s*(food|exercise|breakfast|lunch|dinner|snack)\s*:\s*")
+_DURATION = re.compile(
+    r"\b(\d+(?:\.\d+)?|half an?|an?|one|two|three|four|five|six|seven|eight|nine|ten)"
+    r"\s*(?:-\s*)?(minutes?|mins?|m|hours?|hrs?|h)\b"
+)
+_QTY = re.compile(r"^(\d+(?:\.\d+)?|\d+/\d+)\b\s*")
+_LEAD = re.compile(r"^(?:(?:i|we)\s+)?(?:(?:just|also)\s+)?(?:had|have|ate|eat|eaten|drank|drink|got)\s+")
+_TRAIL = re.compile(r"\s+(?:today|tonight|this morning|this afternoon|this evening|for (?:breakfast|lunch|dinner|a snack|snack))$")
+_PARENS = re.compile(r"\([^)]*\)")
+_TOKEN = re.compile(r"[a-z0-9'%-]+")
+_ARTICLE = re.compile(r"^(?:an?|the)\s+")
+
+UNITS = set(UNIT_ALIASES) | set(UNIT_ALIASES.values()) | {"glass", "glasses", "handful", "handfuls", "scoop", "scoops", "can", "cans"}
+
+_vocab: Optional[set] = None
+
+
+def food_vocabulary() -> set:
+    """Canonical names (and aliases) from the bundled nutrition table."""
+    global _vocab
+    if _vocab is None:
+        with open(FOOD_TABLE, "r", encoding="utf-8") as f:
+            rows = json.load(f)
+        _vocab = {canonical_name(n) for r in rows for n in [r["name"], *r.get("aliases", [])]}
+    return _vocab
+
+
+def _content_tokens(text: str) -> List[str]:
+    return [t for t in _TOKEN.findall(text) if t not in FILLER and not t.isdigit()]
+
+
+def _parse_quantity(text: str) -> Tuple[Optional[float], str]:
+    m = _QTY.match(text)
+    if m:
+        raw = m.group(1)
+        if "/" in raw:
+            num, den = raw.split("/")
+            qty = float(num) / float(den) if float(den) else None
+        else:
+            qty = float(raw)
+        return qty, _ARTICLE.sub("", text[m.end():])
+    first, _, rest = text.partition(" ")
+    if first in NUMBER_WORDS and rest:
+        # "half a pizza" -> 0.5 "pizza"
+        return NUMBER_WORDS[first], _ARTICLE.sub("", rest)
+    return None, text
+
+
+def _parse_exercise(clause: str) -> Optional[Tuple[Dict[str, Any], float, str]]:
+    """(item, certainty, rest): `rest` is the clause minus the words the item explains."""
+    words = _TOKEN.findall(clause)
+    activity = next((ACTIVITY_WORDS[w] for w in words if w in ACTIVITY_WORDS), None)
+    if activity is None and "weight training" in clause:
+        activity = "weight training"
+    if activity is None:
+        return None
+    m = _DURATION.search(clause)
+    duration = None
+    if m:
+        amount = m.group(1)
+        duration = 0.5 if amount.startswith("half") else NUMBER_WORDS.get(amount) or float(amount)
+        if m.group(2).startswith("h"):
+            duration *= 60.0
+    effort = next((EFFORT_WORDS[w] for w in words if w in EFFORT_WORDS), "moderate")
+    item = {"activity": activity, "duration_min": duration if duration is not None else 0.0, "effort_level": effort}
+    rest = clause[:m.start()] + " " + clause[m.end():] if m else clause
+    rest = " ".join(w for w in rest.replace("weight training", " ").split()
+                    if w not in ACTIVITY_WORDS and w not in EFFORT_WORDS)
+    return item, 1.0 if duration is not None else 0.4, rest
+
+
+def _parse_food(clause: str, labelled: bool) -> Optional[Tuple[Dict[str, Any], float]]:
+    text = _LEAD.sub("", clause.strip())
+    while True:
+        trimmed = _TRAIL.sub("", text)
+        if trimmed == text:
+            break
+        text = trimmed
+    text = text.strip()
+    qty, text = _parse_quantity(text)
+    unit = "count"
+    first, _, rest = text.partition(" ")
+    if first in UNITS and rest:
+        unit = UNIT_ALIASES.get(first, singular(first))
+        text = rest
+    text = re.sub(r"^of\s+", "", text).strip()
+    name = canonical_name(text)
+    if not name:
+        return None
+    known = name in food_vocabulary()
+    if not known and not labelled:
+        return None
+    item = {"name": text, "quantity": qty if qty is not None else 1.0, "unit": unit}
+    return item, 1.0 if known else 0.6
+
+
+def parse_with_rules(transcript: str) -> Tuple[Dict[str, Any], float]:
+    """
+    Deterministic parse of semi-structured logs into the parse_with_llm()
+    shape. Returns (parsed, confidence): confidence is the share of content
+    words explained by extracted items, weighted by how sure each item is
+    (known food name, stated duration), and 0.0 when nothing was found.
+    An exercise match only explains its activity/effort/duration words; the
+    rest of the clause is still searched for food, and whatever stays
+    unexplained pulls the confidence down towards the LLM fallback.
+    """
+    text = (transcript or "").lower()
+    text = re.sub(r"^\s*log entry:\s*\w+\s*-\s*", "", text)
+    text = _PARENS.sub(" ", text)
+    food: List[Dict[str, Any]] = []
+    exercise: List[Dict[str, Any]] = []
+    total = covered = 0.0
+
+    for segment in _SEGMENT.split(text):
+        label = _LABEL.match(segment)
+        kind = label.group(1) if label else None
+        if label:
+            segment = segment[label.end():]
+        for clause in _CLAUSE.split(segment):
+            clause = clause.strip()
+            weight = len(_content_tokens(clause))
+            total += weight
+            if not clause:
+                continue
+            rest = clause
+            if kind in (None, "exercise"):
+                found = _parse_exercise(clause)
+                if found:
+                    item, certainty, rest = found
+                    exercise.append(item)
+                    covered += (weight - len(_content_tokens(rest))) * certainty
+            left = len(_content_tokens(rest))
+            if left and kind != "exercise":
+                found = _parse_food(rest, labelled=kind is not None or bool(_LEAD.match(clause)))
+                if found:
+                    food.append(found[0])
+                    covered += left * found[1]
+
+    parsed = {"food": {"items": food}, "exercise": {"items": exercise}}
+    if not (food or exercise) or total == 0:
+        return parsed, 0.0
+    return parsed, round(0.98 * covered / total, 3)
@@ -0,0 +1,615 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, single-process use only
+    fcntl = None
+
+
+def atomic_write_json(path: str, data: Any, indent: Optional[int] = 2):
+    """Write JSON to a temp file next to `path`, fsync, then rename over it."""
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """Exclusive advisory lock on `path`.lock, held across processes for the duration of the block."""
+    with open(f"{path}.lock", "a") as fh:
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+
+def _read_json_dict(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def update_json_dict(path: str, changes: Dict[str, Optional[Any]], indent: Optional[int] = 2) -> Dict[str, Any]:
+    """
+    Apply `changes` (None deletes) to the id-keyed JSON object at `path` and
+    return the result. The file is re-read under file_lock(), so records
+    another process wrote since we loaded it are kept instead of overwritten.
+    """
+    with file_lock(path):
+        try:
+            data = _read_json_dict(path)
+        except ValueError as e:
+            logger.warning(f"Could not read {path} before update, rewriting it: {e}")
+            data = {}
+        for record_id, record in changes.items():
+            if record is None:
+                data.pop(record_id, None)
+            else:
+                data[record_id] = record
+        atomic_write_json(path, data, indent=indent)
+    return data
+
+
+def ts_epoch(ts: Optional[str]) -> float:
+    """Seconds since epoch for an ISO-8601 timestamp; 0.0 if missing or unparseable."""
+    if not ts:
+        return 0.0
+    try:
+        dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except ValueError:
+        return 0.0
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+class _Observable:
+    """
+    Write hooks shared by the stores: each subscriber is called as
+    callback(event, record_id, record) with event "put" or "delete", and
+    callback("flush", None, None) after the store has been flushed.
+    """
+
+    _observers: List[Callable[[str, Optional[str], Optional[Dict[str, Any]]], None]]
+
+    def subscribe(self, callback: Callable[[str, Optional[str], Optional[Dict[str, Any]]], None]):
+        self._observers.append(callback)
+
+    def _notify(self, event: str, record_id: Optional[str] = None, record: Optional[Dict[str, Any]] = None):
+        for callback in self._observers:
+            callback(event, record_id, record)
+
+
+class JsonFileStore(_Observable):
+    """
+    The legacy layout: one output_log.json dict keyed by log id, held in
+    memory and rewritten (atomically) on flush(). The rewrite merges into
+    the file's current contents under a lock (update_json_dict), so two
+    processes sharing it no longer drop each other's records.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._observers = []
+        self.data: Dict[str, Any] = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.data = json.load(f)
+            except Exception as e:
+                logger.warning(f"Could not load existing {path}: {e}")
+        self._changes: Dict[str, Optional[Dict[str, Any]]] = {}
+
+    def __contains__(self, record_id: str) -> bool:
+        return record_id in self.data
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def ids(self) -> List[str]:
+        return list(self.data)
+
+    def ids_for_users(self, user_ids: Iterable[Optional[str]]) -> List[str]:
+        wanted = set(user_ids)
+        return [record_id for record_id, record in self.data.items() if record.get("user_id") in wanted]
+
+    def get(self, record_id: str) -> Optional[Dict[str, Any]]:
+        return self.data.get(record_id)
+
+    def put(self, record_id: str, record: Dict[str, Any]):
+        self.data[record_id] = record
+        self._changes[record_id] = record
+        self._notify("put", record_id, record)
+
+    def flush(self):
+        if self._changes:
+            merged = update_json_dict(self.path, self._changes)
+            for record_id, record in merged.items():
+                if record_id not in self.data:
+                    # Written by another process since we loaded the file
+                    self.data[record_id] = record
+                    self._notify("put", record_id, record)
+            self._changes = {}
+        self._notify("flush")
+
+    def close(self):
+        self.flush()
+
+
+class JournalStore(_Observable):
+    """
+    Append-only JSONL store for enriched payloads.
+
+    Each line is {"id": ..., "record": {...}}; a later line for the same id
+    supersedes earlier ones. put() appends a single line (O(record)) and an
+    in-memory index maps id -> (offset, length, user_id, timestamp) for reads.
+    A torn last line left by a crash is truncated on open; a corrupt line
+    elsewhere is skipped (and dropped by the next compaction). compact()
+    rewrites only live records and swaps the file in with an atomic rename.
+
+    A new journal imports the records of `legacy_path` (output_log.json).
+    With `export_legacy` that file is also rewritten for routes/insights.js,
+    at most every `legacy_interval` seconds on flush and on close(). The
+    export rewrites every record (O(history)), so it is off by default and
+    the normal write path stays O(record).
+    """
+
+    def __init__(self, path: str, legacy_path: Optional[str] = None, fsync: bool = False,
+                 compact_ratio: float = 0.5, export_legacy: bool = False, legacy_interval: float = 0.0):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.export_legacy_to = legacy_path if export_legacy else None
+        self.legacy_interval = legacy_interval
+        self._last_export = time.monotonic()
+        self.fsync = fsync
+        self.compact_ratio = compact_ratio
+        self._observers = []
+        self._index: Dict[str, Tuple[int, int, Optional[str], float]] = {}
+        self._dead_bytes = 0
+        self._lock = threading.Lock()
+        self._appended = False
+
+        new_journal = not os.path.exists(path)
+        self._load()
+        self._fh = open(path, "ab")
+        if new_journal and legacy_path and os.path.exists(legacy_path):
+            self.import_legacy(legacy_path)
+
+    # --- Index -----------------------------------------------------------
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        offset = 0
+        bad: Optional[Tuple[int, int]] = None  # last unreadable line not yet followed by a good one
+        with open(self.path, "rb") as f:
+            for line in f:
+                length = len(line)
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("torn write")
+                    entry = json.loads(line)
+                    record_id, record = entry["id"], entry.get("record")
+                except (ValueError, KeyError, TypeError):
+                    if bad is not None:
+                        self._skip_corrupt(*bad)
+                    bad = (offset, length)
+                    offset += length
+                    continue
+                if bad is not None:
+                    self._skip_corrupt(*bad)
+                    bad = None
+                self._index_entry(record_id, record, offset, length)
+                offset += length
+        if bad is not None:
+            # Only a torn/corrupt last line is cut off (crash mid-append)
+            logger.warning(f"Journal {self.path}: dropping corrupt tail at byte {bad[0]}")
+            with open(self.path, "r+b") as f:
+                f.truncate(bad[0])
+
+    def _skip_corrupt(self, offset: int, length: int):
+        logger.warning(f"Journal {self.path}: skipping corrupt line at byte {offset} ({length} bytes)")
+        self._dead_bytes += length
+
+    def _index_entry(self, record_id: str, record: Optional[Dict[str, Any]], offset: int, length: int):
+        old = self._index.pop(record_id, None)
+        if old is not None:
+            self._dead_bytes += old[1]
+        if record is None:  # tombstone
+            self._dead_bytes += length
+            return
+        self._index[record_id] = (offset, length, record.get("user_id"), ts_epoch(record.get("timestamp")))
+
+    def __contains__(self, record_id: str) -> bool:
+        return record_id in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def ids(self) -> List[str]:
+        return list(self._index)
+
+    def ids_for_users(self, user_ids: Iterable[Optional[str]]) -> List[str]:
+        """Ids of the records owned by any of `user_ids`, from the index (no record reads)."""
+        wanted = set(user_ids)
+        return [record_id for record_id, entry in list(self._index.items()) if entry[2] in wanted]
+
+    # --- Writes ----------------------------------------------------------
+
+    def _append(self, record_id: str, record: Optional[Dict[str, Any]]):
+        line = (json.dumps({"id": record_id, "record": record}, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            offset = self._fh.seek(0, os.SEEK_END)
+            self._fh.write(line)
+            self._fh.flush()
+            if self.fsync:
+                os.fsync(self._fh.fileno())
+            self._index_entry(record_id, record, offset, len(line))
+            self._appended = True
+
+    def put(self, record_id: str, record: Dict[str, Any]):
+        self._append(record_id, record)
+        self._notify("put", record_id, record)
+
+    def delete(self, record_id: str):
+        if record_id in self._index:
+            self._append(record_id, None)
+            self._notify("delete", record_id)
+
+    def import_legacy(self, legacy_path: str) -> int:
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for record_id, record in data.items():
+            self.put(record_id, record)
+        logger.info(f"Journal {self.path}: imported {len(data)} records from {legacy_path}")
+        return len(data)
+
+    def compact(self):
+        """Rewrite the journal with one line per live record."""
+        with self._lock:
+            self._fh.flush()
+            tmp = self.path + ".compact.tmp"
+            new_index: Dict[str, Tuple[int, int, Optional[str], float]] = {}
+            offset = 0
+            with open(self.path, "rb") as src, open(tmp, "wb") as dst:
+                for record_id, (off, length, user_id, ts) in self._index.items():
+                    src.seek(off)
+                    dst.write(src.read(length))
+                    new_index[record_id] = (offset, length, user_id, ts)
+                    offset += length
+                dst.flush()
+                os.fsync(dst.fileno())
+            self._fh.close()
+            os.replace(tmp, self.path)
+            self._fh = open(self.path, "ab")
+            self._index = new_index
+            self._dead_bytes = 0
+
+    def flush(self):
+        with self._lock:
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+        total = self._fh.tell() or 1
+        if self._dead_bytes / total > self.compact_ratio:
+            self.compact()
+        self._export_if_due()
+        self._notify("flush")
+
+    def _export_if_due(self, force: bool = False):
+        if not self.export_legacy_to or not self._appended:
+            return
+        if force or time.monotonic() - self._last_export >= self.legacy_interval:
+            self.export_legacy(self.export_legacy_to)
+            self._appended = False
+            self._last_export = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self._export_if_due(force=True)
+        self._fh.close()
+
+    # --- Reads -----------------------------------------------------------
+
+    def _read(self, offset: int, length: int) -> Dict[str, Any]:
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.read(length))["record"]
+
+    def get(self, record_id: str) -> Optional[Dict[str, Any]]:
+        loc = self._index.get(record_id)
+        if loc is None:
+            return None
+        with self._lock:
+            self._fh.flush()
+        return self._read(loc[0], loc[1])
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            self._fh.flush()
+            locs = sorted(self._index.items(), key=lambda kv: kv[1][0])
+        with open(self.path, "rb") as f:
+            for record_id, (offset, length, _, _) in locs:
+                f.seek(offset)
+                yield record_id, json.loads(f.read(length))["record"]
+
+    def by_user(self, user_id: str, start: Optional[str] = None, end: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Records for `user_id` with start <= timestamp < end, oldest first."""
+        lo = ts_epoch(start) if start else float("-inf")
+        hi = ts_epoch(end) if end else float("inf")
+        hits = sorted(
+            (ts, offset, length)
+            for (offset, length, uid, ts) in list(self._index.values())
+            if uid == user_id and lo <= ts < hi
+        )
+        with self._lock:
+            self._fh.flush()
+        return [self._read(offset, length) for _, offset, length in hits]
+
+    def export_legacy(self, legacy_path: str):
+        """Write the id-keyed output_log.json used by the Node insights route."""
+        atomic_write_json(legacy_path, dict(self.items()))
+
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def shard_name(user_id: Optional[str], timestamp: Optional[str]) -> str:
+    """Relative shard path "<user>/<YYYY-MM-DD>.json" (UTC day) for a record."""
+    user = str(user_id) if user_id else "_unknown"
+    safe = _UNSAFE.sub("_", user)[:64]
+    if safe != user or safe.startswith("."):
+        # Keep distinct ids distinct after sanitising
+        safe = f"{safe.lstrip('.')}-{hashlib.sha1(user.encode('utf-8')).hexdigest()[:8]}"
+    day = datetime.fromtimestamp(ts_epoch(timestamp), tz=timezone.utc).strftime("%Y-%m-%d")
+    return os.path.join(safe, f"{day}.json")
+
+
+class ShardedStore(_Observable):
+    """
+    Output records split into small JSON files per user and UTC day, for
+    several writer processes on one box.
+
+    put() only buffers; flush() rewrites each touched shard under its own
+    advisory lock (file_lock) by re-reading it, applying this process's
+    changes and renaming a temp file over it, so concurrent writers never
+    lose each other's records and readers never see a half-written file.
+    An id -> shard index over every shard gives the usual single id-keyed
+    view (merge view); flush() and refresh() pick up shards other processes
+    changed (by mtime/size) and notify subscribers of those records too.
+
+    A new shard directory imports the records of `legacy_path`. With
+    `export_legacy` the merged output_log.json is also rewritten for
+    routes/insights.js, at most every `legacy_interval` seconds on flush and
+    on close() (O(history), so off by default).
+    """
+
+    def __init__(self, root: str, legacy_path: Optional[str] = None, export_legacy: bool = False,
+                 legacy_interval: float = 0.0):
+        self.root = root
+        self.legacy_path = legacy_path
+        self.export_legacy_to = legacy_path if export_legacy else None
+        self.legacy_interval = legacy_interval
+        self._last_export = time.monotonic()
+        self._observers = []
+        self._lock = threading.RLock()
+        self._index: Dict[str, str] = {}  # record id -> shard
+        self._shards: Dict[str, Tuple[Tuple[int, int], Dict[str, Any]]] = {}  # shard -> (stamp, records)
+        self._pending: Dict[str, Dict[str, Optional[Dict[str, Any]]]] = {}  # shard -> id -> record/None
+        self._changed = False
+
+        new_root = not os.path.isdir(root)
+        os.makedirs(root, exist_ok=True)
+        self.refresh()
+        if new_root and legacy_path and os.path.exists(legacy_path):
+            self.import_legacy(legacy_path)
+            self.flush()
+
+    # --- Shards ----------------------------------------------------------
+
+    def _path(self, shard: str) -> str:
+        return os.path.join(self.root, shard)
+
+    @staticmethod
+    def _stamp(path: str) -> Tuple[int, int]:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+
+    def _shard_files(self) -> Iterator[str]:
+        for user in os.scandir(self.root):
+            if not user.is_dir():
+                continue
+            for entry in os.scandir(user.path):
+                if entry.name.endswith(".json") and not entry.name.startswith("."):
+                    yield os.path.join(user.name, entry.name)
+
+    def refresh(self) -> int:
+        """Re-index shards changed on disk since last seen; returns how many were reloaded."""
+        events: List[Tuple[str, str, Optional[Dict[str, Any]]]] = []
+        reloaded = 0
+        with self._lock:
+            for shard in self._shard_files():
+                path = self._path(shard)
+                cached = self._shards.get(shard)
+                try:
+                    stamp = self._stamp(path)
+                    if cached is not None and cached[0] == stamp:
+                        continue
+                    data = _read_json_dict(path)
+                except FileNotFoundError:
+                    continue
+                except ValueError as e:
+                    logger.warning(f"Shard {path} unreadable, skipped: {e}")
+                    continue
+                old = cached[1] if cached is not None else {}
+                self._shards[shard] = (stamp, data)
+                reloaded += 1
+                for record_id, record in data.items():
+                    if self._index.get(record_id) != shard or old.get(record_id) != record:
+                        self._index[record_id] = shard
+                        events.append(("put", record_id, record))
+                for record_id in old.keys() - data.keys():
+                    if self._index.get(record_id) == shard and record_id not in self._pending.get(shard, {}):
+                        del self._index[record_id]
+                        events.append(("delete", record_id, None))
+        for event, record_id, record in events:
+            self._notify(event, record_id, record)
+        return reloaded
+
+    # --- Merge view ------------------------------------------------------
+
+    def __contains__(self, record_id: str) -> bool:
+        return record_id in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def ids(self) -> List[str]:
+        return list(self._index)
+
+    def ids_for_users(self, user_ids: Iterable[Optional[str]]) -> List[str]:
+        """Ids in the shard directories of `user_ids` (a superset when sanitised names collide)."""
+        dirs = {os.path.dirname(shard_name(uid, None)) for uid in user_ids}
+        with self._lock:
+            return [record_id for record_id, shard in self._index.items() if os.path.dirname(shard) in dirs]
+
+    def get(self, record_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            shard = self._index.get(record_id)
+            if shard is None:
+                return None
+            pending = self._pending.get(shard, {})
+            if record_id in pending:
+                return pending[record_id]
+            cached = self._shards.get(shard)
+            return cached[1].get(record_id) if cached is not None else None
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        for record_id in self.ids():
+            record = self.get(record_id)
+            if record is not None:
+                yield record_id, record
+
+    def by_user(self, user_id: str, start: Optional[str] = None, end: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Records for `user_id` with start <= timestamp < end, oldest first; reads only that user's day shards."""
+        user_dir = os.path.dirname(shard_name(user_id, None))
+        lo = ts_epoch(start) if start else float("-inf")
+        hi = ts_epoch(end) if end else float("inf")
+        first = os.path.basename(shard_name(user_id, start)) if start else ""
+        last = os.path.basename(shard_name(user_id, end)) if end else "~"
+        hits = []
+        for record_id in self.ids():
+            shard = self._index.get(record_id)
+            if shard is None or os.path.dirname(shard) != user_dir or not first <= os.path.basename(shard) <= last:
+                continue
+            record = self.get(record_id)
+            if record is not None and record.get("user_id") == user_id:
+                ts = ts_epoch(record.get("timestamp"))
+                if lo <= ts < hi:
+                    hits.append((ts, record_id, record))
+        return [record for _, _, record in sorted(hits, key=lambda h: h[:2])]
+
+    # --- Writes ----------------------------------------------------------
+
+    def put(self, record_id: str, record: Dict[str, Any]):
+        shard = shard_name(record.get("user_id"), record.get("timestamp"))
+        with self._lock:
+            old = self._index.get(record_id)
+            if old is not None and old != shard:
+                self._pending.setdefault(old, {})[record_id] = None  # moved to another user/day
+            self._pending.setdefault(shard, {})[record_id] = record
+            self._index[record_id] = shard
+        self._notify("put", record_id, record)
+
+    def delete(self, record_id: str):
+        with self._lock:
+            shard = self._index.pop(record_id, None)
+            if shard is None:
+                return
+            self._pending.setdefault(shard, {})[record_id] = None
+        self._notify("delete", record_id)
+
+    def import_legacy(self, legacy_path: str) -> int:
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for record_id, record in data.items():
+            self.put(record_id, record)
+        logger.info(f"Shards {self.root}: imported {len(data)} records from {legacy_path}")
+        return len(data)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            for shard, changes in pending.items():
+                path = self._path(shard)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                update_json_dict(path, changes, indent=None)
+                # Cache what this process knew plus its own changes, marked stale, so the
+                # refresh() below reports whatever other writers put in the same shard
+                known = dict(self._shards.get(shard, ((0, 0), {}))[1])
+                for record_id, record in changes.items():
+                    if record is None:
+                        known.pop(record_id, None)
+                    else:
+                        known[record_id] = record
+                self._shards[shard] = ((-1, -1), known)
+            if pending:
+                self._changed = True
+        self.refresh()
+        self._export_if_due()
+        self._notify("flush")
+
+    def _export_if_due(self, force: bool = False):
+        if not self.export_legacy_to or not self._changed:
+            return
+        if force or time.monotonic() - self._last_export >= self.legacy_interval:
+            self.export_legacy(self.export_legacy_to)
+            self._changed = False
+            self._last_export = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self._export_if_due(force=True)
+
+    def export_legacy(self, legacy_path: str):
+        """Write the id-keyed output_log.json used by the Node insights route (merged over all shards)."""
+        with file_lock(legacy_path):
+            self.refresh()
+            atomic_write_json(legacy_path, dict(self.items()))
+
+
+def open_output_store(output_file: str, journal: Optional[str] = None, export_legacy: bool = False,
+                      shards: Optional[str] = None, legacy_interval: float = 0.0):
+    """
+    ShardedStore under `shards`, journal-backed store if `journal` is set,
+    else the legacy output_log.json dict.
+
+    A new sharded/journal store imports output_log.json. Only with
+    `export_legacy` (--legacy-export) do they write it back: a rewrite of
+    every record, at most every `legacy_interval` seconds and on close, for
+    routes/insights.js. Without it a flush costs O(records written).
+    """
+    if shards:
+        return ShardedStore(shards, legacy_path=output_file, export_legacy=export_legacy,
+                            legacy_interval=legacy_interval)
+    if journal:
+        return JournalStore(journal, legacy_path=output_file, export_legacy=export_legacy,
+                            legacy_interval=legacy_interval)
+    return JsonFileStore(output_file)
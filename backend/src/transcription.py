@@ -1,31 +1,210 @@
 import os
+import re
 import sys
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from openai import OpenAI
 from loguru import logger
 import click
+from functools import lru_cache
+from typing import Any, Dict, Optional
 
-def transcribe_audio(audio_path, api_key):
-    """Transcribe audio file using OpenAI Whisper API"""
-    if not os.path.exists(audio_path):
-        raise FileNotFoundError(f"Audio not found: {audio_path}")
-    
-    # Initialize OpenAI client with provided API key
-    client = OpenAI(api_key=api_key)
-    
-    with open(audio_path, "rb") as audio_file:
-        result = client.audio.transcriptions.create(
-            model="whisper-1",
-            file=audio_file,
-            response_format="verbose_json"
-        )
+from cache import PersistentLRU, DEFAULT_CACHE_DIR
+from metrics import incr
+
+from audio_prep import (AudioError, CHUNK_S, OVERLAP_S, TARGET_RATE, decode_upload, encode_upload, encode_wav,
+                        load_mono, preprocess_audio, split_at_silence)
+
+# Recordings longer than this (seconds, after trimming) are transcribed in parallel chunks
+LONG_AUDIO_S = float(os.getenv("LONG_AUDIO_S", "60"))
+# Longest word run at a chunk seam that is checked for duplication
+MAX_OVERLAP_WORDS = 12
+_WORD = re.compile(r"[\w']+")
+
+WHISPER_MODEL = "whisper-1"
+TRANSCRIPT_CACHE_PATH = os.getenv("TRANSCRIPT_CACHE_PATH", os.path.join(DEFAULT_CACHE_DIR, "transcripts.json"))
+TRANSCRIPT_CACHE_DISABLED = os.getenv("TRANSCRIPT_CACHE_DISABLE", "").lower() in ("1", "true", "yes")
+
+
+@lru_cache(maxsize=4)
+def _client_for(api_key):
+    """One OpenAI client per API key, reused across calls in long-lived processes."""
+    return OpenAI(api_key=api_key)
+
+def _whisper(client, upload, gate=None):
+    """One transcription request; `gate` (e.g. the batch's OpenAI semaphore) is held only around it."""
+    with gate or nullcontext():
+        return _whisper_call(client, upload)
+
+def _whisper_call(client, upload):
+    incr("api_calls", api="whisper")
+    incr("bytes_uploaded", len(upload[1]), api="whisper")
+    result = client.audio.transcriptions.create(
+        model=WHISPER_MODEL,
+        file=upload,
+        response_format="verbose_json"
+    )
+    return result.text
+
+def dedupe_overlap(previous, text, max_words=MAX_OVERLAP_WORDS):
+    """Drop the leading words of `text` that repeat the tail of `previous` (chunk overlap)."""
+    prev_words = [w.lower() for w in _WORD.findall(previous)][-max_words:]
+    matches = list(_WORD.finditer(text))
+    next_words = [m.group(0).lower() for m in matches[:max_words]]
+    for k in range(min(len(prev_words), len(next_words)), 0, -1):
+        if prev_words[-k:] == next_words[:k]:
+            return text[matches[k - 1].end():].lstrip(" ,.;:")
+    return text.strip()
+
+def iter_transcribe_chunks(audio_path, api_key, chunk_s=CHUNK_S, overlap_s=OVERLAP_S, max_workers=4,
+                           samples=None, gate=None):
+    """
+    Long-audio mode: split the recording at quiet points into overlapping
+    chunks, transcribe them concurrently and yield each chunk's text in order
+    (overlap removed) as soon as it and every earlier chunk are done.
+
+    `samples` are already decoded (trimmed, mono, TARGET_RATE) samples of
+    the file, to skip decoding it again. `gate` is acquired per chunk
+    request, so a caller's concurrency limit (--max-openai) still holds.
+    """
+    client = _client_for(api_key)
+    x = load_mono(audio_path) if samples is None else samples
+    if x is None:
+        # Container we can't decode locally: one request for the whole file
+        data, name, _ = preprocess_audio(audio_path)
+        yield _whisper(client, (name, data), gate)
+        return
+    if len(x) == 0:
+        raise AudioError(f"{audio_path}: audio is silent")
+    base = os.path.splitext(os.path.basename(audio_path))[0]
+    spans = split_at_silence(x, TARGET_RATE, chunk_s=chunk_s, overlap_s=overlap_s)
+    logger.debug(f"Transcribing {audio_path} in {len(spans)} chunks")
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(spans)))) as pool:
+        futures = [
+            pool.submit(_whisper, client, (f"{base}.{i}.wav", encode_wav(x[a:b], TARGET_RATE)), gate)
+            for i, (a, b) in enumerate(spans)
+        ]
+        previous = ""
+        for fut in futures:
+            text = fut.result()
+            piece = dedupe_overlap(previous, text) if previous else text.strip()
+            previous = text
+            if piece:
+                yield piece
+
+def transcribe_long_audio(audio_path, api_key, **chunk_opts):
+    """Chunked, concurrent transcription of a long recording, stitched into one transcript."""
+    return " ".join(iter_transcribe_chunks(audio_path, api_key, **chunk_opts))
+
+def audio_digest(audio_path, chunk_size=1 << 16):
+    """SHA-256 of the file contents, read in chunks so large uploads are never held whole."""
+    h = hashlib.sha256()
+    with open(audio_path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+_transcript_memo: Optional[PersistentLRU] = None
+_transcript_memo_lock = threading.Lock()
+
+def _memo() -> PersistentLRU:
+    global _transcript_memo
+    with _transcript_memo_lock:
+        if _transcript_memo is None:
+            _transcript_memo = PersistentLRU(TRANSCRIPT_CACHE_PATH, max_entries=5000, autosave_every=20,
+                                              name="transcript")
+        return _transcript_memo
+
+def transcript_cache_stats() -> Dict[str, Any]:
+    return _memo().stats()
+
+def save_transcript_cache():
+    if _transcript_memo is not None:
+        _transcript_memo.save()
+
+
+class TranscriptionService:
+    """
+    Whisper transcription with one reused OpenAI client and a disk cache of
+    transcripts keyed by the SHA-256 of the audio bytes, so duplicate uploads,
+    re-runs and retries never pay for the same recording twice.
+    """
+
+    def __init__(self, api_key, cache: Optional[PersistentLRU] = None, use_cache=True,
+                 preprocess=True, long_audio_s=LONG_AUDIO_S):
+        self.api_key = api_key
+        self.client = _client_for(api_key)
+        self.use_cache = use_cache and not TRANSCRIPT_CACHE_DISABLED
+        self.cache = cache if cache is not None else (_memo() if self.use_cache else None)
+        self.preprocess = preprocess
+        self.long_audio_s = long_audio_s
+
+    @staticmethod
+    def cache_key(digest):
+        return f"{WHISPER_MODEL}:{digest}"
+
+    def transcribe(self, audio_path, gate=None):
+        """`gate` is an optional context manager (e.g. a semaphore) held around each Whisper request."""
+        if not os.path.exists(audio_path):
+            raise FileNotFoundError(f"Audio not found: {audio_path}")
+        key = self.cache_key(audio_digest(audio_path)) if self.cache is not None else None
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                logger.info(f"Transcription cache hit for: {audio_path}")
+                return cached
+        transcript = self._transcribe(audio_path, gate)
+        if key is not None:
+            self.cache.put(key, transcript)
+        return transcript
+
+    def _transcribe(self, audio_path, gate=None):
+        # Validate, downmix/resample and trim silence before paying for the upload
+        if self.preprocess:
+            data, x, stats = decode_upload(audio_path)
+            if x is None:
+                upload = (f"{os.path.splitext(os.path.basename(audio_path))[0]}.{stats['format']}", data)
+            elif self.long_audio_s and len(x) / TARGET_RATE > self.long_audio_s:
+                transcript = transcribe_long_audio(audio_path, self.api_key, samples=x, gate=gate)
+                logger.info(f"Transcription completed for: {audio_path} (chunked)")
+                return transcript
+            else:
+                data, name = encode_upload(audio_path, x, stats)
+                upload = (name, data)
+            logger.debug(f"Preprocessed {audio_path}: {stats['original_bytes']} -> {stats['bytes']} bytes")
+        else:
+            with open(audio_path, "rb") as f:
+                upload = (os.path.basename(audio_path), f.read())
+
+        transcript = _whisper(self.client, upload, gate)
         logger.info(f"Transcription completed for: {audio_path}")
-        return result.text
+        return transcript
+
+    def save(self):
+        if self.cache is not None:
+            self.cache.save()
+
+
+@lru_cache(maxsize=4)
+def default_service(api_key):
+    """Shared TranscriptionService per API key for the module-level helpers."""
+    return TranscriptionService(api_key)
+
+def transcribe_audio(audio_path, api_key, preprocess=True, long_audio_s=LONG_AUDIO_S, gate=None):
+    """Transcribe audio file using OpenAI Whisper API (cached by audio content hash)"""
+    if preprocess and long_audio_s == LONG_AUDIO_S:
+        return default_service(api_key).transcribe(audio_path, gate)
+    return TranscriptionService(api_key, preprocess=preprocess, long_audio_s=long_audio_s).transcribe(audio_path, gate)
 
 @click.command()
 @click.argument('input_file')
 @click.option('--api-key', help='OpenAI API key (or set OPENAI_API_KEY env var)')
 @click.option('--verbose', '-v', is_flag=True, help='Enable verbose logging')
-def main(input_file, api_key, verbose):
+@click.option('--no-preprocess', is_flag=True, help='Upload the file unchanged (no resample/trim)')
+@click.option('--stream', is_flag=True, help='Chunked mode: print partial transcripts as chunks finish')
+def main(input_file, api_key, verbose, no_preprocess, stream):
     """Transcribe audio using OpenAI Whisper API"""
     
     # Set up logging
@@ -49,7 +228,12 @@ def main(input_file, api_key, verbose):
             sys.exit(1)
         
         print(f"Transcribing: {input_file}")
-        transcript = transcribe_audio(input_file, api_key)
+        if stream:
+            for piece in iter_transcribe_chunks(input_file, api_key):
+                print(piece, flush=True)
+            return
+        transcript = transcribe_audio(input_file, api_key, preprocess=not no_preprocess)
+        save_transcript_cache()
         print(f"\nTranscript:\n{transcript}")
         
     except Exception as e:
@@ -0,0 +1,92 @@
+import json
+import time
+import random
+import threading
+from typing import Dict, Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from loguru import logger
+
+from metrics import incr
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TransportError(RuntimeError):
+    pass
+
+
+class PooledJsonTransport:
+    """
+    Keep-alive JSON POST transport shared by every caller in the process.
+
+    One requests.Session with a sized connection pool (no TCP/TLS handshake
+    per call), a semaphore bounding requests in flight, and retries with
+    full-jitter exponential backoff on 429/5xx and connection errors.
+    Retry-After is honoured when the server sends it. Calls, retries and
+    bytes sent are reported to metrics under `name`.
+    """
+
+    def __init__(self, base_url: str, headers: Optional[Dict[str, str]] = None, timeout: float = 20,
+                 pool_size: int = 16, max_concurrency: int = 4, max_retries: int = 4,
+                 backoff_base: float = 0.5, backoff_cap: float = 8.0, name: str = "http"):
+        self.base_url = base_url
+        self.name = name
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json", **(headers or {})})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrency))
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "failures": 0}
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after:
+            try:
+                return min(self.backoff_cap, float(retry_after))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    def post_json(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        # Serialised once so retries resend the same bytes
+        data = json.dumps(body).encode("utf-8")
+        attempt = 0
+        while True:
+            self._count("requests")
+            incr("api_calls", api=self.name)
+            incr("bytes_uploaded", len(data), api=self.name)
+            try:
+                with self._slots:
+                    resp = self.session.post(self.base_url, data=data, timeout=self.timeout)
+                if resp.status_code not in RETRY_STATUSES:
+                    resp.raise_for_status()
+                    return resp.json()
+                error: Exception = requests.HTTPError(f"{resp.status_code} from {self.base_url}", response=resp)
+                retry_after = resp.headers.get("Retry-After")
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error, retry_after = e, None
+            if attempt >= self.max_retries:
+                self._count("failures")
+                incr("api_failures", api=self.name)
+                raise TransportError(f"POST {self.base_url} failed after {attempt + 1} attempts: {error}") from error
+            delay = self._backoff(attempt, retry_after)
+            logger.debug(f"Retrying POST {self.base_url} in {delay:.2f}s ({error})")
+            self._count("retries")
+            incr("api_retries", api=self.name)
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self):
+        self.session.close()
+
@@ -0,0 +1,405 @@
+import os
+import json
+import time
+import signal
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional
+
+from loguru import logger
+
+from payload import process_record, make_nutritionix_client
+from classifier import parse_cache_stats, save_parse_cache
+from transcription import transcript_cache_stats, save_transcript_cache
+from nutrition_db import LocalNutritionDB
+from exercise_engine import default_snapshot_path, recompute_changed
+from rollups import Rollups, default_rollup_path
+from store import open_output_store
+from metrics import METRICS, span
+from fingerprint import FingerprintIndex, default_fingerprint_path, link_duplicate
+
+
+def _load_json(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def spool_log_ids(spool_dir: str, log_ids: List[str], name: Optional[str] = None) -> str:
+    """
+    Queue log ids for a worker. The file is written under a temp name and
+    renamed into the spool, so the worker never sees it half-written; other
+    producers must do the same (dotfiles and *.tmp names are ignored).
+    """
+    os.makedirs(spool_dir, exist_ok=True)
+    name = name or f"{time.time_ns()}-{os.getpid()}.ids"
+    tmp = os.path.join(spool_dir, f".{name}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("".join(f"{log_id}\n" for log_id in log_ids))
+    path = os.path.join(spool_dir, name)
+    os.replace(tmp, path)
+    return path
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        return False  # os.kill would terminate it; spools are single-worker there
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class _WatchedJson:
+    """A JSON file kept in memory and re-read only when its mtime changes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = None
+        self.data: Dict[str, Any] = {}
+        self.refresh()
+
+    def refresh(self) -> bool:
+        mtime = os.path.getmtime(self.path)
+        if mtime == self.mtime:
+            return False
+        self.data = _load_json(self.path)
+        self.mtime = mtime
+        return True
+
+
+class PipelineWorker:
+    """
+    Resident version of payload.py.
+
+    Log ids are picked up from a spool directory: a producer renames a file
+    into it whose name is the log id (or whose lines are log ids); see
+    spool_log_ids(). The OpenAI/Nutritionix
+    clients, profiles, log.json and the output index stay in memory, so the
+    per-log cost is just the API calls. The output store is flushed every
+    `checkpoint_every` records or after `flush_interval` idle seconds.
+    Logs repeating a processed log's content are linked to its output
+    (see fingerprint.py); one whose original is still running is retried on
+    the next poll, and any left at shutdown are finished (or re-spooled)
+    after the drain.
+
+    A spool file is claimed by renaming it to <name>.<pid>.claimed and is
+    deleted only once every id in it is stored (and flushed) or has failed.
+    Claims left by a worker that died are renamed back on startup, so a
+    crash re-runs those logs instead of dropping them.
+    """
+
+    def __init__(
+        self,
+        logs_path: str,
+        profiles_path: str,
+        uploads_dir: str,
+        output_file: str,
+        spool_dir: str,
+        journal: Optional[str] = None,
+        shards: Optional[str] = None,
+        export_legacy: bool = False,
+        legacy_interval: float = 300.0,
+        workers: int = 4,
+        max_openai: int = 4,
+        max_nutritionix: int = 2,
+        checkpoint_every: int = 20,
+        flush_interval: float = 5.0,
+        poll_interval: float = 0.5,
+    ):
+        self.logs = _WatchedJson(logs_path)
+        self.profiles = _WatchedJson(profiles_path)
+        self.uploads_dir = uploads_dir
+        self.spool_dir = spool_dir
+        self.checkpoint_every = checkpoint_every
+        self.flush_interval = flush_interval
+        self.poll_interval = poll_interval
+
+        os.makedirs(spool_dir, exist_ok=True)
+        self._requeue_claims()
+        self.store = open_output_store(output_file, journal, export_legacy=export_legacy, shards=shards,
+                                       legacy_interval=legacy_interval)
+        self.rollups = Rollups.attach(self.store, default_rollup_path(output_file))
+        self.weight_snapshot = default_snapshot_path(output_file)
+        self.fingerprints = FingerprintIndex(default_fingerprint_path(output_file), uploads_dir)
+        self._weights_mtime = None
+        self.nx = make_nutritionix_client(max_concurrency=max_nutritionix)
+        self.local_db = LocalNutritionDB.load()
+        self.limits = {"openai": threading.BoundedSemaphore(max(1, max_openai))}
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers))
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._queued: set = set()
+        self._deferred: List[str] = []
+        self._claims: Dict[str, set] = {}  # claimed spool file -> its ids not yet stored or failed
+        self._dirty = 0
+        self._last_save = time.monotonic()
+        self.started_at = time.time()
+        self.stats = {"processed": 0, "failed": 0, "skipped": 0, "linked": 0}
+        self.last_error: Optional[str] = None
+
+    # --- Queue -----------------------------------------------------------
+
+    def _requeue_claims(self):
+        """Rename claims of workers that are no longer running back into the spool."""
+        for name in os.listdir(self.spool_dir):
+            if not name.endswith(".claimed"):
+                continue
+            original, pid, _ = name.rsplit(".", 2)
+            if pid.isdigit() and int(pid) != os.getpid() and _pid_alive(int(pid)):
+                continue
+            try:
+                os.replace(os.path.join(self.spool_dir, name), os.path.join(self.spool_dir, original))
+            except OSError:
+                continue  # another starting worker re-queued it first
+            logger.warning(f"Worker: re-queued unfinished spool file {original}")
+
+    def _claim_spool(self) -> List[str]:
+        ids: List[str] = []
+        for name in sorted(os.listdir(self.spool_dir)):
+            if name.startswith(".") or name.endswith((".tmp", ".claimed")):
+                continue  # producer temp file not renamed into place yet, or already claimed
+            path = os.path.join(self.spool_dir, name)
+            claimed = f"{path}.{os.getpid()}.claimed"
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue  # another worker claimed it first
+            with open(claimed, "r", encoding="utf-8") as f:
+                lines = [ln.strip() for ln in f if ln.strip()] or [name]
+            with self._lock:
+                self._claims[claimed] = set(lines)
+            ids.extend(lines)
+        return ids
+
+    def _settle(self, log_id: str):
+        """`log_id` is stored or has failed; its claims may go after the next flush. Caller holds _lock."""
+        for ids in self._claims.values():
+            ids.discard(log_id)
+
+    def submit(self, log_id: str) -> bool:
+        with self._lock:
+            if log_id in self._queued:
+                return False
+            if log_id in self.store:
+                self.stats["skipped"] += 1
+                self._settle(log_id)
+                return False
+            self._queued.add(log_id)
+        self.pool.submit(self._process, log_id)
+        return True
+
+    def _process(self, log_id: str):
+        try:
+            record = self.logs.data.get(log_id)
+            if record is None and self.logs.refresh():
+                record = self.logs.data.get(log_id)
+            if record is None:
+                raise KeyError(f"log id {log_id} not found in {self.logs.path}")
+            original = self.fingerprints.claim(log_id, record, self.store.__contains__)
+            if original is not None:
+                original_output = self.store.get(original)
+                if original_output is None:
+                    # Original still in flight: try again once it is stored (or has failed)
+                    with self._lock:
+                        self._queued.discard(log_id)
+                        self._deferred.append(log_id)
+                    return
+                enriched = link_duplicate(original_output, record, original)
+            else:
+                self.profiles.refresh()
+                enriched = process_record(record, self.profiles.data, self.uploads_dir, self.nx, self.limits, self.local_db)
+        except Exception as e:
+            logger.warning(f"Worker: log {log_id} failed: {e}")
+            self.fingerprints.release(log_id)
+            with self._lock:
+                self._queued.discard(log_id)
+                self._settle(log_id)
+                self.stats["failed"] += 1
+                self.last_error = f"{log_id}: {e}"
+            return
+        with self._lock:
+            self.store.put(log_id, enriched)
+            self.fingerprints.commit(log_id)
+            self._queued.discard(log_id)
+            self._settle(log_id)
+            self.stats["linked" if original is not None else "processed"] += 1
+            self._dirty += 1
+            if self.checkpoint_every and self._dirty >= self.checkpoint_every:
+                self._save_locked()
+        logger.info(f"Worker: completed extraction for {log_id}")
+
+    def _save_locked(self):
+        with span("save"):
+            self.store.flush()
+            save_parse_cache()
+            save_transcript_cache()
+            if self.nx is not None and self.nx.cache is not None:
+                self.nx.cache.save()
+            self.fingerprints.save()
+        # Claims whose logs are all flushed (or failed) are done
+        for claimed in [claimed for claimed, ids in self._claims.items() if not ids]:
+            try:
+                os.remove(claimed)
+            except FileNotFoundError:
+                pass
+            del self._claims[claimed]
+        self._dirty = 0
+        self._last_save = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            if self._dirty or any(not ids for ids in self._claims.values()):
+                self._save_locked()
+
+    def _check_profiles(self):
+        """Recompute stored exercise calories for users whose profile weight changed."""
+        self.profiles.refresh()
+        if self.profiles.mtime == self._weights_mtime:
+            return
+        with self._lock:
+            try:
+                recompute_changed(self.store, self.profiles.data, self.weight_snapshot)
+            except Exception as e:
+                logger.warning(f"Worker: exercise recompute failed: {e}")
+                self.last_error = f"recompute: {e}"
+            self._weights_mtime = self.profiles.mtime
+
+    # --- Lifecycle -------------------------------------------------------
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "status": "draining" if self._stop.is_set() else "ok",
+                "uptime_s": round(time.time() - self.started_at, 1),
+                "in_flight": len(self._queued),
+                "deferred": len(self._deferred),
+                "unsaved": self._dirty,
+                "known_outputs": len(self.store),
+                "last_error": self.last_error,
+                "parse_cache": parse_cache_stats(),
+                "transcript_cache": transcript_cache_stats(),
+                "nutrition_cache": self.nx.cache.stats() if self.nx is not None and self.nx.cache is not None else None,
+                "stages": METRICS.snapshot()["stages"],
+                **self.stats,
+            }
+
+    def stop(self, *_):
+        if not self._stop.is_set():
+            logger.info("Worker: shutdown requested, draining")
+        self._stop.set()
+
+    def run(self):
+        logger.info(f"Worker: watching {self.spool_dir}")
+        while not self._stop.is_set():
+            self._check_profiles()
+            with self._lock:
+                deferred, self._deferred = self._deferred, []
+            for log_id in deferred + self._claim_spool():
+                self.submit(log_id)
+            if time.monotonic() - self._last_save >= self.flush_interval:
+                self.flush()
+            self._stop.wait(self.poll_interval)
+        # Graceful drain: finish everything already submitted, then persist
+        self.pool.shutdown(wait=True)
+        # Deferred duplicates' originals are now stored or failed: link (or run) them here
+        with self._lock:
+            deferred, self._deferred = self._deferred, []
+        for log_id in deferred:
+            if log_id not in self.store:
+                self._process(log_id)
+        with self._lock:
+            leftover, self._deferred = self._deferred, []
+        if leftover:
+            spool_log_ids(self.spool_dir, leftover)
+            logger.warning(f"Worker: re-spooled {len(leftover)} deferred logs")
+            with self._lock:
+                for log_id in leftover:
+                    self._settle(log_id)
+        with self._lock:
+            self._save_locked()
+            self.store.close()
+        logger.info(f"Worker: stopped ({self.stats['processed']} processed, {self.stats['failed']} failed)")
+
+
+def serve_health(worker: PipelineWorker, host: str, port: int) -> ThreadingHTTPServer:
+    """Expose GET /health (JSON status) and /metrics (Prometheus text) on a background thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.rstrip("/")
+            if path == "/metrics":
+                body, content_type = METRICS.to_prometheus().encode("utf-8"), "text/plain; version=0.0.4"
+            elif path in ("/health", "/status"):
+                body, content_type = json.dumps(worker.status()).encode("utf-8"), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Worker: health endpoint on http://{host}:{server.server_port}/health")
+    return server
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--logs", required=True, help="Path to log.json (dict keyed by log id)")
+    ap.add_argument("--profiles", required=True, help="Path to profile.json (dict keyed by userId)")
+    ap.add_argument("--uploads-dir", default=".", help="Base directory where audio/photo files are stored")
+    ap.add_argument("--output_log", required=True, help="Path to output_log.json (dict keyed by log id)")
+    ap.add_argument("--journal", help="Append-only JSONL output store; a new journal imports output_log.json")
+    ap.add_argument("--shards", help="Directory of per-user/day output shards, safe for several concurrent processes; "
+                                     "a new shard directory imports output_log.json")
+    ap.add_argument("--legacy-export", action="store_true",
+                    help="With --journal/--shards, also rewrite output_log.json for routes/insights.js "
+                         "(a full rewrite of every record, at most every --legacy-export-interval seconds and on exit)")
+    ap.add_argument("--legacy-export-interval", type=float, default=300.0,
+                    help="Minimum seconds between two output_log.json exports with --legacy-export")
+    ap.add_argument("--spool-dir", required=True, help="Directory watched for files naming log ids to process")
+    ap.add_argument("--workers", type=int, default=4, help="Size of the worker pool")
+    ap.add_argument("--max-openai", type=int, default=4, help="Concurrent OpenAI requests")
+    ap.add_argument("--max-nutritionix", type=int, default=2, help="Concurrent Nutritionix requests")
+    ap.add_argument("--checkpoint-every", type=int, default=20, help="Save output_log.json every N records")
+    ap.add_argument("--flush-interval", type=float, default=5.0, help="Save pending records after N idle seconds")
+    ap.add_argument("--health-host", default="127.0.0.1", help="Bind address for the health endpoint")
+    ap.add_argument("--health-port", type=int, default=8765, help="Port for the health endpoint (0 disables it)")
+    args = ap.parse_args()
+
+    worker = PipelineWorker(
+        args.logs, args.profiles, args.uploads_dir, args.output_log, args.spool_dir,
+        journal=args.journal,
+        shards=args.shards,
+        export_legacy=args.legacy_export,
+        legacy_interval=args.legacy_export_interval,
+        workers=args.workers,
+        max_openai=args.max_openai,
+        max_nutritionix=args.max_nutritionix,
+        checkpoint_every=args.checkpoint_every,
+        flush_interval=args.flush_interval,
+    )
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+
+    server = serve_health(worker, args.health_host, args.health_port) if args.health_port else None
+    try:
+        worker.run()
+    finally:
+        if server:
+            server.shutdown()
+
+if __name__ == "__main__":
+    main()
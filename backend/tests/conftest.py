@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+# classifier builds its OpenAI client at import; tests point it at api_stubs when they need it
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+# Keep the persistent parse/transcript/Nutritionix caches out of backend/data
+os.environ["PIPELINE_CACHE_DIR"] = tempfile.mkdtemp(prefix="pipeline-tests-")
@@ -0,0 +1,133 @@
+import io
+import wave
+
+import numpy as np
+import pytest
+
+from audio_prep import (TARGET_RATE, AudioError, preprocess_audio, read_wav, resample, sniff_format,
+                        trim_silence)
+
+
+def _wav_bytes(x, rate, width=2):
+    """PCM WAV of float samples (frames,) or (frames, channels) in [-1, 1]."""
+    x = x.reshape(len(x), -1)
+    if width == 1:
+        pcm = (x * 127 + 128).astype(np.uint8).tobytes()
+    else:
+        pcm = (x * (2 ** (8 * width - 1) - 1)).astype("<i4").view(np.uint8).reshape(-1, 4)[:, :width].tobytes()
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(x.shape[1])
+        w.setsampwidth(width)
+        w.setframerate(rate)
+        w.writeframes(pcm)
+    return buf.getvalue()
+
+
+def _tone(seconds, rate, hz=440.0, level=0.5):
+    t = np.arange(int(seconds * rate)) / rate
+    return (level * np.sin(2 * np.pi * hz * t)).astype(np.float32)
+
+
+def _write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+@pytest.mark.parametrize("width", [1, 2, 3, 4])
+def test_read_wav_decodes_every_pcm_width(width):
+    tone = _tone(0.1, 8000)
+    x, rate = read_wav(_wav_bytes(tone, 8000, width))
+    assert rate == 8000 and x.shape == (len(tone), 1)
+    assert np.abs(x[:, 0] - tone).max() < 0.02
+
+
+def test_stereo_44k_is_downmixed_resampled_and_trimmed(tmp_path):
+    rate = 44100
+    quiet = np.zeros(rate, dtype=np.float32)
+    speech = np.concatenate([quiet, _tone(2.0, rate), quiet])
+    path = _write(tmp_path, "note.wav", _wav_bytes(np.stack([speech, speech], axis=1), rate))
+
+    data, name, stats = preprocess_audio(path, compact="")
+
+    x, out_rate = read_wav(data)
+    assert name == "note.wav" and out_rate == TARGET_RATE and x.shape[1] == 1
+    assert stats["duration_s"] == pytest.approx(4.0, abs=0.01)
+    assert stats["trimmed_s"] == pytest.approx(2.0 - 0.4, abs=0.05)  # PAD_MS kept on each side
+    assert stats["bytes"] == len(data) < stats["original_bytes"] / 4
+
+
+def test_trim_silence_keeps_padding_around_speech():
+    x = np.concatenate([np.zeros(TARGET_RATE), _tone(1.0, TARGET_RATE), np.zeros(TARGET_RATE)])
+    trimmed = trim_silence(x, TARGET_RATE, pad_ms=100)
+    assert len(trimmed) == pytest.approx(1.2 * TARGET_RATE, abs=TARGET_RATE * 0.02)
+
+
+def test_resample_keeps_duration_and_pitch():
+    y = resample(_tone(1.0, 48000, hz=300), 48000, TARGET_RATE)
+    assert len(y) == TARGET_RATE
+    peak_hz = np.argmax(np.abs(np.fft.rfft(y))) * TARGET_RATE / len(y)
+    assert peak_hz == pytest.approx(300, abs=2)
+
+
+def test_silent_or_broken_uploads_are_rejected(tmp_path):
+    silent = _write(tmp_path, "silent.wav", _wav_bytes(np.zeros(TARGET_RATE, dtype=np.float32), TARGET_RATE))
+    truncated = _write(tmp_path, "cut.wav", _wav_bytes(_tone(1.0, TARGET_RATE), TARGET_RATE)[:30])
+    garbage = _write(tmp_path, "junk.bin", b"hello, not audio at all")
+
+    with pytest.raises(AudioError, match="silent"):
+        preprocess_audio(silent)
+    with pytest.raises(AudioError):
+        preprocess_audio(truncated)
+    with pytest.raises(AudioError, match="unrecognised"):
+        preprocess_audio(garbage)
+
+
+@pytest.mark.parametrize("head, fmt", [
+    (b"ID3\x04\x00", "mp3"),
+    (b"fLaC\x00\x00\x00\x22", "flac"),
+    (b"OggS\x00\x02", "ogg"),
+    (b"\x00\x00\x00\x20ftypM4A ", "m4a"),
+    (b"\x1a\x45\xdf\xa3\x01", "webm"),
+])
+def test_other_containers_pass_through_untouched(tmp_path, head, fmt):
+    data = head + bytes(range(64))
+    assert sniff_format(data[:12]) == fmt
+
+    out, name, stats = preprocess_audio(_write(tmp_path, "upload.bin", data))
+    assert out == data and name == f"upload.{fmt}" and stats["format"] == fmt
+
+
+def _riff(fmt_tag, bits, samples, extensible=False):
+    """Hand-built mono 16 kHz WAV in an encoding the stdlib wave module can't read."""
+    block = bits // 8
+    fmt = (fmt_tag.to_bytes(2, "little") + (1).to_bytes(2, "little") + TARGET_RATE.to_bytes(4, "little")
+           + (TARGET_RATE * block).to_bytes(4, "little") + block.to_bytes(2, "little") + bits.to_bytes(2, "little"))
+    if extensible:
+        fmt += (22).to_bytes(2, "little") + bits.to_bytes(2, "little") + (4).to_bytes(4, "little") + bytes(16)
+    chunks = b"fmt " + len(fmt).to_bytes(4, "little") + fmt + b"data" + len(samples).to_bytes(4, "little") + samples
+    return b"RIFF" + (4 + len(chunks)).to_bytes(4, "little") + b"WAVE" + chunks
+
+
+@pytest.mark.parametrize("data", [
+    _riff(3, 32, _tone(0.5, TARGET_RATE).astype("<f4").tobytes()),
+    _riff(0xFFFE, 16, (_tone(0.5, TARGET_RATE) * 32767).astype("<i2").tobytes(), extensible=True),
+], ids=["ieee-float", "extensible"])
+def test_wav_encodings_wave_cannot_read_pass_through(tmp_path, data):
+    out, name, stats = preprocess_audio(_write(tmp_path, "note.wav", data))
+    assert out == data and name == "note.wav" and stats["format"] == "wav"
+
+
+def test_riff_without_audio_is_still_rejected(tmp_path):
+    header_only = _riff(3, 32, b"")
+    with pytest.raises(AudioError, match="corrupt WAV header"):
+        preprocess_audio(_write(tmp_path, "empty.wav", header_only))
+
+
+@pytest.mark.parametrize("sync", [b"\xff\xfb", b"\xff\xfa", b"\xff\xf3", b"\xff\xf2", b"\xff\xe3"])
+def test_bare_mpeg_frames_pass_through(tmp_path, sync):
+    data = sync + b"\x90\x64" + bytes(64)
+    out, name, _ = preprocess_audio(_write(tmp_path, "memo.bin", data))
+    assert out == data and name == "memo.mp3"
+    assert sniff_format(b"\xff\x1b\x00\x00") is None
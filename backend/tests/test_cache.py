@@ -0,0 +1,70 @@
+import cache
+from cache import PersistentLRU
+from calculator import NutritionCache
+
+
+def test_lru_evicts_least_recently_used():
+    lru = PersistentLRU(None, max_entries=2)
+    lru.put("a", 1)
+    lru.put("b", 2)
+    assert lru.get("a") == 1  # "b" is now the oldest
+    lru.put("c", 3)
+
+    assert lru.get("b") is None
+    assert (lru.get("a"), lru.get("c")) == (1, 3)
+    assert lru.stats()["evictions"] == 1
+
+
+def test_lru_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    lru = PersistentLRU(None, ttl_s=60)
+    lru.put("a", 1)
+    now[0] += 59
+    assert lru.get("a") == 1
+    now[0] += 2
+    assert lru.get("a") is None
+    assert len(lru) == 0
+    assert (lru.hits, lru.misses) == (1, 1)
+
+
+def test_lru_persists_across_instances(tmp_path):
+    path = str(tmp_path / "c.json")
+    lru = PersistentLRU(path, autosave_every=0)
+    lru.put("a", {"x": 1})
+    assert not (tmp_path / "c.json").exists()  # only written on save() with autosave off
+    lru.save()
+
+    assert PersistentLRU(path).get("a") == {"x": 1}
+
+
+def test_lru_autosaves_every_n_puts(tmp_path):
+    path = str(tmp_path / "c.json")
+    lru = PersistentLRU(path, autosave_every=2)
+    lru.put("a", 1)
+    assert not (tmp_path / "c.json").exists()
+    lru.put("b", 2)
+    assert PersistentLRU(path).get("b") == 2
+
+
+def test_nutrition_cache_stores_per_unit_and_scales():
+    nc = NutritionCache(None)
+    nc.store({"name": "Bananas", "quantity": 2, "unit": "count"}, {"calories": 210.0, "protein_g": 2.6}, "42")
+
+    hit = nc.lookup({"name": "banana", "quantity": 3, "unit": "pieces"})
+    assert hit["macros"] == {"calories": 315.0, "protein_g": 3.9}
+    assert hit["source_ref"] == {"provider": "Nutritionix", "id": "42"}
+    assert hit["name"] == "banana"
+
+
+def test_nutrition_cache_keys_on_normalised_name_and_unit():
+    key = NutritionCache.key
+    assert key({"name": "Large Bananas", "unit": "each"}) == key({"name": "banana", "unit": None})
+    assert key({"name": "Porridge", "unit": "bowls"}) == key({"name": "oatmeal", "unit": "bowl"})
+    assert key({"name": "rice", "unit": "grams"}) != key({"name": "rice", "unit": "cup"})
+
+
+def test_nutrition_cache_skips_zero_quantity():
+    nc = NutritionCache(None)
+    nc.store({"name": "apple", "quantity": 0}, {"calories": 0.0}, None)
+    assert nc.lookup({"name": "apple", "quantity": 1}) is None
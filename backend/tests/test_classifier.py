@@ -0,0 +1,109 @@
+import pytest
+
+import classifier
+from api_stubs import StubServer
+from cache import PersistentLRU
+
+
+@pytest.fixture
+def stub():
+    with StubServer() as server:
+        yield server
+
+
+@pytest.fixture
+def llm(stub, monkeypatch):
+    client = classifier.OpenAI(api_key="stub", base_url=stub.env()["OPENAI_BASE_URL"], max_retries=0)
+    monkeypatch.setattr(classifier, "client", client)
+    return stub
+
+
+@pytest.fixture
+def memo(tmp_path, monkeypatch):
+    """Empty parse memo persisted under tmp_path."""
+    path = str(tmp_path / "parse.json")
+    monkeypatch.setattr(classifier, "PARSE_CACHE_PATH", path)
+    monkeypatch.setattr(classifier, "_parse_memo", None)
+    monkeypatch.setattr(classifier, "PARSE_CACHE_DISABLED", False)
+    return path
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    """Replaces the model with a canned parse; records every request's messages."""
+    calls = []
+
+    def fake_chat_json(messages, schema_hint):
+        calls.append(messages)
+        return {"food": {"items": [{"name": "banana", "quantity": 1, "unit": "count"}]}, "exercise": {"items": []}}
+
+    monkeypatch.setattr(classifier, "_chat_json", fake_chat_json)
+    return calls
+
+
+def test_parse_with_llm_is_memoised(memo, chat):
+    first = classifier.parse_with_llm("I ate a banana")
+    first["food"]["items"].clear()  # callers mutate results; the memo must not change
+    second = classifier.parse_with_llm("  i ate a BANANA. ")
+
+    assert len(chat) == 1
+    assert second["food"]["items"][0]["name"] == "banana"
+    assert classifier.parse_cache_stats()["hits"] == 1
+
+
+def test_parse_memo_is_bypassed_on_request(memo, chat, monkeypatch):
+    classifier.parse_with_llm("I ate a banana")
+    classifier.parse_with_llm("I ate a banana", use_cache=False)
+    monkeypatch.setattr(classifier, "PARSE_CACHE_DISABLED", True)
+    classifier.parse_with_llm("I ate a banana")
+    assert len(chat) == 3
+
+
+def test_parse_memo_persists_and_follows_the_prompt(memo, chat, monkeypatch):
+    classifier.parse_with_llm("I ate a banana")
+    classifier.save_parse_cache()
+    assert len(PersistentLRU(memo)) == 1
+
+    monkeypatch.setattr(classifier, "_parse_memo", None)  # a new process reloads the file
+    classifier.parse_with_llm("I ate a banana")
+    assert len(chat) == 1
+    monkeypatch.setattr(classifier, "PROMPT_VERSION", "test")
+    classifier.parse_with_llm("I ate a banana")
+    assert len(chat) == 2
+    key = classifier.parse_cache_key
+    assert key("I ate a banana") != key("I ate a banana", classifier.PARSE_SYSTEM_PROMPT + " Be terse.")
+
+
+def test_batched_parse_raises_api_errors_without_resplitting(llm):
+    llm.error_rate = 1.0
+
+    with pytest.raises(Exception):
+        classifier.parse_batch_with_llm({str(i): f"log {i}" for i in range(8)}, use_cache=False)
+    assert llm.requests == {"chat": 1}
+
+
+def test_batched_parse_counts_one_memo_lookup_per_record(memo, llm):
+    transcripts = {str(i): f"I ate {i + 2} apples and a mystery dish" for i in range(6)}
+    classifier.parse_batch_with_llm(transcripts)
+    assert classifier.parse_cache_stats()["misses"] == 6
+
+    classifier.parse_batch_with_llm(transcripts)
+    stats = classifier.parse_cache_stats()
+    assert (stats["hits"], stats["misses"]) == (6, 6)
+    assert llm.requests == {"chat": 1}
+
+
+def test_single_record_fallback_is_validated(memo, monkeypatch):
+    def fake_chat_json(messages, schema_hint):
+        if messages[0]["content"] == classifier.BATCH_SYSTEM_PROMPT:
+            return {}  # every id missing: split down to single requests
+        if "bad" in messages[1]["content"]:
+            return {"food": "not a section"}
+        return {"food": {"items": []}, "exercise": {"items": []}}
+
+    monkeypatch.setattr(classifier, "_chat_json", fake_chat_json)
+    results = classifier.parse_batch_with_llm({"a": "good log", "b": "bad log"})
+
+    assert list(results) == ["a"]
+    assert classifier._memo().get(classifier.parse_cache_key("bad log")) is None
+    assert classifier._memo().get(classifier.parse_cache_key("good log")) is not None
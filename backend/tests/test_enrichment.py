@@ -0,0 +1,56 @@
+import pytest
+
+import classifier
+from api_stubs import StubServer
+from calculator import EnrichmentScheduler, NutritionixClient
+from payload import run_batch
+from store import JsonFileStore
+from transport import PooledJsonTransport
+
+
+@pytest.fixture
+def stub():
+    with StubServer() as server:
+        yield server
+
+
+@pytest.fixture
+def nx(stub):
+    transport = PooledJsonTransport(stub.env()["NUTRITIONIX_BASE_URL"], max_retries=0, name="nutritionix")
+    client = NutritionixClient("stub", "stub", transport=transport)
+    yield client
+    client.close()
+
+
+def _food_payload(*names):
+    return {"metadata": {}, "proposed_logs": [
+        {"type": "food", "items": [{"name": n, "quantity": 1, "unit": "count"} for n in names]},
+    ]}
+
+
+def test_failing_chunk_only_affects_its_foods(nx):
+    # max_items=1: one query per food, so the 404 for the unknown food is its own chunk
+    scheduler = EnrichmentScheduler(nx, max_items=1)
+    ok, bad = scheduler.enrich_payloads([(_food_payload("banana"), {}), (_food_payload("unmatchable"), {})])
+
+    assert ok["proposed_logs"][0]["items"][0]["macros"]["calories"] > 0
+    assert bad["proposed_logs"][0]["items"][0]["macros"] is None
+    assert scheduler.stats["failed_requests"] == 1
+
+
+def test_batch_window_survives_a_failing_chunk(nx, tmp_path, monkeypatch):
+    monkeypatch.setattr(classifier, "RULE_CONFIDENCE_THRESHOLD", 0.0)  # rule parses only, no LLM
+    logs = {
+        f"log{i}": {"metadata": {"user_id": "u1", "input_method": "text", "content_preview": text,
+                                 "timestamp": f"2025-01-01T0{i}:00:00Z"}}
+        for i, text in enumerate(["I ate 2 bananas", "I ate 1 unmatchable", "I ate an apple"])
+    }
+    store = JsonFileStore(str(tmp_path / "output_log.json"))
+
+    stats = run_batch(logs, {"u1": {"metadata": {"weight": 70}}}, str(tmp_path), store, workers=2, nx=nx,
+                      max_query_items=1)
+
+    assert stats["done"] == 3 and stats["failed"] == 0
+    macros = {log_id: store.get(log_id)["proposed_logs"][1]["items"][0]["macros"] for log_id in logs}
+    assert macros["log1"] is None
+    assert macros["log0"] and macros["log2"]
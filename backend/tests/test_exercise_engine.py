@@ -0,0 +1,58 @@
+import copy
+import json
+
+from exercise_engine import recompute_changed
+from store import JsonFileStore, JournalStore, ShardedStore
+
+RECORD = {
+    "user_id": "u1",
+    "timestamp": "2025-01-01T08:00:00Z",
+    "proposed_logs": [{"type": "exercise", "items": [
+        # Computed with an older formula/weight: must survive a first run untouched
+        {"activity": "walking", "duration_min": 60, "effort_level": "moderate", "met": 3.5, "calories_burned": 200},
+    ]}],
+}
+
+
+def _stores(tmp_path):
+    return [
+        JsonFileStore(str(tmp_path / "output_log.json")),
+        JournalStore(str(tmp_path / "output_log.jsonl")),
+        ShardedStore(str(tmp_path / "shards")),
+    ]
+
+
+def _calories(store, record_id="a"):
+    return store.get(record_id)["proposed_logs"][0]["items"][0]["calories_burned"]
+
+
+def test_first_run_without_snapshot_only_seeds_it(tmp_path):
+    profiles = {"u1": {"metadata": {"weight": 70}}}
+    for store in _stores(tmp_path):
+        store.put("a", copy.deepcopy(RECORD))
+        store.flush()
+        snapshot = tmp_path / f"{type(store).__name__}.weights.json"
+
+        stats = recompute_changed(store, profiles, str(snapshot))
+
+        assert stats["updated"] == 0
+        assert _calories(store) == 200
+        assert json.loads(snapshot.read_text()) == {"u1": 70.0}
+
+
+def test_weight_change_recomputes_a_copy(tmp_path):
+    for store in _stores(tmp_path):
+        store.put("a", copy.deepcopy(RECORD))
+        store.put("b", {**copy.deepcopy(RECORD), "user_id": "u2"})
+        store.flush()
+        snapshot = str(tmp_path / f"{type(store).__name__}.weights.json")
+        recompute_changed(store, {"u1": {"metadata": {"weight": 70}}, "u2": {"metadata": {"weight": 70}}}, snapshot)
+        held = store.get("a")
+
+        stats = recompute_changed(store, {"u1": {"metadata": {"weight": 80}}, "u2": {"metadata": {"weight": 70}}},
+                                  snapshot)
+
+        assert stats["users"] == 1 and stats["records"] == 1 and stats["updated"] == 1
+        assert _calories(store) == 280.0
+        assert _calories(store, "b") == 200
+        assert held["proposed_logs"][0]["items"][0]["calories_burned"] == 200
@@ -0,0 +1,44 @@
+from fingerprint import FingerprintIndex
+
+
+def _upload_log(log_id, method, file_name, ts="2025-01-01T08:00:00Z", user="u1"):
+    return {"id": log_id, "metadata": {"user_id": user, "input_method": method, "file_name": file_name,
+                                       "content_preview": f"{method} upload", "timestamp": ts}}
+
+
+def _uploads(tmp_path, sub, files):
+    (tmp_path / sub).mkdir(exist_ok=True)
+    for name, data in files.items():
+        (tmp_path / sub / name).write_bytes(data)
+    return str(tmp_path)
+
+
+def _claims(index, logs):
+    return [index.claim(log["id"], log, lambda log_id: True) for log in logs]
+
+
+def test_duplicated_photo_is_detected(tmp_path):
+    uploads = _uploads(tmp_path, "images", {"a.png": b"\x89PNG same", "b.png": b"\x89PNG same",
+                                            "c.png": b"\x89PNG other"})
+    index = FingerprintIndex(None, uploads)
+    logs = [_upload_log("a", "photo", "a.png"), _upload_log("b", "photo", "b.png", ts="2025-01-01T08:00:20Z"),
+            _upload_log("c", "photo", "c.png", ts="2025-01-01T08:00:40Z")]
+
+    assert _claims(index, logs) == [None, "a", None]
+
+
+def test_duplicated_voice_note_is_detected(tmp_path):
+    uploads = _uploads(tmp_path, "audio", {"a.wav": b"RIFF same", "b.wav": b"RIFF same"})
+    index = FingerprintIndex(None, uploads)
+    assert _claims(index, [_upload_log("a", "voice", "a.wav"), _upload_log("b", "voice", "b.wav")]) == [None, "a"]
+
+
+def test_same_text_from_another_user_or_later_is_not_a_duplicate(tmp_path):
+    def text_log(log_id, user, ts):
+        return {"id": log_id, "metadata": {"user_id": user, "input_method": "text", "timestamp": ts,
+                                           "content_preview": "I ate 2 bananas"}}
+
+    index = FingerprintIndex(None, str(tmp_path))
+    logs = [text_log("a", "u1", "2025-01-01T08:00:00Z"), text_log("b", "u1", "2025-01-01T08:01:00Z"),
+            text_log("c", "u2", "2025-01-01T08:00:00Z"), text_log("d", "u1", "2025-01-01T12:00:00Z")]
+    assert _claims(index, logs) == [None, "a", None, None]
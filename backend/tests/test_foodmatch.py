@@ -0,0 +1,45 @@
+from foodmatch import FoodNameIndex, canonical_name, index_for, match_items
+
+
+def _foods(*names):
+    return [{"food_name": n} for n in names]
+
+
+def test_canonical_name_folds_plurals_fillers_and_synonyms():
+    assert canonical_name("Large Bananas") == "banana"
+    assert canonical_name("some fresh cookies") == "cookie"
+    assert canonical_name("Porridge") == "oatmeal"
+    assert canonical_name(None) == ""
+
+
+def test_index_matches_word_order_extra_words_and_typos():
+    index = FoodNameIndex(["oatmeal", "chicken breast", "brown rice"])
+    assert index.best("chicken breast") == (1, 1.0)
+    for query in ("breast of chicken", "grilled chicken breast", "chiken breast"):
+        i, score = index.best(query)
+        assert i == 1 and 0.3 <= score < 1.0
+    assert index.best("brown rise")[0] == 2
+    assert index.best("zzz")[0] is None
+
+
+def test_index_for_reuses_one_index_per_table():
+    assert index_for(("apple", "pear")) is index_for(("apple", "pear"))
+
+
+def test_match_items_pairs_by_name_not_position():
+    items = [{"name": "rice"}, {"name": "chicken"}]
+    foods = _foods("chicken breast", "white rice")
+    assert match_items(items, foods) == [foods[1], foods[0]]
+
+
+def test_match_items_uses_each_food_once():
+    items = [{"name": "apple"}, {"name": "apple"}]
+    foods = _foods("apple", "apples")
+    assert match_items(items, foods) == [foods[0], foods[1]]
+
+
+def test_unmatched_items_take_the_leftover_food_in_query_order():
+    items = [{"name": "banana"}, {"name": "mystery stew"}, {"name": "toast"}]
+    foods = _foods("banana", "beef stew with vegetables", "toast")
+    assert match_items(items, foods) == foods
+    assert match_items([{"name": "banana"}, {"name": "toast"}], []) == [None, None]
@@ -0,0 +1,128 @@
+import os
+import json
+
+import logindex
+from logindex import LogIndex
+from store import ts_epoch
+from payload import pick_latest_log
+
+
+def _log(ts, user="u1"):
+    return {"timestamp": ts, "metadata": {"user_id": user}}
+
+
+def _index(logs):
+    index = LogIndex(os.devnull, persist=False)
+    index.refresh(logs)
+    return index
+
+
+def test_refresh_drops_deleted_ids():
+    logs = {
+        "a": _log("2025-01-01T08:00:00Z"),
+        "b": _log("2025-01-01T09:00:00Z", "u2"),
+        "c": _log("2025-01-01T10:00:00Z"),
+    }
+    index = _index(logs)
+    del logs["c"]  # DELETE /:logId removed it from log.json
+    index.refresh(logs)
+
+    assert pick_latest_log(logs, index) is logs["b"]
+    assert index.latest("u1") == "a"
+    assert index.pending(set()) == ["a", "b"]
+    assert "c" not in index.user_of
+
+
+def test_refresh_drops_last_log_of_a_user():
+    logs = {"a": _log("2025-01-01T08:00:00Z"), "b": _log("2025-01-01T09:00:00Z", "u2")}
+    index = _index(logs)
+    del logs["b"]
+    index.refresh(logs)
+    assert index.latest("u2") is None
+    assert "u2" not in index.by_user
+
+
+def test_fresh_build_is_sorted():
+    logs = {str(i): _log(f"2025-01-01T{i % 24:02d}:{i % 60:02d}:00Z", f"u{i % 3}") for i in range(200)}
+    index = _index(dict(reversed(list(logs.items()))))
+    assert index.entries == sorted(index.entries)
+    for entries in index.by_user.values():
+        assert entries == sorted(entries)
+    assert sum(len(e) for e in index.by_user.values()) == len(logs)
+
+
+def test_late_arrival_behind_cursor_is_pending():
+    logs = {"a": _log("2025-01-01T08:00:00Z"), "b": _log("2025-01-01T10:00:00Z")}
+    index = _index(logs)
+    index.advance({"a", "b"})
+    assert index.pending({"a", "b"}) == []
+    logs["late"] = _log("2025-01-01T09:00:00Z")
+    index.refresh(logs)
+    assert index.pending({"a", "b"}) == ["late"]
+
+
+def _write_logs(path, logs):
+    # The API's layout: JSON.stringify(logs, null, 2), new keys last
+    path.write_text(json.dumps(logs, indent=2), encoding="utf-8")
+
+
+def _persisted(tmp_path, logs):
+    path = tmp_path / "log.json"
+    _write_logs(path, logs)
+    index = LogIndex(str(path))
+    index.refresh()
+    index.save()
+    return path
+
+
+def test_refresh_parses_only_appended_logs(tmp_path, monkeypatch):
+    logs = {str(i): {**_log(f"2025-01-01T0{i}:00:00Z"), "id": str(i)} for i in range(3)}
+    path = _persisted(tmp_path, logs)
+    sidecar = tmp_path / "log.json.idx.json"
+    before = sidecar.read_bytes()
+
+    logs["3"] = {**_log("2025-01-01T05:00:00Z", "u2"), "id": "3", "note": "café"}
+    _write_logs(path, logs)
+    starts = []
+    real_scan = logindex._scan_object
+    monkeypatch.setattr(logindex, "_scan_object", lambda f, start=0: starts.append(start) or real_scan(f, start))
+
+    index = LogIndex(str(path))
+    assert index.refresh() == 1
+    index.save()
+    assert starts and starts[0] > 0
+    assert index.latest() == "3"
+    assert index.load_records(["3"]) == {"3": logs["3"]}
+    # Saving appended the new row and a state line; earlier lines are untouched
+    assert sidecar.read_bytes().startswith(before)
+    assert LogIndex(str(path)).window(user_id="u1") == ["0", "1", "2"]
+
+
+def test_refresh_rescans_after_delete(tmp_path):
+    logs = {str(i): {**_log(f"2025-01-01T0{i}:00:00Z"), "id": str(i)} for i in range(4)}
+    path = _persisted(tmp_path, logs)
+    del logs["1"]
+    logs["4"] = {**_log("2025-01-01T06:00:00Z"), "id": "4"}
+    _write_logs(path, logs)
+
+    index = LogIndex(str(path))
+    assert index.refresh() == 1
+    index.save()
+    reopened = LogIndex(str(path))
+    assert reopened.window() == ["0", "2", "3", "4"]
+    assert reopened.load_records(["2", "4"]) == {"2": logs["2"], "4": logs["4"]}
+
+
+def test_reads_single_document_sidecar(tmp_path):
+    logs = {"a": {**_log("2025-01-01T08:00:00Z"), "id": "a"}, "b": {**_log("2025-01-01T09:00:00Z"), "id": "b"}}
+    path = tmp_path / "log.json"
+    _write_logs(path, logs)
+    sidecar = tmp_path / "log.json.idx.json"
+    sidecar.write_text(json.dumps({"source": [0, 0], "cursor": [ts_epoch("2025-01-01T08:00:00Z"), "a"],
+                                   "entries": [[ts_epoch("2025-01-01T08:00:00Z"), "a", "u1"]]}))
+    index = LogIndex(str(path))
+    assert index.refresh() == 1
+    index.save()
+    reopened = LogIndex(str(path))
+    assert reopened.pending(set()) == ["b"]
+    assert reopened.load_records(["b"]) == {"b": logs["b"]}
@@ -0,0 +1,88 @@
+import json
+import pstats
+import threading
+
+import pytest
+
+from metrics import STAGES, Metrics, profiling
+
+
+def test_spans_record_count_total_and_max():
+    m = Metrics()
+    m.observe("parse", 0.2)
+    m.observe("parse", 0.4)
+    with m.span("enrich"):
+        pass
+
+    stages = m.snapshot()["stages"]
+    assert stages["parse"] == {"count": 2, "total_s": 0.6, "max_s": 0.4, "mean_s": 0.3}
+    assert stages["enrich"]["count"] == 1
+    assert set(STAGES) <= set(stages)  # unused stages are exported as zeros
+    assert "parse 0.60s/2" in m.summary() and "load" not in m.summary()
+
+
+def test_span_records_time_even_when_the_stage_raises():
+    m = Metrics()
+    with pytest.raises(RuntimeError):
+        with m.span("transcribe"):
+            raise RuntimeError("boom")
+    assert m.snapshot()["stages"]["transcribe"]["count"] == 1
+
+
+def test_counters_are_labelled_and_thread_safe():
+    m = Metrics()
+
+    def bump():
+        for _ in range(1000):
+            m.incr("api_calls", api="whisper")
+
+    threads = [threading.Thread(target=bump) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    m.incr("tokens", 30, api="openai_chat", kind="prompt")
+
+    assert m.snapshot()["counters"] == [
+        {"name": "api_calls", "labels": {"api": "whisper"}, "value": 4000},
+        {"name": "tokens", "labels": {"api": "openai_chat", "kind": "prompt"}, "value": 30},
+    ]
+
+
+def test_prometheus_export(tmp_path):
+    m = Metrics()
+    m.observe("parse", 0.5)
+    m.incr("cache_hits", cache="parse")
+    m.incr("cache_hits", cache='we"ird')
+    path = tmp_path / "run.prom"
+    m.export(str(path))
+
+    text = path.read_text()
+    assert 'pipeline_stage_seconds_count{stage="parse"} 1' in text
+    assert 'pipeline_stage_seconds_sum{stage="parse"} 0.5' in text
+    assert text.count("# TYPE pipeline_cache_hits_total counter") == 1
+    assert 'pipeline_cache_hits_total{cache="parse"} 1' in text
+    assert 'pipeline_cache_hits_total{cache="we\\"ird"} 1' in text
+    assert text.endswith("\n")
+
+
+def test_json_export_and_reset(tmp_path):
+    m = Metrics()
+    m.incr("api_calls", api="nutritionix")
+    path = tmp_path / "run.json"
+    m.export(str(path))
+
+    assert json.loads(path.read_text())["counters"][0]["value"] == 1
+    m.reset()
+    assert m.snapshot()["counters"] == []
+
+
+def test_cpu_profiling_writes_stats(tmp_path):
+    out = str(tmp_path / "cpu.prof")
+    with profiling("cpu", out):
+        sum(range(1000))
+    assert pstats.Stats(out).total_calls > 0
+
+    with pytest.raises(ValueError):
+        with profiling("gpu"):
+            pass
@@ -0,0 +1,33 @@
+from calculator import enrich_payload
+from model import Payload
+
+
+def test_null_item_lists_enrich_as_empty():
+    payload = {"metadata": {}, "proposed_logs": [
+        {"type": "exercise", "items": None, "parser_confidence": 0.9},
+        {"type": "food", "items": None, "parser_confidence": 0.9},
+    ]}
+    out = enrich_payload(payload, {"weight": 70})
+    assert out["proposed_logs"][0]["items"] == []
+    assert out["proposed_logs"][1]["items"] == []
+
+
+def test_null_proposed_logs_has_no_logs():
+    assert Payload.from_dict({"proposed_logs": None}).logs == ()
+
+
+def test_odd_scalars_are_coerced():
+    payload = {"proposed_logs": [{"type": "exercise", "parser_confidence": True, "items": [
+        {"activity": "running", "duration_min": "30", "effort_level": 5, "met": "n/a"},
+    ]}]}
+    out = enrich_payload(payload, {"weight": 70})
+    log = out["proposed_logs"][0]
+    assert log["parser_confidence"] == 1
+    assert log["items"][0]["effort_level"] == "5"
+    assert log["items"][0]["calories_burned"] == 343.0
+
+
+def test_well_formed_payload_is_shared_not_copied():
+    payload = {"proposed_logs": [{"type": "food", "items": [{"name": "apple", "quantity": 1, "unit": "count"}]}]}
+    assert Payload.from_dict(payload).to_dict() is payload
+    assert enrich_payload(payload, {})["proposed_logs"][0]["items"][0] is payload["proposed_logs"][0]["items"][0]
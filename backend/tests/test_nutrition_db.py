@@ -0,0 +1,64 @@
+import pytest
+
+from nutrition_db import LocalNutritionDB
+
+ROWS = [
+    {"name": "banana", "aliases": ["bananas"], "unit_g": 118, "serving_g": 118, "slice_g": None,
+     "density_g_per_ml": None, "per_100g": {"calories": 89, "protein_g": 1.1}},
+    {"name": "milk", "unit_g": 244, "serving_g": 244, "slice_g": None, "density_g_per_ml": 1.03,
+     "per_100g": {"calories": 50, "protein_g": 3.3}},
+    {"name": "bread", "unit_g": None, "serving_g": 60, "slice_g": 30, "density_g_per_ml": None,
+     "per_100g": {"calories": 265, "protein_g": 9.0}},
+]
+
+
+@pytest.fixture
+def db():
+    return LocalNutritionDB(ROWS)
+
+
+def _calories(result):
+    return result["macros"]["calories"]
+
+
+def test_resolves_mass_volume_and_portion_units(db):
+    grams, cup, slices = db.resolve_many([
+        {"name": "banana", "quantity": 200, "unit": "grams"},
+        {"name": "milk", "quantity": 1, "unit": "cups"},
+        {"name": "bread", "quantity": 2, "unit": "slices"},
+    ])
+    assert _calories(grams) == 178.0
+    assert _calories(cup) == round(240 * 1.03 * 0.5, 2)
+    assert _calories(slices) == 159.0
+    assert slices["source_ref"] == {"provider": "local", "id": "bread"}
+
+
+def test_count_falls_back_to_serving_weight(db):
+    (bread,) = db.resolve_many([{"name": "bread", "quantity": 1, "unit": "count"}])
+    assert _calories(bread) == 159.0
+
+
+def test_unknown_food_or_unconvertible_unit_is_a_miss(db):
+    assert db.resolve_many([
+        {"name": "dragon fruit", "quantity": 1, "unit": "count"},
+        {"name": "banana", "quantity": 1, "unit": "cup"},  # no density for banana
+    ]) == [None, None]
+
+
+def test_names_match_after_canonicalisation(db):
+    (hit,) = db.resolve_many([{"name": "Large Bananas", "quantity": 2, "unit": "each"}])
+    assert _calories(hit) == round(2 * 118 * 0.89, 2)
+    assert hit["name"] == "Large Bananas"
+
+
+def test_bundled_table_loads():
+    db = LocalNutritionDB.load()
+    assert len(db) > 0
+    assert db.row_for("bananas") is not None
+
+
+def test_explicit_zero_quantity_is_kept(db):
+    zero, missing = db.resolve_many([{"name": "banana", "quantity": 0, "unit": "count"},
+                                     {"name": "banana", "quantity": None, "unit": "count"}])
+    assert _calories(zero) == 0.0
+    assert _calories(missing) == round(118 * 0.89, 2)
@@ -0,0 +1,34 @@
+import classifier
+from payload import pending_log_ids, run_batch
+from store import JsonFileStore
+
+
+def _text_log(text, ts, user="u1"):
+    return {"timestamp": ts, "metadata": {"user_id": user, "input_method": "text", "content_preview": text,
+                                          "timestamp": ts}}
+
+
+def test_pending_log_ids_skips_done_and_orders_oldest_first():
+    logs = {
+        "new": _text_log("I ate an apple", "2025-01-03T08:00:00Z"),
+        "old": _text_log("I ate an apple", "2025-01-01T08:00:00.500Z"),
+        "done": _text_log("I ate an apple", "2025-01-02T08:00:00Z"),
+    }
+    assert pending_log_ids(logs, {"done": {}}) == ["old", "new"]
+
+
+def test_batch_processes_every_unprocessed_log(tmp_path, monkeypatch):
+    monkeypatch.setattr(classifier, "RULE_CONFIDENCE_THRESHOLD", 0.0)  # rule parses only, no LLM
+    logs = {f"log{i}": _text_log("I ate 2 bananas", f"2025-01-01T0{i}:00:00Z") for i in range(5)}
+    store = JsonFileStore(str(tmp_path / "output_log.json"))
+    store.put("log0", {"kept": True})
+    store.flush()
+
+    stats = run_batch(logs, {"u1": {"metadata": {"weight": 70}}}, str(tmp_path), store, workers=2,
+                      checkpoint_every=2)
+
+    assert stats == {"pending": 4, "done": 4, "failed": 0, "linked": 0}
+    reopened = JsonFileStore(str(tmp_path / "output_log.json"))
+    assert sorted(reopened.ids()) == [f"log{i}" for i in range(5)]
+    assert reopened.get("log0") == {"kept": True}
+    assert reopened.get("log3")["proposed_logs"][1]["items"][0]["name"]
@@ -0,0 +1,138 @@
+import pytest
+
+from rollups import Rollups, buckets, contribution
+from store import JournalStore
+
+
+def _payload(user="u1", ts="2025-09-06T08:00:00Z", calories=100.0, burned=0.0, minutes=0.0, **extra):
+    return {
+        "user_id": user, "timestamp": ts, **extra,
+        "proposed_logs": [
+            {"type": "exercise", "items": [{"activity": "walk", "duration_min": minutes, "calories_burned": burned}]},
+            {"type": "food", "items": [{"name": "banana", "macros": {"calories": calories, "protein_g": 1.0}}]},
+        ],
+    }
+
+
+def test_buckets_are_utc_day_and_iso_week():
+    assert buckets("2025-09-06T23:30:00-02:00") == ("2025-09-07", "2025-W36")
+    assert buckets("2024-12-30T08:00:00Z") == ("2024-12-30", "2025-W01")
+
+
+def test_contribution_sums_food_and_exercise():
+    c = contribution(_payload(calories=150, burned=80, minutes=20))
+    assert (c["calories_in"], c["protein_g"], c["calories_out"], c["exercise_min"], c["records"]) == (
+        150, 1, 80, 20, 1)
+    assert contribution(_payload(duplicate_of="x"))["records"] == 0
+
+
+def test_reprocessed_record_replaces_its_contribution():
+    r = Rollups()
+    r.apply("a", _payload(calories=100))
+    r.apply("b", _payload(calories=50, ts="2025-09-07T08:00:00Z"))
+    r.apply("a", _payload(calories=300))
+
+    assert [row["calories_in"] for row in r.series("u1")] == [300, 50]
+    assert r.series("u1", by="week")[0]["calories_in"] == 350
+    r.retract("b")
+    assert [row["period"] for row in r.series("u1")] == ["2025-09-06"]
+
+
+def test_series_and_summary_ranges():
+    r = Rollups()
+    for i, day in enumerate(["2025-09-01", "2025-09-05", "2025-09-09"]):
+        r.apply(str(i), _payload(ts=f"{day}T12:00:00Z", calories=10 * (i + 1)))
+    r.apply("other", _payload(user="u2", calories=999))
+
+    assert [row["period"] for row in r.series("u1", "2025-09-02", "2025-09-09")] == ["2025-09-05"]
+    assert r.summary("u1", "2025-09-01", "2025-09-06")["calories_in"] == 30
+    assert r.summary("u2")["records"] == 1
+
+
+def test_attached_rollups_follow_store_writes_and_reload(tmp_path):
+    path = str(tmp_path / "out.rollups.json")
+    store = JournalStore(str(tmp_path / "out.jsonl"))
+    rollups = Rollups.attach(store, path)
+    store.put("a", _payload(calories=120))
+    store.put("b", _payload(calories=30))
+    store.delete("b")
+    store.flush()
+
+    assert rollups.summary("u1")["calories_in"] == 120
+    assert Rollups(path).summary("u1")["calories_in"] == 120
+    store.close()
+
+
+def test_attach_rebuilds_when_out_of_step(tmp_path):
+    store = JournalStore(str(tmp_path / "out.jsonl"))
+    store.put("a", _payload(calories=120))  # written before any rollups existed
+    store.flush()
+
+    rollups = Rollups.attach(store, str(tmp_path / "out.rollups.json"))
+    assert rollups.summary("u1")["calories_in"] == pytest.approx(120)
+    store.close()
+
+
+def test_flush_appends_deltas_instead_of_rewriting_the_snapshot(tmp_path):
+    path = tmp_path / "out.rollups.json"
+    store = JournalStore(str(tmp_path / "out.jsonl"))
+    for i in range(50):
+        store.put(str(i), _payload(calories=1))
+    store.flush()
+    Rollups.attach(store, str(path)).save()  # rebuilt: writes the snapshot
+    snapshot = path.read_bytes()
+
+    store.put("new", _payload(calories=5))
+    store.flush()
+
+    assert path.read_bytes() == snapshot
+    assert (tmp_path / "out.rollups.json.deltas").read_text().count("\n") == 1
+    assert Rollups(str(path)).summary("u1")["calories_in"] == 55
+    store.close()
+
+
+def test_records_without_user_do_not_force_a_rebuild(tmp_path, monkeypatch):
+    path = str(tmp_path / "out.rollups.json")
+    store = JournalStore(str(tmp_path / "out.jsonl"))
+    store.put("anon", {"timestamp": "2025-09-06T08:00:00Z", "proposed_logs": []})
+    store.put("a", _payload())
+    store.flush()
+    Rollups.attach(store, path)
+
+    def no_rebuild(self, store):
+        raise AssertionError("rollups rebuilt although in step with the store")
+
+    monkeypatch.setattr(Rollups, "rebuild", no_rebuild)
+    assert Rollups.attach(store, path).summary("u1")["records"] == 1
+    store.close()
+
+
+def test_deltas_are_compacted_into_the_snapshot(tmp_path):
+    path = str(tmp_path / "out.rollups.json")
+    rollups = Rollups(path, compact_min_bytes=0)
+    rollups.apply("a", _payload(calories=10))
+    rollups.apply("b", _payload(user="u2", calories=7))
+    rollups.save()  # delta file outgrows the (missing) snapshot: folded in
+    assert (tmp_path / "out.rollups.json.deltas").read_text() == ""
+    assert Rollups(path).summary("u2")["calories_in"] == 7
+
+    rollups.apply("a", _payload(calories=20))
+    rollups.retract("b")
+    rollups.save()  # smaller than the snapshot now: appended
+    assert (tmp_path / "out.rollups.json.deltas").read_text().count("\n") == 2
+    reloaded = Rollups(path)
+    assert reloaded.summary("u1")["calories_in"] == 20
+    assert reloaded.series("u2") == [] and set(reloaded.records) == {"a"}
+
+
+def test_replaying_deltas_twice_changes_nothing(tmp_path):
+    path = str(tmp_path / "out.rollups.json")
+    rollups = Rollups(path)
+    rollups.apply("a", _payload(calories=10))
+    rollups.apply("b", _payload(calories=3))
+    rollups.retract("b")
+    rollups.save()
+    deltas = tmp_path / "out.rollups.json.deltas"
+    deltas.write_text(deltas.read_text() * 2 + '["c", [')  # replayed again, then a torn line
+
+    assert Rollups(path).summary("u1") == rollups.summary("u1")
@@ -0,0 +1,25 @@
+from classifier import RULE_CONFIDENCE_THRESHOLD
+from rule_parser import parse_with_rules
+
+
+def test_exercise_does_not_swallow_food_in_same_clause():
+    parsed, confidence = parse_with_rules("I ate a banana 30 minutes before running 5 miles")
+    assert confidence < RULE_CONFIDENCE_THRESHOLD  # left to the LLM
+    assert [it["activity"] for it in parsed["exercise"]["items"]] == ["running"]
+
+
+def test_article_after_quantity_word_is_dropped():
+    parsed, _ = parse_with_rules("I ate half a pizza")
+    assert parsed["food"]["items"] == [{"name": "pizza", "quantity": 0.5, "unit": "count"}]
+
+
+def test_plain_logs_stay_on_the_fast_path():
+    parsed, confidence = parse_with_rules("Had a bowl of oatmeal with 1 cup milk, then walked for 20 minutes")
+    assert confidence >= RULE_CONFIDENCE_THRESHOLD
+    assert [it["name"] for it in parsed["food"]["items"]] == ["oatmeal", "milk"]
+    assert parsed["exercise"]["items"] == [{"activity": "walking", "duration_min": 20.0, "effort_level": "moderate"}]
+
+
+def test_unexplained_words_next_to_exercise_lower_confidence():
+    _, confidence = parse_with_rules("ran 30 minutes on the treadmill at the gym")
+    assert confidence < RULE_CONFIDENCE_THRESHOLD
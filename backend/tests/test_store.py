@@ -0,0 +1,107 @@
+import json
+import multiprocessing
+
+import pytest
+
+from store import JournalStore, JsonFileStore, ShardedStore
+
+
+def _record(i, user="u1"):
+    return {"user_id": user, "timestamp": f"2025-01-0{1 + i % 3}T08:00:00Z", "v": i}
+
+
+def test_journal_skips_corrupt_line_in_the_middle(tmp_path):
+    path = str(tmp_path / "j.jsonl")
+    journal = JournalStore(path)
+    for i in range(4):
+        journal.put(str(i), _record(i))
+    journal.close()
+    with open(path, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+    lines[1] = "{not json\n"
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(lines)
+
+    journal = JournalStore(path)
+    assert sorted(journal.ids()) == ["0", "2", "3"]
+    assert journal.get("3")["v"] == 3
+    journal.close()
+
+
+def test_journal_truncates_torn_tail(tmp_path):
+    path = str(tmp_path / "j.jsonl")
+    journal = JournalStore(path)
+    journal.put("0", _record(0))
+    journal.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"id": "1", "rec')
+
+    journal = JournalStore(path)
+    journal.put("2", _record(2))
+    journal.close()
+    assert sorted(JournalStore(path).ids()) == ["0", "2"]
+
+
+@pytest.mark.parametrize("make", [
+    lambda tmp: JsonFileStore(str(tmp / "output_log.json")),
+    lambda tmp: ShardedStore(str(tmp / "shards")),
+])
+def test_two_writers_keep_each_others_records(tmp_path, make):
+    first, second = make(tmp_path), make(tmp_path)
+    first.put("a", _record(0))
+    second.put("b", _record(1))
+    first.flush()
+    second.flush()
+    assert {"a", "b"} <= set(make(tmp_path).ids())
+    assert "a" in second
+
+
+def _write_many(root, worker):
+    store = ShardedStore(root)
+    for i in range(30):
+        store.put(f"{worker}-{i}", _record(i, f"u{i % 2}"))
+        if i % 5 == 4:
+            store.flush()
+    store.close()
+
+
+def test_sharded_store_concurrent_processes(tmp_path):
+    root = str(tmp_path / "shards")
+    procs = [multiprocessing.Process(target=_write_many, args=(root, w)) for w in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert len(ShardedStore(root)) == 120
+
+
+def test_sharded_store_exports_legacy_file(tmp_path):
+    legacy = tmp_path / "output_log.json"
+    store = ShardedStore(str(tmp_path / "shards"), legacy_path=str(legacy), export_legacy=True)
+    store.put("a", _record(0))
+    store.put("b", _record(1, "u2"))
+    store.close()
+    assert sorted(json.loads(legacy.read_text())) == ["a", "b"]
+
+
+def test_stores_do_not_export_legacy_file_by_default(tmp_path):
+    legacy = tmp_path / "output_log.json"
+    legacy.write_text(json.dumps({"old": _record(0)}))
+    for store in (ShardedStore(str(tmp_path / "shards"), legacy_path=str(legacy)),
+                  JournalStore(str(tmp_path / "out.jsonl"), legacy_path=str(legacy))):
+        assert "old" in store
+        store.put("a", _record(1))
+        store.close()
+    assert list(json.loads(legacy.read_text())) == ["old"]
+
+
+def test_journal_legacy_export_waits_for_interval(tmp_path):
+    legacy = tmp_path / "output_log.json"
+    store = JournalStore(str(tmp_path / "out.jsonl"), legacy_path=str(legacy), export_legacy=True,
+                         legacy_interval=3600)
+    store.put("a", _record(0))
+    store.flush()
+    assert not legacy.exists()
+    store.put("b", _record(1))
+    store.close()
+    assert sorted(json.loads(legacy.read_text())) == ["a", "b"]
@@ -0,0 +1,147 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import transcription
+from audio_prep import TARGET_RATE, encode_wav, split_at_silence
+from cache import PersistentLRU
+from transcription import TranscriptionService, dedupe_overlap, iter_transcribe_chunks
+
+
+def _speech_with_gaps(seconds, gap_every_s=7.0, rate=TARGET_RATE):
+    """Tone with a 0.3 s silent gap every `gap_every_s` seconds."""
+    t = np.arange(int(seconds * rate)) / rate
+    x = (0.5 * np.sin(2 * np.pi * 300 * t)).astype(np.float32)
+    for start in np.arange(gap_every_s, seconds, gap_every_s):
+        x[int(start * rate):int((start + 0.3) * rate)] = 0.0
+    return x
+
+
+def test_split_at_silence_cuts_in_gaps_and_overlaps():
+    x = _speech_with_gaps(100)
+    spans = split_at_silence(x, TARGET_RATE, chunk_s=30, search_s=5, overlap_s=1)
+
+    assert spans[0][0] == 0 and spans[-1][1] == len(x)
+    assert len(spans) == 4
+    for (a0, b0), (a1, b1) in zip(spans, spans[1:]):
+        assert b0 - a1 == 2 * TARGET_RATE  # one second of overlap on each side of the cut
+        cut = (b0 + a1) // 2
+        assert x[cut - 10:cut + 10].max() == 0.0  # inside a silent gap
+    assert all(b - a <= (30 + 2) * TARGET_RATE for a, b in spans)
+
+
+def test_short_audio_is_one_span():
+    x = _speech_with_gaps(20)
+    assert split_at_silence(x, TARGET_RATE, chunk_s=30) == [(0, len(x))]
+
+
+@pytest.mark.parametrize("previous, text, expected", [
+    ("I had two eggs and", "eggs and a slice of toast.", "a slice of toast."),
+    ("then I walked the dog", "The dog, for twenty minutes", "for twenty minutes"),
+    ("nothing shared here", "  Completely new words ", "Completely new words"),
+    ("repeat repeat", "repeat repeat", ""),
+])
+def test_dedupe_overlap(previous, text, expected):
+    assert dedupe_overlap(previous, text) == expected
+
+
+class CountingGate:
+    """Semaphore that records how often it was entered and how many holders it had at once."""
+
+    def __init__(self, limit):
+        self._slots = threading.BoundedSemaphore(limit)
+        self.entries = 0
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._slots.acquire()
+        with self._lock:
+            self.entries += 1
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self.active -= 1
+        self._slots.release()
+
+
+def test_chunks_are_transcribed_in_order_without_overlap_repeats(monkeypatch):
+    words = [f"w{i}" for i in range(40)]
+
+    def fake_whisper_call(client, upload):
+        i = int(upload[0].split(".")[-2])  # "<base>.<chunk>.wav"
+        time.sleep(0.01)
+        return " ".join(words[max(0, 10 * i - 2):10 * i + 10])  # each chunk repeats 2 words of the last
+
+    monkeypatch.setattr(transcription, "_client_for", lambda api_key: None)
+    monkeypatch.setattr(transcription, "_whisper_call", fake_whisper_call)
+    gate = CountingGate(2)
+
+    pieces = list(iter_transcribe_chunks("/tmp/long.wav", "key", samples=_speech_with_gaps(100), max_workers=4,
+                                         chunk_s=30, overlap_s=1, gate=gate))
+
+    assert " ".join(pieces) == " ".join(words)
+    # The caller's limit is taken per chunk request and holds across the chunk pool
+    assert gate.entries == len(pieces) == 4
+    assert gate.peak == 2
+
+
+def test_silent_samples_are_rejected(monkeypatch):
+    monkeypatch.setattr(transcription, "_client_for", lambda api_key: None)
+    with pytest.raises(transcription.AudioError):
+        list(iter_transcribe_chunks("/tmp/long.wav", "key", samples=np.zeros(0, dtype=np.float32)))
+
+
+@pytest.fixture
+def whisper(monkeypatch):
+    """Stands in for the Whisper request; records upload names."""
+    uploads = []
+
+    def fake_whisper_call(client, upload):
+        uploads.append(upload[0])
+        return f"transcript {len(uploads)}"
+
+    monkeypatch.setattr(transcription, "_whisper_call", fake_whisper_call)
+    return uploads
+
+
+def _recording(tmp_path, name, hz):
+    t = np.arange(TARGET_RATE) / TARGET_RATE
+    path = tmp_path / name
+    path.write_bytes(encode_wav((0.5 * np.sin(2 * np.pi * hz * t)).astype(np.float32), TARGET_RATE))
+    return str(path)
+
+
+def test_same_audio_is_transcribed_once(tmp_path, whisper):
+    service = TranscriptionService("key", cache=PersistentLRU(None))
+    first = _recording(tmp_path, "a.wav", 300)
+    copy = tmp_path / "copy-of-a.wav"
+    copy.write_bytes(open(first, "rb").read())
+
+    assert service.transcribe(first) == service.transcribe(str(copy)) == "transcript 1"
+    assert service.transcribe(_recording(tmp_path, "b.wav", 500)) == "transcript 2"
+    assert len(whisper) == 2
+    assert service.cache.stats()["hits"] == 1
+
+
+def test_transcript_cache_persists_and_can_be_bypassed(tmp_path, whisper):
+    path = str(tmp_path / "transcripts.json")
+    audio = _recording(tmp_path, "a.wav", 300)
+    service = TranscriptionService("key", cache=PersistentLRU(path))
+    service.transcribe(audio)
+    service.save()
+
+    assert TranscriptionService("key", cache=PersistentLRU(path)).transcribe(audio) == "transcript 1"
+    TranscriptionService("key", use_cache=False).transcribe(audio)
+    assert len(whisper) == 2
+
+
+def test_cache_key_names_the_model_and_clients_are_reused():
+    assert TranscriptionService.cache_key("abc") == f"{transcription.WHISPER_MODEL}:abc"
+    assert transcription._client_for("key") is transcription._client_for("key")
+    assert TranscriptionService("key", use_cache=False).client is TranscriptionService("key", use_cache=False).client
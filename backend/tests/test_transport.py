@@ -0,0 +1,77 @@
+import socket
+
+import pytest
+import requests
+
+import transport
+from api_stubs import StubServer
+from transport import PooledJsonTransport, TransportError
+
+
+@pytest.fixture
+def stub():
+    with StubServer() as server:
+        yield server
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    """Backoff sleeps, recorded instead of slept; jitter always draws its upper bound."""
+    slept = []
+    monkeypatch.setattr(transport.time, "sleep", slept.append)
+    monkeypatch.setattr(transport.random, "uniform", lambda low, high: high)
+    return slept
+
+
+def _transport(url, **kwargs):
+    return PooledJsonTransport(url, backoff_base=0.5, backoff_cap=8.0, name="test", **kwargs)
+
+
+def test_retries_429_and_5xx_with_exponential_backoff(stub, delays):
+    stub.fail_next(429, 503, 500)
+    t = _transport(stub.env()["NUTRITIONIX_BASE_URL"], max_retries=4)
+
+    assert t.post_json({"query": "1 banana"})["foods"]
+    assert stub.requests == {"nutrients": 4}
+    assert t.stats == {"requests": 4, "retries": 3, "failures": 0}
+    assert delays == [0.5, 1.0, 2.0]
+
+
+def test_retry_after_is_honoured_and_capped(stub, delays):
+    stub.fail_next(429, retry_after=3)
+    stub.fail_next(503, retry_after=60)
+    t = _transport(stub.env()["NUTRITIONIX_BASE_URL"])
+
+    t.post_json({"query": "1 banana"})
+    assert delays == [3.0, 8.0]
+
+
+def test_gives_up_after_max_retries(stub, delays):
+    stub.fail_next(*[502] * 5)
+    t = _transport(stub.env()["NUTRITIONIX_BASE_URL"], max_retries=2)
+
+    with pytest.raises(TransportError, match="after 3 attempts"):
+        t.post_json({"query": "1 banana"})
+    assert stub.requests == {"nutrients": 3}
+    assert t.stats == {"requests": 3, "retries": 2, "failures": 1}
+    assert delays == [0.5, 1.0]
+
+
+def test_client_errors_are_not_retried(stub, delays):
+    t = _transport(stub.env()["NUTRITIONIX_BASE_URL"])
+
+    with pytest.raises(requests.HTTPError):
+        t.post_json({"query": "1 unmatchable"})  # the stub's 404
+    assert stub.requests == {"nutrients": 1}
+    assert delays == []
+
+
+def test_connection_errors_are_retried(delays):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]  # nothing listens here once closed
+    t = _transport(f"http://127.0.0.1:{port}/v2/natural/nutrients", max_retries=1)
+
+    with pytest.raises(TransportError):
+        t.post_json({"query": "1 banana"})
+    assert t.stats["retries"] == 1 and len(delays) == 1
@@ -0,0 +1,92 @@
+import json
+import os
+import threading
+import time
+
+import classifier
+from worker import PipelineWorker, spool_log_ids
+
+
+def _write(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    return str(path)
+
+
+def test_worker_spool_and_duplicates_survive_shutdown(tmp_path, monkeypatch):
+    monkeypatch.setattr(classifier, "RULE_CONFIDENCE_THRESHOLD", 0.0)  # rule parses only, no LLM
+    monkeypatch.delenv("NUTRITIONIX_APP_ID", raising=False)
+    texts = ["I ate 2 bananas", "I ate 2 bananas", "I walked for 20 minutes", "I walked for 20 minutes"]
+    logs = {
+        f"log{i}": {"metadata": {"user_id": "u1", "input_method": "text", "content_preview": text,
+                                 "timestamp": f"2025-01-01T08:00:0{i}Z"}}
+        for i, text in enumerate(texts)
+    }
+    logs_path = _write(tmp_path / "log.json", logs)
+    profiles_path = _write(tmp_path / "profile.json", {"u1": {"metadata": {"weight": 70}}})
+    spool = tmp_path / "spool"
+    spool.mkdir()
+    (spool / ".queued.ids.tmp").write_text("log0\n")  # producer still writing: must be left alone
+
+    worker = PipelineWorker(logs_path, profiles_path, str(tmp_path), str(tmp_path / "output_log.json"), str(spool),
+                            workers=4, poll_interval=0.01, flush_interval=0.0)
+    spool_log_ids(str(spool), list(logs))
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    time.sleep(0.05)
+    worker.stop()
+    thread.join(timeout=30)
+
+    with open(tmp_path / "output_log.json", "r", encoding="utf-8") as f:
+        output = json.load(f)
+    queued = [name for name in os.listdir(spool) if not name.startswith(".")]
+    # Every id is either stored or handed back to the spool, never dropped
+    assert set(output) | set(_spooled_ids(spool, queued)) == set(logs)
+    assert worker.stats["processed"] + worker.stats["linked"] == len(output)
+    assert worker.stats["failed"] == 0
+    assert os.path.exists(spool / ".queued.ids.tmp")
+
+
+def _spooled_ids(spool, names):
+    ids = []
+    for name in names:
+        ids.extend(line.strip() for line in (spool / name).read_text().splitlines() if line.strip())
+    return ids
+
+
+def _text_worker(tmp_path, monkeypatch, **kwargs):
+    monkeypatch.setattr(classifier, "RULE_CONFIDENCE_THRESHOLD", 0.0)
+    monkeypatch.delenv("NUTRITIONIX_APP_ID", raising=False)
+    logs = {f"log{i}": {"metadata": {"user_id": "u1", "input_method": "text", "content_preview": f"I ate {i + 1} bananas",
+                                     "timestamp": f"2025-01-01T08:00:0{i}Z"}} for i in range(3)}
+    logs_path = _write(tmp_path / "log.json", logs)
+    profiles_path = _write(tmp_path / "profile.json", {"u1": {"metadata": {"weight": 70}}})
+    spool = tmp_path / "spool"
+    spool.mkdir(exist_ok=True)
+    worker = PipelineWorker(logs_path, profiles_path, str(tmp_path), str(tmp_path / "output_log.json"), str(spool),
+                            workers=2, poll_interval=0.01, **kwargs)
+    return worker, logs, spool
+
+
+def test_claimed_spool_file_is_kept_until_flush(tmp_path, monkeypatch):
+    worker, logs, spool = _text_worker(tmp_path, monkeypatch, checkpoint_every=0, flush_interval=3600)
+    spool_log_ids(str(spool), list(logs), name="batch.ids")
+    for log_id in worker._claim_spool():
+        worker.submit(log_id)
+    worker.pool.shutdown(wait=True)
+
+    assert worker.stats["processed"] == len(logs)
+    assert os.listdir(spool) == [f"batch.ids.{os.getpid()}.claimed"]  # stored, not yet flushed
+    worker.flush()
+    assert os.listdir(spool) == []
+    assert set(json.loads((tmp_path / "output_log.json").read_text())) == set(logs)
+
+
+def test_claims_of_a_dead_worker_are_requeued(tmp_path, monkeypatch):
+    spool = tmp_path / "spool"
+    spool.mkdir()
+    (spool / "batch.ids.999999999.claimed").write_text("log0\nlog2\n")
+    worker, logs, spool = _text_worker(tmp_path, monkeypatch)
+    assert os.listdir(spool) == ["batch.ids"]
+    assert sorted(worker._claim_spool()) == ["log0", "log2"]
+    worker.pool.shutdown(wait=True)